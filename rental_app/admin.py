@@ -1,7 +1,11 @@
 # rental_app/admin.py
 
+from django import forms
 from django.contrib import admin
-from .models import Tenant, Property, Contract, Fee, Payment
+from django.db.models import Sum
+from rest_framework.exceptions import ValidationError
+from .models import Tenant, Property, Contract, Fee, Payment, NotificationRun
+from .services import check_payment, post_payment
 
 @admin.register(Tenant)
 class TenantAdmin(admin.ModelAdmin):
@@ -22,10 +26,40 @@ class ContractAdmin(admin.ModelAdmin):
 
 @admin.register(Fee)
 class FeeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'contract', 'category', 'amount', 'term', 'is_collected', 'overdue_status')
+    list_display = ('id', 'contract', 'category', 'amount', 'term', 'due_date', 'is_collected', 'overdue_status')
     search_fields = ('contract__id', 'category', 'term')
 
+class PaymentAdminForm(forms.ModelForm):
+    class Meta:
+        model = Payment
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        fee = cleaned_data.get('fee')
+        amount = cleaned_data.get('amount')
+        if self.instance.pk is None and fee is not None and amount is not None:
+            # 提前给出表单错误，保存时 post_payment 会在锁定费用后再校验一次
+            paid_amount = fee.payments.aggregate(total=Sum('amount'))['total'] or 0
+            try:
+                check_payment(fee, amount, paid_amount)
+            except ValidationError as e:
+                raise forms.ValidationError([str(message) for message in e.detail.values()])
+        return cleaned_data
+
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
-    list_display = ('id', 'fee', 'payment_date', 'amount', 'payment_method')
-    search_fields = ('fee__id', 'payment_method')
\ No newline at end of file
+    form = PaymentAdminForm
+    list_display = ('id', 'fee', 'payment_date', 'amount', 'payment_method', 'receipt_status')
+    search_fields = ('fee__id', 'payment_method')
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            super().save_model(request, obj, form, change)
+        else:
+            post_payment(obj)
+@admin.register(NotificationRun)
+class NotificationRunAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'run_date', 'status', 'chunks_done', 'chunks_total', 'tenants', 'sent', 'failed', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = [field.name for field in NotificationRun._meta.fields]
@@ -0,0 +1,86 @@
+# rental_app/analytics.py
+
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .models import Fee, Payment, Property
+from .periods import month_range
+
+KPI_CACHE_KEY = 'rental_app:kpi_snapshot'
+ZERO = Decimal('0.00')
+
+
+def compute_financial_kpis():
+    """一次条件聚合得到应收、逾期及本月计费、本月到期金额，支付总额作为不相关子查询并入同一条语句"""
+    month_start, next_month = month_range(timezone.localdate())
+    received_total = (
+        Payment.objects.order_by()
+        .values(group=Value(1))
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    totals = Fee.objects.aggregate(
+        receivable_amount=Coalesce(Sum('amount', filter=Q(is_collected=False)), Value(ZERO)),
+        overdue_amount=Coalesce(
+            Sum('amount', filter=Q(overdue_status='overdue', is_collected=False)), Value(ZERO)),
+        billed_this_month=Coalesce(
+            Sum('amount', filter=Q(period_start__gte=month_start, period_start__lt=next_month)), Value(ZERO)),
+        due_this_month=Coalesce(
+            Sum('amount', filter=Q(due_date__gte=month_start, due_date__lt=next_month, is_collected=False)),
+            Value(ZERO)),
+        # 子查询与费用表无关，PostgreSQL 只计算一次
+        received_amount=Coalesce(Max(Subquery(received_total)), Value(ZERO)),
+    )
+    receivable_amount = totals['receivable_amount']
+    received_amount = totals['received_amount']
+    collection_rate = (received_amount / receivable_amount) * 100 if receivable_amount else 0
+    return {
+        'receivable_amount': receivable_amount,
+        'received_amount': received_amount,
+        'overdue_amount': totals['overdue_amount'],
+        'billed_this_month': totals['billed_this_month'],
+        'due_this_month': totals['due_this_month'],
+        'collection_rate': collection_rate,
+    }
+
+
+def compute_property_kpis():
+    """一次条件聚合得到总面积、已租面积和可租房源数"""
+    totals = Property.objects.aggregate(
+        total_area=Coalesce(Sum('area'), Value(ZERO)),
+        rented_area=Coalesce(Sum('area', filter=Q(rental_status='rented')), Value(ZERO)),
+        available_properties=Count('id', filter=Q(rental_status='available')),
+    )
+    total_area = totals['total_area']
+    rented_area = totals['rented_area']
+    rental_rate = (rented_area / total_area) * 100 if total_area else 0
+    return {
+        'total_area': total_area,
+        'rented_area': rented_area,
+        'available_properties': totals['available_properties'],
+        'rental_rate': rental_rate,
+    }
+
+
+def compute_kpis():
+    return {
+        'financial': compute_financial_kpis(),
+        'property': compute_property_kpis(),
+        'generated_at': timezone.now(),
+    }
+
+
+def get_kpi_snapshot():
+    """返回缓存的 KPI 快照；缓存失效或超过 KPI_SNAPSHOT_MAX_AGE 秒后重新计算"""
+    snapshot = cache.get(KPI_CACHE_KEY)
+    if snapshot is None:
+        snapshot = compute_kpis()
+        cache.set(KPI_CACHE_KEY, snapshot, getattr(settings, 'KPI_SNAPSHOT_MAX_AGE', 60))
+    return snapshot
+
+
+def invalidate_kpi_snapshot():
+    cache.delete(KPI_CACHE_KEY)
@@ -0,0 +1,80 @@
+# rental_app/availability.py
+
+from django.db import IntegrityError, connection
+from django.db.backends.postgresql.psycopg_any import DateRange
+from .models import Contract, ContractProperty, Property
+
+LEASE_CONSTRAINT = 'exclude_overlapping_leases'
+
+# 把合同的起止日期和状态同步到关联行，已一致的行不重复写入；起止日期颠倒的合同不写租期
+SYNC_LEASES_SQL = """
+UPDATE {contract_properties} cp
+SET period = lease.period, active = lease.active
+FROM (
+    SELECT id,
+           CASE WHEN start_date <= end_date THEN daterange(start_date, end_date, '[]') END AS period,
+           status = 'active' AS active
+    FROM {contract}
+    WHERE id = ANY(%s)
+) lease
+WHERE cp.contract_id = lease.id
+  AND (cp.period IS DISTINCT FROM lease.period OR cp.active IS DISTINCT FROM lease.active)
+"""
+
+
+def sync_lease_periods(contract_ids):
+    """
+    合同关联房源、修改起止日期或状态后调用，用一条 UPDATE 同步关联行的租期。
+    与同一房源其他有效合同的租期重叠时由排他约束抛出 IntegrityError，见 is_lease_conflict
+    """
+    contract_ids = list(contract_ids)
+    if not contract_ids:
+        return 0
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            SYNC_LEASES_SQL.format(
+                contract_properties=quote(ContractProperty._meta.db_table),
+                contract=quote(Contract._meta.db_table),
+            ),
+            [contract_ids],
+        )
+        return cursor.rowcount
+
+
+def is_lease_conflict(exc):
+    """IntegrityError 是否由同一房源租期重叠引起"""
+    return isinstance(exc, IntegrityError) and LEASE_CONSTRAINT in str(exc)
+
+
+def lease_range(start, end):
+    """闭区间 [start, end] 对应的日期范围"""
+    return DateRange(start, end, '[]')
+
+
+def lease_overlaps(period, start, end):
+    """
+    租期是否与闭区间 [start, end] 重叠，与排他约束的 && 一致。
+    period 可以是从数据库读出的（规范化为左闭右开），也可以是 lease_range 构造的闭区间
+    """
+    starts_before_end = period.lower is None or period.lower < end or (period.lower_inc and period.lower == end)
+    ends_after_start = period.upper is None or start < period.upper or (period.upper_inc and start == period.upper)
+    return starts_before_end and ends_after_start
+
+
+def vacant_properties(start, end, min_area=None, address=None, queryset=None):
+    """
+    在 [start, end] 整段期间都没有有效合同的房源（不含维护中的房源）。
+    租期重叠用排他约束的 GiST 索引查出，再从房源中排除
+    """
+    if queryset is None:
+        queryset = Property.objects.all()
+    leased = ContractProperty.objects.filter(
+        active=True, period__overlap=lease_range(start, end),
+    ).values('property_id')
+    queryset = queryset.exclude(rental_status='maintenance').exclude(id__in=leased)
+    if min_area is not None:
+        queryset = queryset.filter(area__gte=min_area)
+    if address:
+        queryset = queryset.filter(address__icontains=address)
+    return queryset
@@ -0,0 +1,106 @@
+# rental_app/balances.py
+
+from decimal import Decimal
+from django.db.models import F, Q, Sum, Value, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import Contract, Fee
+
+BALANCE_FIELDS = Contract.BALANCE_FIELDS
+ZERO = Decimal('0.00')
+
+
+def fee_contribution(state):
+    """单笔费用对合同三项余额的贡献，state 为 (contract_id, amount, is_collected, overdue_status)"""
+    if state is None:
+        return (ZERO, ZERO, ZERO)
+    _, amount, is_collected, overdue_status = state
+    amount = Decimal(str(amount or 0))
+    overdue = overdue_status == 'overdue'
+    return (
+        ZERO if is_collected else amount,
+        amount if overdue and not is_collected else ZERO,
+        amount if overdue else ZERO,
+    )
+
+
+def apply_balance_delta(contract_id, delta, contract=None):
+    """用一条 UPDATE 原子地把差额加到合同余额上，并同步内存中的合同实例"""
+    changes = {field: d for field, d in zip(BALANCE_FIELDS, delta) if d}
+    if not changes:
+        return
+    Contract.objects.filter(pk=contract_id).update(
+        **{field: F(field) + d for field, d in changes.items()}
+    )
+    if contract is not None:
+        for field, d in changes.items():
+            setattr(contract, field, Decimal(str(getattr(contract, field) or 0)) + d)
+
+
+def apply_fee_change(old_state, new_state, contract=None):
+    """根据费用变更前后的状态更新合同余额；费用换了合同时分别调整新旧合同"""
+    old = fee_contribution(old_state)
+    new = fee_contribution(new_state)
+    old_contract_id = old_state[0] if old_state else None
+    new_contract_id = new_state[0] if new_state else None
+
+    if old_contract_id == new_contract_id:
+        delta = tuple(n - o for n, o in zip(new, old))
+        apply_balance_delta(new_contract_id, delta, contract)
+        return
+
+    if old_contract_id is not None:
+        apply_balance_delta(old_contract_id, tuple(-o for o in old))
+    if new_contract_id is not None:
+        apply_balance_delta(new_contract_id, new, contract)
+
+
+def _fee_total(**filters):
+    return Coalesce(
+        Subquery(
+            Fee.objects.filter(contract=OuterRef('pk'), **filters)
+            .order_by()
+            .values('contract')
+            .annotate(total=Sum('amount'))
+            .values('total')[:1]
+        ),
+        Value(ZERO),
+    )
+
+
+def expected_balances(queryset=None):
+    """用一次分组查询为合同标注按费用明细重新计算的余额"""
+    if queryset is None:
+        queryset = Contract.objects.all()
+    zero = Value(ZERO)
+    return queryset.annotate(
+        expected_receivable=Coalesce(
+            Sum('fees__amount', filter=Q(fees__is_collected=False)), zero),
+        expected_outstanding=Coalesce(
+            Sum('fees__amount', filter=Q(fees__is_collected=False, fees__overdue_status='overdue')), zero),
+        expected_overdue=Coalesce(
+            Sum('fees__amount', filter=Q(fees__overdue_status='overdue')), zero),
+    )
+
+
+def find_balance_drift(contract_ids=None):
+    """返回余额与费用明细不一致的合同（带 expected_* 标注）"""
+    queryset = Contract.objects.all()
+    if contract_ids is not None:
+        queryset = queryset.filter(pk__in=contract_ids)
+    return expected_balances(queryset.only('id', *BALANCE_FIELDS)).filter(
+        ~Q(current_receivable=F('expected_receivable'))
+        | ~Q(current_outstanding=F('expected_outstanding'))
+        | ~Q(total_overdue=F('expected_overdue'))
+    ).order_by('pk')
+
+
+def refresh_contract_balances(contract_ids=None):
+    """用一条集合式 UPDATE 按费用明细重算合同余额，返回更新的行数"""
+    queryset = Contract.objects.all()
+    if contract_ids is not None:
+        queryset = queryset.filter(pk__in=contract_ids)
+    return queryset.update(
+        current_receivable=_fee_total(is_collected=False),
+        current_outstanding=_fee_total(is_collected=False, overdue_status='overdue'),
+        total_overdue=_fee_total(overdue_status='overdue'),
+    )
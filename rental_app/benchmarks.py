@@ -0,0 +1,314 @@
+# rental_app/benchmarks.py
+
+import statistics
+import time
+import tracemalloc
+from datetime import date
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+from .analytics import invalidate_kpi_snapshot
+from .balances import refresh_contract_balances
+from .caching import invalidate_list_cache
+from .models import (
+    Tenant, Property, Contract, ContractProperty, Fee, Payment, NotificationDelivery, NotificationRun,
+)
+from .notifications import NOTIFICATION_KINDS, notification_fees, send_fee_digests
+
+# 造数用的表，SQL 中以 {tenant}、{property} 等引用
+SEED_TABLES = {
+    'tenant': Tenant, 'property': Property, 'contract': Contract, 'fee': Fee, 'payment': Payment,
+    'contract_properties': ContractProperty, 'notification_delivery': NotificationDelivery,
+    'notification_recipients': NotificationRun.recipients.through,
+}
+
+# 基准数据中的合同（按租户邮箱前缀识别）及其序号 g，序号只取决于插入顺序
+SEED_CONTRACTS_CTE = """
+WITH bench AS (
+    SELECT c.*, row_number() OVER (ORDER BY c.id) AS g
+    FROM {contract} c JOIN {tenant} t ON t.id = c.tenant_id
+    WHERE t.email LIKE %(email_pattern)s
+)
+"""
+
+# 所有取值都由序号算出，参数相同时生成的数据相同。
+# 最近 4 个月的费用未收；更早的费用约 5% 未收并已逾期，其余已收并各有一笔支付。
+SEED_SQL = [
+    """
+    INSERT INTO {tenant} (email, first_name, last_name, phone_number)
+    SELECT %(prefix)s || '-' || g || '@example.com', '租户', g::text, '138' || lpad(g::text, 8, '0')
+    FROM generate_series(1, %(tenants)s) g
+    """,
+    """
+    INSERT INTO {property} (house_number, area, address, rental_status, current_value, maintenance_status)
+    SELECT upper(%(prefix)s) || '-' || g, 50 + g %% 100, '基准测试楼 ' || (1 + g %% 50) || ' 号',
+           CASE WHEN g <= %(contracts)s THEN 'rented' WHEN g %% 10 = 0 THEN 'maintenance' ELSE 'available' END,
+           (50 + g %% 100) * 20000, CASE WHEN g %% 10 = 0 THEN '维修中' END
+    FROM generate_series(1, %(properties)s) g
+    """,
+    """
+    INSERT INTO {contract} (
+        tenant_id, start_date, end_date, monthly_rent, yearly_rent, total_rent, rental_area,
+        rental_unit_price, rent_collection_time, status, current_receivable, current_outstanding,
+        total_overdue, deposit_amount, management_fee, business_type, decoration_period,
+        rent_free_period, promotion_fee
+    )
+    SELECT t.id, %(start)s::date, (%(start)s::date + make_interval(months => %(months)s) - interval '1 day')::date,
+           1000 + g %% 500, (1000 + g %% 500) * 12, (1000 + g %% 500) * %(months)s, 50 + g %% 100,
+           round((1000 + g %% 500) / (50 + g %% 100)::numeric, 2), %(start)s::date + g %% 28, 'active', 0, 0,
+           0, (1000 + g %% 500) * 2, 100 + g %% 50, (ARRAY['零售', '餐饮', '办公'])[1 + g %% 3], 0, 0, 0
+    FROM generate_series(1, %(contracts)s) g
+    JOIN (
+        SELECT id, row_number() OVER (ORDER BY id) AS rn FROM {tenant} WHERE email LIKE %(email_pattern)s
+    ) t ON t.rn = 1 + (g - 1) %% %(tenants)s
+    ORDER BY g
+    """,
+    SEED_CONTRACTS_CTE + """
+    INSERT INTO {contract_properties} (contract_id, property_id, period, active)
+    SELECT bench.id, p.id, daterange(bench.start_date, bench.end_date, '[]'), bench.status = 'active'
+    FROM bench JOIN (
+        SELECT id, row_number() OVER (ORDER BY id) AS g FROM {property} WHERE house_number LIKE %(house_pattern)s
+    ) p ON p.g = bench.g
+    """,
+    SEED_CONTRACTS_CTE + """
+    , months AS (
+        SELECT bench.id AS contract_id, bench.g, m, k.category,
+               CASE k.category WHEN 'rent' THEN bench.monthly_rent ELSE bench.management_fee END AS amount,
+               (bench.start_date + make_interval(months => m))::date AS period_start,
+               EXTRACT(DAY FROM bench.rent_collection_time)::int AS due_day,
+               m < %(months)s - 4 AND (bench.g + m) %% 20 <> 0 AS collected,
+               m < %(months)s - 4 AS past
+        FROM bench
+        CROSS JOIN generate_series(0, %(months)s - 1) m
+        CROSS JOIN (VALUES ('rent'), ('management_fee')) k(category)
+    )
+    INSERT INTO {fee} (
+        contract_id, category, amount, term, period_start, due_date, is_collected, overdue_status, payment_method
+    )
+    SELECT contract_id, category, amount, to_char(period_start, 'YYYY-MM'), period_start,
+           period_start + LEAST(
+               due_day, EXTRACT(DAY FROM period_start + interval '1 month' - interval '1 day')::int
+           ) - 1,
+           collected, CASE WHEN past AND NOT collected THEN 'overdue' ELSE 'on_time' END,
+           CASE WHEN collected THEN 'bank_transfer' END
+    FROM months
+    UNION ALL
+    SELECT id, 'deposit', deposit_amount, '一次性', NULL, rent_collection_time, TRUE, 'on_time', 'bank_transfer'
+    FROM bench
+    ORDER BY 1, 4, 2
+    """,
+    SEED_CONTRACTS_CTE + """
+    INSERT INTO {payment} (fee_id, payment_date, amount, payment_method, receipt_status, reference)
+    SELECT f.id, (f.due_date + time '10:00') AT TIME ZONE %(time_zone)s, f.amount, 'bank_transfer', 'ready', ''
+    FROM {fee} f JOIN bench ON bench.id = f.contract_id
+    WHERE f.is_collected
+    ORDER BY f.id
+    """,
+]
+
+# 删除基准数据：先删支付、费用、合同关系，再删合同、房源，最后删通知送达记录、通知对象和租户
+CLEAR_SQL = [
+    SEED_CONTRACTS_CTE + """
+    DELETE FROM {payment} p USING {fee} f, bench WHERE p.fee_id = f.id AND f.contract_id = bench.id
+    """,
+    SEED_CONTRACTS_CTE + "DELETE FROM {fee} f USING bench WHERE f.contract_id = bench.id",
+    SEED_CONTRACTS_CTE + "DELETE FROM {contract_properties} cp USING bench WHERE cp.contract_id = bench.id",
+    SEED_CONTRACTS_CTE + "DELETE FROM {contract} c USING bench WHERE c.id = bench.id",
+    "DELETE FROM {property} WHERE house_number LIKE %(house_pattern)s",
+    """
+    DELETE FROM {notification_delivery} d USING {tenant} t
+    WHERE d.tenant_id = t.id AND t.email LIKE %(email_pattern)s
+    """,
+    """
+    DELETE FROM {notification_recipients} r USING {tenant} t
+    WHERE r.tenant_id = t.id AND t.email LIKE %(email_pattern)s
+    """,
+    "DELETE FROM {tenant} WHERE email LIKE %(email_pattern)s",
+]
+
+
+def seed_params(prefix, **params):
+    return {
+        'prefix': prefix,
+        'email_pattern': f'{prefix}-%@example.com',
+        'house_pattern': f'{prefix.upper()}-%',
+        'time_zone': settings.TIME_ZONE,
+        **params,
+    }
+
+
+def execute_seed_sql(statements, params):
+    names = {key: connection.ops.quote_name(model._meta.db_table) for key, model in SEED_TABLES.items()}
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql.format(**names), params)
+
+
+def seed_dataset(tenants, properties, contracts, months, start, prefix='bench'):
+    """
+    用 generate_series 集合式地生成基准数据，参数相同时数据相同（主键取决于序列）。
+    每份合同关联一个房源，每月一条租金和一条物业管理费，另有一笔保证金；
+    合同余额最后用一条 UPDATE 按费用重算。返回各表生成的行数。
+    """
+    params = seed_params(
+        prefix, tenants=tenants, properties=max(properties, contracts), contracts=contracts,
+        months=months, start=start,
+    )
+    with transaction.atomic():
+        execute_seed_sql(SEED_SQL, params)
+        refresh_contract_balances(Contract.objects.filter(tenant__in=bench_tenants(prefix)).values('id'))
+    with connection.cursor() as cursor:
+        for model in SEED_TABLES.values():
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(model._meta.db_table)}')
+    invalidate_kpi_snapshot()
+    invalidate_list_cache('tenants', 'properties')
+    return {
+        'tenants': tenants,
+        'properties': params['properties'],
+        'contracts': contracts,
+        'fees': contracts * (months * 2 + 1),
+    }
+
+
+def clear_dataset(prefix='bench'):
+    with transaction.atomic():
+        execute_seed_sql(CLEAR_SQL, seed_params(prefix))
+    invalidate_kpi_snapshot()
+    invalidate_list_cache('tenants', 'properties')
+
+
+def bench_tenants(prefix='bench'):
+    return Tenant.objects.filter(email__startswith=f'{prefix}-', email__endswith='@example.com')
+
+
+# 耗时、峰值内存超过基线的 (1 + 容差) 倍且差值超过以下下限时视为回退，避免小数值的抖动误报
+BENCHMARK_MIN_DELTA_MS = 5
+BENCHMARK_MIN_DELTA_KB = 64
+
+BENCHMARK_CASES = (
+    'tenants-list', 'properties-list', 'contracts-list', 'fees-list', 'payments-list',
+    'data-analysis', 'tenant-fees', 'tenant-statement', 'payment-create', 'payment-notifications',
+    'overdue-notifications', 'revenue-forecast',
+)
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def checked(response):
+    if response.status_code >= 400:
+        raise BenchmarkError(f'{response.request["PATH_INFO"]} 返回 {response.status_code}')
+    return response
+
+
+def benchmark_cases(client, prefix='bench'):
+    """主要接口和通知任务，返回 [(名称, 可重复调用的函数)]；写操作在事务内执行后回滚"""
+    tenant_id = (
+        bench_tenants(prefix).order_by('id').values_list('id', flat=True).first()
+        or Tenant.objects.order_by('id').values_list('id', flat=True).first()
+    )
+    fee = Fee.objects.filter(is_collected=False, amount__gt=0).order_by('-id').first()
+
+    def get(path):
+        return lambda: checked(client.get(path))
+
+    def data_analysis():
+        # 每次都重新计算，不读缓存的快照
+        invalidate_kpi_snapshot()
+        checked(client.get('/api/data-analysis/'))
+
+    def create_payment():
+        with transaction.atomic():
+            response = client.post(
+                '/api/payments/', {'fee_id': fee.pk, 'amount': str(fee.amount), 'payment_method': 'POS'},
+                format='json',
+            )
+            transaction.set_rollback(True)
+        checked(response)
+
+    def notify(kind):
+        # 单个 worker 发送全部租户的耗时，即只有一个分块时的通知任务
+        def run():
+            mail.outbox = []
+            send_fee_digests(notification_fees(kind, date.today()), *NOTIFICATION_KINDS[kind])
+        return run
+
+    cases = [
+        ('tenants-list', get('/api/tenants/')),
+        ('properties-list', get('/api/properties/')),
+        ('contracts-list', get('/api/contracts/')),
+        ('fees-list', get('/api/fees/')),
+        ('payments-list', get('/api/payments/')),
+        ('data-analysis', data_analysis),
+    ]
+    if tenant_id is not None:
+        cases.append(('tenant-fees', get(f'/api/tenants/{tenant_id}/fees/')))
+        cases.append(('tenant-statement', get(f'/api/tenants/{tenant_id}/statement/')))
+    if fee is not None:
+        cases.append(('payment-create', create_payment))
+    cases += [
+        ('payment-notifications', notify('payment')),
+        ('overdue-notifications', notify('overdue')),
+        ('revenue-forecast', get('/api/revenue-forecast/?months=60')),
+    ]
+    return cases
+
+
+def measure(func, repeat):
+    """预热一次后计时 repeat 次；另跑一次统计 SQL 条数和 Python 峰值内存（tracemalloc 会拖慢执行，不计入耗时）"""
+    func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'max_ms': round(max(timings) * 1000, 2),
+        'queries': len(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(names=None, repeat=5, prefix='bench'):
+    """依次测量各用例，返回 {名称: 结果}"""
+    client = APIClient()
+    client.force_authenticate(User(username='benchmark'))
+    results = {}
+    with override_settings(
+        ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    ):
+        for name, func in benchmark_cases(client, prefix):
+            if names and name not in names:
+                continue
+            results[name] = measure(func, repeat)
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    """与基线比较：SQL 条数增加，或耗时中位数、峰值内存超过基线的 (1 + tolerance) 倍，返回说明列表"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(f"{name}: SQL {base['queries']} → {result['queries']} 条")
+        for key, unit, min_delta in (
+            ('median_ms', 'ms', BENCHMARK_MIN_DELTA_MS), ('peak_kb', 'KB', BENCHMARK_MIN_DELTA_KB),
+        ):
+            if result[key] > base[key] * (1 + tolerance) and result[key] - base[key] > min_delta:
+                regressions.append(f'{name}: {key} {base[key]} → {result[key]} {unit}')
+    return regressions
@@ -0,0 +1,84 @@
+# rental_app/caching.py
+
+import hashlib
+import time
+from functools import partial
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .metrics import registry
+
+LIST_CACHE_PREFIX = 'rental_app:list:'
+# 未在 LIST_CACHE_TTLS 中配置的缓存时间（秒）
+DEFAULT_LIST_CACHE_TTL = 300
+# 冷缓存时只有拿到锁的请求查询数据库；锁的最长持有时间，以及其他请求等待结果的最长时间（秒）
+CACHE_LOCK_TIMEOUT = 10
+CACHE_WAIT = 2.0
+CACHE_POLL_INTERVAL = 0.05
+
+
+def version_key(namespace):
+    return f'{LIST_CACHE_PREFIX}{namespace}:version'
+
+
+def namespace_version(namespace):
+    key = version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # 版本号丢失（首次使用或被淘汰）时从当前时间起算，不会与旧版本的键重合
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    try:
+        cache.incr(version_key(namespace))
+    except ValueError:
+        cache.add(version_key(namespace), time.time_ns(), None)
+
+
+def invalidate_list_cache(*namespaces):
+    """
+    使命名空间下的所有缓存失效（递增版本号，旧键随 TTL 过期）。立即失效一次，事务提交后再失效一次：
+    提交前并发请求读到旧数据写入的缓存也会作废
+    """
+    for namespace in namespaces:
+        bump_version(namespace)
+        transaction.on_commit(partial(bump_version, namespace))
+
+
+def read_through(namespace, name, identity, build):
+    """
+    读穿缓存：键由命名空间版本、name 和 identity（如完整 URL）组成，未命中时调用 build 计算并写入，
+    缓存时间取 LIST_CACHE_TTLS[name]。冷缓存时用 cache.add 抢锁，只有一个请求查询数据库，
+    其他请求轮询等待其结果，超过 CACHE_WAIT 秒仍未写入时自行计算
+    """
+    version = namespace_version(namespace)
+    digest = hashlib.sha1(identity.encode()).hexdigest()
+    key = f'{LIST_CACHE_PREFIX}{namespace}:{version}:{name}:{digest}'
+    value = cache.get(key)
+    if value is not None:
+        registry.inc('rental_cache_requests_total', cache=name, result='hit')
+        return value
+
+    lock = f'{key}:lock'
+    if cache.add(lock, 1, CACHE_LOCK_TIMEOUT):
+        registry.inc('rental_cache_requests_total', cache=name, result='miss')
+        try:
+            value = build()
+            ttl = getattr(settings, 'LIST_CACHE_TTLS', {}).get(name, DEFAULT_LIST_CACHE_TTL)
+            cache.set(key, value, ttl)
+        finally:
+            cache.delete(lock)
+        return value
+
+    deadline = time.monotonic() + CACHE_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(CACHE_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            registry.inc('rental_cache_requests_total', cache=name, result='wait')
+            return value
+    registry.inc('rental_cache_requests_total', cache=name, result='miss')
+    return build()
@@ -0,0 +1,125 @@
+# rental_app/exports.py
+
+import csv
+import tempfile
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from .models import Tenant, Contract, Fee, Payment
+
+# 每次从服务端游标取回的行数
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# 各模型导出的列：(表头, values_list 字段)，关联字段直接在 SQL 中取出，不经过序列化器
+EXPORT_COLUMNS = {
+    Tenant: (
+        ('ID', 'id'),
+        ('邮箱', 'email'),
+        ('名', 'first_name'),
+        ('姓', 'last_name'),
+        ('电话', 'phone_number'),
+    ),
+    Contract: (
+        ('ID', 'id'),
+        ('租户邮箱', 'tenant__email'),
+        ('开始日期', 'start_date'),
+        ('结束日期', 'end_date'),
+        ('月租金', 'monthly_rent'),
+        ('物业管理费', 'management_fee'),
+        ('保证金', 'deposit_amount'),
+        ('收租日', 'rent_collection_time'),
+        ('状态', 'status'),
+        ('当前应收', 'current_receivable'),
+        ('当前未结', 'current_outstanding'),
+        ('累计逾期', 'total_overdue'),
+    ),
+    Fee: (
+        ('ID', 'id'),
+        ('合同ID', 'contract_id'),
+        ('租户邮箱', 'contract__tenant__email'),
+        ('类别', 'category'),
+        ('金额', 'amount'),
+        ('所属期', 'term'),
+        ('所属期首日', 'period_start'),
+        ('到期日', 'due_date'),
+        ('已收取', 'is_collected'),
+        ('逾期状态', 'overdue_status'),
+        ('支付方式', 'payment_method'),
+    ),
+    Payment: (
+        ('ID', 'id'),
+        ('费用ID', 'fee_id'),
+        ('合同ID', 'fee__contract_id'),
+        ('费用类别', 'fee__category'),
+        ('所属期', 'fee__term'),
+        ('支付时间', 'payment_date'),
+        ('金额', 'amount'),
+        ('支付方式', 'payment_method'),
+        ('银行流水号', 'reference'),
+        ('收据状态', 'receipt_status'),
+    ),
+}
+
+
+class Echo:
+    """csv.writer 的伪文件对象：writerow 直接返回写入的内容"""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    """按主键顺序从服务端游标逐块读取 values_list 元组，内存占用与总行数无关"""
+    fields = [field for _, field in EXPORT_COLUMNS[queryset.model]]
+    return (
+        queryset.select_related(None).prefetch_related(None)
+        .order_by('pk')
+        .values_list(*fields)
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+
+
+def export_header(model):
+    return [header for header, _ in EXPORT_COLUMNS[model]]
+
+
+def iter_csv(queryset):
+    """逐行生成 CSV 文本，首行带 BOM 以便 Excel 正确识别中文"""
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(export_header(queryset.model))
+    for row in export_rows(queryset):
+        yield writer.writerow(row)
+
+
+def write_xlsx(queryset, fileobj):
+    """用 openpyxl 的只写模式逐行写入，行数据先落到临时文件而不是留在内存"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(queryset.model._meta.verbose_name_plural[:31])
+    sheet.append(export_header(queryset.model))
+    for row in export_rows(queryset):
+        sheet.append([
+            timezone.make_naive(value) if getattr(value, 'tzinfo', None) else value
+            for value in row
+        ])
+    workbook.save(fileobj)
+
+
+def export_filename(queryset, file_format):
+    return f"{queryset.model._meta.model_name}s-{timezone.localdate():%Y%m%d}.{file_format}"
+
+
+def export_response(queryset, file_format='csv'):
+    """返回流式下载响应：CSV 边查询边发送；XLSX 写入临时文件后按块发送"""
+    filename = export_filename(queryset, file_format)
+    if file_format == 'xlsx':
+        tmp = tempfile.TemporaryFile()
+        write_xlsx(queryset, tmp)
+        tmp.seek(0)
+        return FileResponse(tmp, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
+    response = StreamingHttpResponse(iter_csv(queryset), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,57 @@
+# rental_app/filters.py
+
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+from .models import Fee, Payment
+
+# 费用按日期范围过滤的查询参数（YYYY-MM-DD，包含端点）
+FEE_DATE_FILTERS = {
+    'period_from': 'period_start__gte',
+    'period_to': 'period_start__lte',
+    'due_from': 'due_date__gte',
+    'due_to': 'due_date__lte',
+}
+
+
+def date_param(params, name):
+    """读取 YYYY-MM-DD 格式的查询参数，未提供时返回 None，格式错误时返回 400"""
+    value = params.get(name)
+    if value is None:
+        return None
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ValidationError({name: '日期格式应为 YYYY-MM-DD'})
+    return day
+
+
+def filter_fee_dates(queryset, params):
+    """按 ?period_from= / ?period_to= / ?due_from= / ?due_to= 过滤费用的所属期和到期日"""
+    filters = {}
+    for param, lookup in FEE_DATE_FILTERS.items():
+        day = date_param(params, param)
+        if day is not None:
+            filters[lookup] = day
+    return queryset.filter(**filters)
+
+
+def filter_payments(queryset, params):
+    """按 ?fee= 过滤支付记录"""
+    fee_id = params.get('fee', None)
+    if fee_id is not None:
+        queryset = queryset.filter(fee_id=fee_id)
+    return queryset
+
+
+# 列表接口使用的查询参数过滤，导出等其他入口按模型复用
+LIST_FILTERS = {
+    Fee: filter_fee_dates,
+    Payment: filter_payments,
+}
+
+
+def apply_list_filters(queryset, params):
+    list_filter = LIST_FILTERS.get(queryset.model)
+    return list_filter(queryset, params) if list_filter else queryset
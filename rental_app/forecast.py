@@ -0,0 +1,160 @@
+# rental_app/forecast.py
+
+from datetime import date
+from decimal import Decimal
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+from .models import Contract, Fee, Payment
+
+# 预测的最长月数
+MAX_FORECAST_MONTHS = 120
+
+# 历史回收率取预测时点前多少个月内到期的租金和物业费
+DEFAULT_HISTORY_MONTHS = 12
+
+FORECAST_AMOUNTS = ('rent', 'management_fee', 'promotion_fee')
+
+# 一条语句取出有效合同的预测所需列（日期为 1970-01-01 起的天数，金额为分），
+# 以及每份合同在历史窗口内到期的租金、物业费金额和其中已支付的金额（单笔费用的支付超出金额的部分不计）
+FORECAST_SQL = """
+SELECT c.start_date - DATE '1970-01-01',
+       c.end_date - DATE '1970-01-01',
+       COALESCE(c.decoration_period, 0) + COALESCE(c.rent_free_period, 0),
+       ROUND(c.monthly_rent * 100)::bigint,
+       ROUND(c.management_fee * 100)::bigint,
+       ROUND(c.promotion_fee * 100)::bigint,
+       COALESCE(h.billed, 0),
+       COALESCE(h.paid, 0)
+FROM {contract} c
+LEFT JOIN (
+    SELECT f.contract_id,
+           ROUND(SUM(f.amount) * 100)::bigint AS billed,
+           ROUND(SUM(LEAST(COALESCE(p.paid, 0), f.amount)) * 100)::bigint AS paid
+    FROM {fee} f
+    LEFT JOIN LATERAL (SELECT SUM(amount) AS paid FROM {payment} WHERE fee_id = f.id) p ON true
+    WHERE f.category IN ('rent', 'management_fee')
+      AND f.due_date >= %(history_from)s AND f.due_date < %(as_of)s
+    GROUP BY f.contract_id
+) h ON h.contract_id = c.id
+WHERE c.status = 'active' AND c.end_date >= %(horizon_start)s
+"""
+
+
+def add_months(day, months):
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+def load_forecast_columns(horizon_start, as_of, history_months=DEFAULT_HISTORY_MONTHS):
+    """按列加载有效合同：返回 int64 二维数组，每行一份合同，列顺序同 FORECAST_SQL"""
+    quote = connection.ops.quote_name
+    sql = FORECAST_SQL.format(
+        contract=quote(Contract._meta.db_table),
+        fee=quote(Fee._meta.db_table),
+        payment=quote(Payment._meta.db_table),
+    )
+    params = {
+        'horizon_start': horizon_start,
+        'as_of': as_of,
+        'history_from': add_months(as_of.replace(day=1), -history_months),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return np.array(rows, dtype=np.int64).reshape(-1, 8)
+
+
+def month_index(days):
+    """1970-01-01 起的天数 -> 所在月份（1970-01 起的月数）"""
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def collection_rates(billed, paid):
+    """
+    每份合同的历史回收率（已付 / 应收）；历史窗口内没有到期费用的合同用整体回收率，
+    整体也没有历史时按全部回收计。返回 (每份合同的回收率, 整体回收率)
+    """
+    total_billed = billed.sum()
+    overall = paid.sum() / total_billed if total_billed else 1.0
+    rates = np.where(billed > 0, paid / np.maximum(billed, 1), overall)
+    return np.clip(rates, 0.0, 1.0), float(overall)
+
+
+def billing_mask(columns, horizon):
+    """
+    (合同数, 月数) 的布尔矩阵：合同在该月是否计费，以及每份合同第一个计费月的月份。
+    与 schedule.schedule_rows 的规则一致：从装修期、免租期结束日所在月起，到合同结束日所在月止
+    """
+    start, end, free_days = columns[:, 0], columns[:, 1], columns[:, 2]
+    billable_from = start + free_days
+    first = month_index(billable_from)
+    last = month_index(end)
+    valid = billable_from <= end
+    return valid[:, None] & (first[:, None] <= horizon) & (horizon <= last[:, None]), first
+
+
+def first_month_amounts(columns, first, amounts):
+    """
+    第一个计费月的金额：不从月初开始计费时（合同月中开始或免租期在月中结束），
+    按计费天数占当月天数的比例折算，与 schedule.prorate 一样四舍五入到分（整数运算，不经过浮点）
+    """
+    end = columns[:, 1]
+    billable_from = columns[:, 0] + columns[:, 2]
+    month_start = first.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    month_end = (first + 1).astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) - 1
+    month_days = month_end - month_start + 1
+    billed_from = np.maximum(month_start, billable_from)
+    billed = np.where(billed_from > month_start, np.minimum(month_end, end) - billed_from + 1, month_days)
+    return {name: (amount * billed * 2 + month_days) // (2 * month_days) for name, amount in amounts.items()}
+
+
+def cents(value):
+    return Decimal(int(round(value))).scaleb(-2)
+
+
+def build_revenue_forecast(months=12, start=None, as_of=None, history_months=DEFAULT_HISTORY_MONTHS):
+    """
+    预测从 start 所在月（默认本月）起 months 个月的按月计费和预计回收金额。
+    计费 = 租金 + 物业管理费，与费用计划生成的月度费用一致（含第一个计费月的折算）；推广费单列，不计入计费和回收。
+    预计回收 = 每份合同的计费 × 该合同的历史回收率。
+    合同只查询一次并按列载入 NumPy 数组，逐月计费用矩阵运算完成，不逐合同循环
+    """
+    as_of = as_of or timezone.localdate()
+    start = (start or as_of).replace(day=1)
+    columns = load_forecast_columns(start, as_of, history_months)
+
+    horizon = month_index(np.array([(start - date(1970, 1, 1)).days])) + np.arange(months)
+    mask, first = billing_mask(columns, horizon)
+    # 第一个计费月可能折算，与其余整月分开计算
+    first_weights = (mask & (horizon == first[:, None])).astype(np.int64)
+    weights = mask.astype(np.int64) - first_weights
+    amounts = dict(zip(FORECAST_AMOUNTS, columns[:, 3:6].T))
+    first_amounts = first_month_amounts(columns, first, amounts)
+    rates, overall_rate = collection_rates(columns[:, 6], columns[:, 7])
+
+    monthly = {name: amounts[name] @ weights + first_amounts[name] @ first_weights for name in FORECAST_AMOUNTS}
+    monthly['billed'] = monthly['rent'] + monthly['management_fee']
+    monthly['expected_collected'] = (
+        ((amounts['rent'] + amounts['management_fee']) * rates) @ weights
+        + ((first_amounts['rent'] + first_amounts['management_fee']) * rates) @ first_weights
+    )
+    contract_counts = mask.sum(axis=0)
+
+    fields = FORECAST_AMOUNTS + ('billed', 'expected_collected')
+    results = [
+        {
+            'month': str(label),
+            'contracts': int(contract_counts[i]),
+            **{name: cents(monthly[name][i]) for name in fields},
+        }
+        for i, label in enumerate(horizon.astype('datetime64[M]').astype(str))
+    ]
+    return {
+        'start': start.strftime('%Y-%m'),
+        'months': months,
+        'contracts': len(columns),
+        'collection_rate': round(overall_rate * 100, 2),
+        'totals': {name: sum((row[name] for row in results), Decimal('0.00')) for name in fields},
+        'results': results,
+    }
@@ -0,0 +1,326 @@
+# rental_app/imports.py
+
+import codecs
+import csv
+import io
+import json
+from itertools import islice
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from .analytics import invalidate_kpi_snapshot
+from .availability import lease_overlaps, lease_range
+from .balances import refresh_contract_balances
+from .caching import invalidate_list_cache
+from .models import Tenant, Property, Contract, ContractProperty, Fee
+from .occupancy import set_rental_status
+from .schedule import schedule_rows
+
+# 每批校验、写入的行数
+IMPORT_BATCH_SIZE = 1000
+
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+# 依次尝试的文件编码：UTF-8（可带 BOM），否则按 GBK（GB18030 兼容 GBK）解码，Excel 另存的中文 CSV 多为后者
+IMPORT_ENCODINGS = ('utf-8-sig', 'gb18030')
+
+FEE_COPY_FIELDS = (
+    'contract', 'category', 'amount', 'term', 'period_start', 'due_date', 'is_collected', 'overdue_status',
+)
+
+# COPY 数据中表示 NULL 的标记，空字符串仍按空字符串写入
+COPY_NULL = '\\N'
+
+
+def detect_encoding(file, chunk_size=1 << 16):
+    """
+    返回 IMPORT_ENCODINGS 中能完整解码二进制文件的第一个编码，都不能时返回 None。
+    每种编码从头分块读一遍，大文件不必整个读入内存；返回前把文件位置还原到开头
+    """
+    try:
+        for encoding in IMPORT_ENCODINGS:
+            file.seek(0)
+            decoder = codecs.getincrementaldecoder(encoding)()
+            try:
+                for chunk in iter(lambda: file.read(chunk_size), b''):
+                    decoder.decode(chunk)
+                decoder.decode(b'', final=True)
+            except UnicodeDecodeError:
+                continue
+            return encoding
+        return None
+    finally:
+        file.seek(0)
+
+
+def read_rows(lines, file_format='csv'):
+    """逐行解析 CSV（首行为表头）或 JSON Lines，生成 (行号, 字典)；无法解析的行生成 (行号, ValidationError)"""
+    if file_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            if None in row:
+                yield reader.line_num, ValidationError('列数多于表头')
+            else:
+                yield reader.line_num, row
+        return
+    for line_num, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_num, ValidationError('不是有效的 JSON')
+            continue
+        if isinstance(row, dict):
+            yield line_num, row
+        else:
+            yield line_num, ValidationError('每行应为一个 JSON 对象')
+
+
+def error_messages(exc):
+    if hasattr(exc, 'error_dict'):
+        return exc.message_dict
+    return {'non_field_errors': exc.messages}
+
+
+def copy_rows(model, field_names, rows):
+    """
+    用 COPY FROM STDIN 写入一批行（字段值元组，不返回主键）。与 bulk_create 相比省去了构造模型实例
+    和逐个值编译 INSERT 语句的开销，适合费用这类大批量、无需回读主键的数据。
+    未列出的字段写入 NULL，不会使用模型默认值。
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([COPY_NULL if value is None else value for value in row])
+    buffer.seek(0)
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in field_names)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {quote(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+            buffer,
+        )
+
+
+class BulkImporter:
+    """
+    批量导入的基类：build 逐行把数据转换为未保存的模型实例并做字段级校验（不查询数据库），
+    check_batch 对整批做唯一性、关联等需要查询数据库的校验，save_batch 用集合式语句写入。
+    """
+    model = None
+    fields = ()
+    unique_field = None
+    # bulk_create 不触发信号，导入后需要失效的列表缓存
+    cache_namespace = None
+
+    def __init__(self):
+        # 本次导入中已出现的唯一值，用于发现文件内重复
+        self.seen = set()
+
+    def build(self, row):
+        unknown = set(row) - set(self.fields)
+        if unknown:
+            raise ValidationError({name: '未知字段' for name in sorted(unknown)})
+        # 空值按未提供处理，使用模型默认值
+        values = {name: value for name, value in row.items() if value not in ('', None)}
+        instance = self.model(**values)
+        instance.clean_fields(exclude=self.clean_exclude())
+        return instance
+
+    def clean_exclude(self):
+        return []
+
+    def check_batch(self, items):
+        """items 为 [(行号, 实例)]，返回 {行号: 错误}"""
+        errors = {}
+        if self.unique_field is None:
+            return errors
+        field = self.unique_field
+        values = [getattr(instance, field) for _, instance in items]
+        existing = set(
+            self.model.objects.filter(**{f'{field}__in': values}).values_list(field, flat=True)
+        )
+        for line, instance in items:
+            value = getattr(instance, field)
+            if value in existing:
+                errors[line] = {field: ['已存在']}
+            elif value in self.seen:
+                errors[line] = {field: ['与导入文件中前面的行重复']}
+            self.seen.add(value)
+        return errors
+
+    def save_batch(self, instances, report):
+        self.model.objects.bulk_create(instances)
+
+
+class TenantImporter(BulkImporter):
+    model = Tenant
+    fields = ('email', 'first_name', 'last_name', 'phone_number')
+    unique_field = 'email'
+    cache_namespace = 'tenants'
+
+
+class PropertyImporter(BulkImporter):
+    model = Property
+    fields = ('house_number', 'area', 'address', 'rental_status', 'current_value', 'maintenance_status')
+    unique_field = 'house_number'
+    cache_namespace = 'properties'
+
+
+class ContractImporter(BulkImporter):
+    """
+    合同按租户邮箱（tenant_email）和房号（house_numbers，CSV 中用分号分隔，JSON 中可为数组）
+    关联已存在的租户和房源，有效合同的租期不能与房源上其他有效合同重叠
+    """
+    model = Contract
+    fields = (
+        'tenant_email', 'house_numbers',
+        'start_date', 'end_date', 'monthly_rent', 'yearly_rent', 'total_rent', 'rental_area',
+        'rental_unit_price', 'rent_collection_time', 'status', 'deposit_amount', 'management_fee',
+        'business_type', 'rental_purpose', 'decoration_period', 'rent_free_period',
+        'utilities_payment', 'promotion_fee',
+    )
+
+    def build(self, row):
+        row = dict(row)
+        tenant_email = row.pop('tenant_email', None)
+        house_numbers = row.pop('house_numbers', None) or []
+        if isinstance(house_numbers, str):
+            house_numbers = house_numbers.split(';')
+        house_numbers = list(dict.fromkeys(
+            str(number).strip() for number in house_numbers if str(number).strip()
+        ))
+        errors = {}
+        if not tenant_email:
+            errors['tenant_email'] = ['必填']
+        if not house_numbers:
+            errors['house_numbers'] = ['至少需要一个房号']
+        try:
+            instance = super().build(row)
+        except ValidationError as exc:
+            errors.update(error_messages(exc))
+        else:
+            if instance.start_date > instance.end_date:
+                errors['end_date'] = ['结束日期不能早于开始日期']
+        if errors:
+            raise ValidationError(errors)
+        instance._tenant_email = tenant_email
+        instance._house_numbers = house_numbers
+        return instance
+
+    def clean_exclude(self):
+        return ['tenant']
+
+    def check_batch(self, items):
+        emails = {instance._tenant_email for _, instance in items}
+        numbers = {number for _, instance in items for number in instance._house_numbers}
+        tenants = dict(Tenant.objects.filter(email__in=emails).values_list('email', 'id'))
+        properties = dict(Property.objects.filter(house_number__in=numbers).values_list('house_number', 'id'))
+        # 这些房源上有效合同的租期（含本次导入前面各批已写入的），有效的新合同不能与之重叠，
+        # 与排他约束的规则一致，房源状态不参与判断；本批中前面的行通过校验后也加入
+        leases = {}
+        for property_id, period in ContractProperty.objects.filter(
+            active=True, property_id__in=properties.values(), period__isnull=False,
+        ).values_list('property_id', 'period'):
+            leases.setdefault(property_id, []).append(period)
+
+        errors = {}
+        for line, instance in items:
+            row_errors = {}
+            instance.tenant_id = tenants.get(instance._tenant_email)
+            if instance.tenant_id is None:
+                row_errors['tenant_email'] = [f'租户不存在：{instance._tenant_email}']
+            messages = []
+            instance._property_ids = []
+            for number in instance._house_numbers:
+                if number not in properties:
+                    messages.append(f'房源不存在：{number}')
+                elif instance.status == 'active' and any(
+                    lease_overlaps(period, instance.start_date, instance.end_date)
+                    for period in leases.get(properties[number], ())
+                ):
+                    messages.append(f'房源在合同期内已有其他有效合同：{number}')
+                else:
+                    instance._property_ids.append(properties[number])
+            if messages:
+                row_errors['house_numbers'] = messages
+            if row_errors:
+                errors[line] = row_errors
+            elif instance.status == 'active':
+                period = lease_range(instance.start_date, instance.end_date)
+                for property_id in instance._property_ids:
+                    leases.setdefault(property_id, []).append(period)
+        return errors
+
+    def save_batch(self, contracts, report):
+        """
+        合同用 bulk_create 写入以取回主键；房源关系、费用用 COPY 写入，
+        房源状态和合同余额各用一条集合式 UPDATE 更新
+        """
+        Contract.objects.bulk_create(contracts)
+        # 关联行直接带上租期，与 availability.sync_lease_periods 的结果一致
+        property_ids = [
+            (contract.id, property_id, f'[{contract.start_date},{contract.end_date}]', contract.status == 'active')
+            for contract in contracts for property_id in contract._property_ids
+        ]
+        copy_rows(ContractProperty, ('contract', 'property', 'period', 'active'), property_ids)
+        # 只有有效合同占用房源，与关联行的 active 和 check_batch 的租期检查一致
+        set_rental_status([row[1] for row in property_ids if row[3]], 'rented')
+        # 与 Contract.create_initial_fees 和 create_fees 信号一致：一笔保证金加上每月的租金和物业管理费
+        fees = []
+        for contract in contracts:
+            fees.append((
+                contract.id, 'deposit', contract.deposit_amount, '一次性', None, contract.rent_collection_time,
+            ))
+            fees.extend((contract.id, *row) for row in schedule_rows(contract))
+        copy_rows(Fee, FEE_COPY_FIELDS, (row + (False, 'on_time') for row in fees))
+        refresh_contract_balances([contract.id for contract in contracts])
+        report['fees'] = report.get('fees', 0) + len(fees)
+
+
+IMPORTERS = {
+    Tenant: TenantImporter,
+    Property: PropertyImporter,
+    Contract: ContractImporter,
+}
+
+
+def run_import(model, lines, file_format='csv', dry_run=False, batch_size=IMPORT_BATCH_SIZE):
+    """
+    按批校验并写入，出错的行跳过并记录到 errors（行号与字段错误），其余行照常导入。
+    整个导入在一个事务内完成；dry_run 时完整执行后回滚，报告与实际导入一致。
+    """
+    importer = IMPORTERS[model]()
+    report = {'rows': 0, 'created': 0, 'errors': [], 'dry_run': dry_run}
+    rows = read_rows(lines, file_format)
+    with transaction.atomic():
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            report['rows'] += len(batch)
+            valid = []
+            errors = {}
+            for line, row in batch:
+                try:
+                    if isinstance(row, ValidationError):
+                        raise row
+                    valid.append((line, importer.build(row)))
+                except ValidationError as exc:
+                    errors[line] = error_messages(exc)
+            if valid:
+                errors.update(importer.check_batch(valid))
+            instances = [instance for line, instance in valid if line not in errors]
+            if instances:
+                importer.save_batch(instances, report)
+                report['created'] += len(instances)
+            report['errors'].extend(
+                {'line': line, 'errors': errors[line]} for line in sorted(errors)
+            )
+        if dry_run:
+            transaction.set_rollback(True)
+        elif report['created']:
+            transaction.on_commit(invalidate_kpi_snapshot)
+            if importer.cache_namespace:
+                invalidate_list_cache(importer.cache_namespace)
+    return report
@@ -0,0 +1,52 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from rental_app.benchmarks import BENCHMARK_CASES, BenchmarkError, find_regressions, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        '测量主要列表接口、数据分析、租户费用、支付创建和通知任务的耗时、SQL 条数和峰值内存；'
+        '指定 --baseline 时与基线比较，超出容差即以非零状态退出。写操作在事务内回滚，邮件不会真正发送'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', action='append', choices=BENCHMARK_CASES, help='只运行指定用例，可重复使用')
+        parser.add_argument('--repeat', type=int, default=5, help='每个用例计时的次数（另有一次预热）')
+        parser.add_argument('--prefix', default='bench', help='seed_benchmark_data 使用的前缀')
+        parser.add_argument('--baseline', help='基线 JSON 文件，与其比较')
+        parser.add_argument('--save-baseline', help='把本次结果写入 JSON 文件作为基线')
+        parser.add_argument(
+            '--tolerance', type=float, default=settings.BENCHMARK_REGRESSION_TOLERANCE,
+            help='耗时、峰值内存允许超出基线的比例，SQL 条数不允许增加',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as fileobj:
+                    baseline = json.load(fileobj)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'无法读取基线：{exc}')
+
+        try:
+            results = run_benchmarks(options['case'], options['repeat'], options['prefix'])
+        except BenchmarkError as exc:
+            raise CommandError(exc)
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<24} 中位数 {result['median_ms']:>9.2f} ms  最大 {result['max_ms']:>9.2f} ms  "
+                f"SQL {result['queries']:>4}  峰值内存 {result['peak_kb']:>9.1f} KB"
+            )
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w', encoding='utf-8') as fileobj:
+                json.dump(results, fileobj, ensure_ascii=False, indent=2)
+            self.stdout.write(f"基线已写入 {options['save_baseline']}")
+
+        if baseline is not None:
+            regressions = find_regressions(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('性能回退：\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS(f'未超出基线（容差 {options["tolerance"]:.0%}）'))
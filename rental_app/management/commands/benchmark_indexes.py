@@ -0,0 +1,106 @@
+import re
+from datetime import date
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Sum
+from rental_app.availability import vacant_properties
+from rental_app.benchmarks import seed_dataset
+from rental_app.models import ContractProperty, Property, Fee, Payment
+from rental_app.periods import month_range
+
+
+def hot_paths(contract_id, fee_id, period_start):
+    """各接口、任务实际执行的查询"""
+    month_start, next_month = month_range(period_start)
+    return [
+        ('receivables 翻页', Fee.objects.filter(is_collected=False).order_by('-id')[:51]),
+        ('payables 翻页', Fee.objects.filter(overdue_status='overdue', is_collected=False).order_by('-id')[:51]),
+        ('缴费通知 所属期', Fee.objects.filter(
+            period_start__gte=month_start, period_start__lt=next_month,
+            is_collected=False, overdue_status='on_time')),
+        ('逾期标记 到期日', Fee.objects.filter(
+            is_collected=False, overdue_status='on_time', due_date__lt=month_start)),
+        ('合同余额汇总', Fee.objects.filter(contract_id=contract_id, is_collected=False)
+            .values('contract').annotate(total=Sum('amount'))),
+        ('费用已付总额', Payment.objects.filter(fee_id=fee_id)
+            .values('fee').annotate(total=Sum('amount'))),
+        ('available 翻页', Property.objects.filter(rental_status='available').order_by('-id')[:51]),
+        ('空置房源 租期', vacant_properties(month_start, next_month).order_by('-id')[:51]),
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        '对费用、支付、房源的热点查询执行 EXPLAIN ANALYZE，对比删除新增索引（含租期排他约束的 GiST 索引）前后的执行计划和耗时。'
+        '删除索引与造数都在事务内进行并最终回滚，但会短暂持有表锁，请勿在生产库运行'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed-contracts', type=int, default=0,
+            help='先在事务内生成指定数量的合同（与 seed_benchmark_data 相同的数据），默认使用现有数据',
+        )
+        parser.add_argument('--months', type=int, default=36, help='造数时每份合同的月数')
+        parser.add_argument('--plans', action='store_true', help='输出完整执行计划')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed_contracts']:
+                self.seed(options['seed_contracts'], options['months'])
+
+            contract_id = Fee.objects.order_by('-contract_id').values_list('contract_id', flat=True).first()
+            fee_id = Payment.objects.order_by('-fee_id').values_list('fee_id', flat=True).first()
+            period_start = Fee.objects.filter(period_start__isnull=False).order_by(
+                '-period_start').values_list('period_start', flat=True).first() or date.today()
+            paths = hot_paths(contract_id, fee_id, period_start)
+
+            before = {}
+            with transaction.atomic():
+                self.drop_indexes()
+                for name, queryset in paths:
+                    before[name] = self.explain(queryset)
+                transaction.set_rollback(True)
+            after = {name: self.explain(queryset) for name, queryset in paths}
+
+            for name, _ in paths:
+                self.report(name, before[name], after[name], options['plans'])
+            transaction.set_rollback(True)
+
+    def seed(self, contracts, months):
+        counts = seed_dataset(
+            tenants=max(1, contracts // 4), properties=contracts, contracts=contracts,
+            months=months, start=date(2020, 1, 1),
+        )
+        self.stdout.write(f"已生成 {counts['contracts']} 份合同、{counts['fees']} 条费用")
+
+    def drop_indexes(self):
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            for model in (Fee, Payment, Property):
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX {quote(index.name)}')
+            # 造数留下的延迟外键检查先执行完，否则同一事务内的 ALTER TABLE 会报 pending trigger events
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for constraint in ContractProperty._meta.constraints:
+                cursor.execute(
+                    f'ALTER TABLE {quote(ContractProperty._meta.db_table)} DROP CONSTRAINT {quote(constraint.name)}'
+                )
+
+    def explain(self, queryset):
+        queryset.explain()  # 预热缓存
+        plan = queryset.explain(analyze=True, buffers=True)
+        match = re.search(r'Execution Time: ([\d.]+) ms', plan)
+        return plan, float(match.group(1)) if match else None
+
+    def report(self, name, before, after, show_plans):
+        (before_plan, before_ms), (after_plan, after_ms) = before, after
+        self.stdout.write(self.style.MIGRATE_HEADING(name))
+        self.stdout.write(f'  无索引: {before_ms:.3f} ms    有索引: {after_ms:.3f} ms')
+        if show_plans:
+            for label, plan in (('无索引', before_plan), ('有索引', after_plan)):
+                self.stdout.write(f'  --- {label} ---')
+                for line in plan.splitlines():
+                    self.stdout.write(f'  {line}')
+        else:
+            self.stdout.write(f'  无索引: {before_plan.splitlines()[0].strip()}')
+            self.stdout.write(f'  有索引: {after_plan.splitlines()[0].strip()}')
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+from rental_app.exports import EXPORT_COLUMNS, EXPORT_FORMATS, iter_csv, write_xlsx
+from rental_app.filters import apply_list_filters
+
+MODELS = {model._meta.model_name + 's': model for model in EXPORT_COLUMNS}
+
+
+class Command(BaseCommand):
+    help = '流式导出租户、合同、费用或支付记录为 CSV / XLSX，过滤参数与列表接口相同'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(MODELS), help='导出的数据')
+        parser.add_argument('--file-format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('-o', '--output', help='输出文件，CSV 默认输出到标准输出，XLSX 必须指定')
+        parser.add_argument(
+            '--filter', action='append', default=[], metavar='参数=值',
+            help='列表接口的查询参数，如 --filter period_from=2025-01-01，可重复使用',
+        )
+
+    def handle(self, *args, **options):
+        params = {}
+        for item in options['filter']:
+            name, sep, value = item.partition('=')
+            if not sep:
+                raise CommandError(f'过滤参数格式应为 参数=值：{item}')
+            params[name] = value
+        try:
+            queryset = apply_list_filters(MODELS[options['model']].objects.all(), params)
+        except ValidationError as exc:
+            raise CommandError(exc.detail)
+
+        output = options['output']
+        if options['file_format'] == 'xlsx':
+            if not output:
+                raise CommandError('导出 XLSX 需要用 --output 指定文件')
+            with open(output, 'wb') as fileobj:
+                write_xlsx(queryset, fileobj)
+        elif output:
+            with open(output, 'w', encoding='utf-8', newline='') as fileobj:
+                fileobj.writelines(iter_csv(queryset))
+        else:
+            for line in iter_csv(queryset):
+                self.stdout.write(line, ending='')
+            return
+        self.stdout.write(self.style.SUCCESS(f'已导出到 {output}'))
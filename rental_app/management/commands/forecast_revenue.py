@@ -0,0 +1,53 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from rental_app.forecast import DEFAULT_HISTORY_MONTHS, MAX_FORECAST_MONTHS, build_revenue_forecast
+from rental_app.periods import term_period_start
+
+
+class Command(BaseCommand):
+    help = '按有效合同预测未来每月的计费（租金、物业管理费）和按历史回收率估算的回收金额'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, default=12,
+            help=f'预测月数（默认 12，最多 {MAX_FORECAST_MONTHS}）',
+        )
+        parser.add_argument(
+            '--start',
+            help='起始月份 YYYY-MM（默认本月）',
+        )
+        parser.add_argument(
+            '--history-months', type=int, default=DEFAULT_HISTORY_MONTHS,
+            help=f'计算回收率的历史月数（默认 {DEFAULT_HISTORY_MONTHS}）',
+        )
+        parser.add_argument(
+            '--json', action='store_true',
+            help='以 JSON 输出',
+        )
+
+    def handle(self, *args, **options):
+        if not 1 <= options['months'] <= MAX_FORECAST_MONTHS:
+            raise CommandError(f'--months 应为 1 到 {MAX_FORECAST_MONTHS}')
+        start = None
+        if options['start']:
+            start = term_period_start(options['start'])
+            if start is None:
+                raise CommandError('--start 格式应为 YYYY-MM')
+
+        forecast = build_revenue_forecast(
+            options['months'], start, history_months=options['history_months']
+        )
+        if options['json']:
+            self.stdout.write(json.dumps(forecast, cls=DjangoJSONEncoder, ensure_ascii=False, indent=2))
+            return
+
+        self.stdout.write(f"{'月份':<8} {'合同':>6} {'租金':>14} {'物业费':>12} {'推广费':>12} {'计费':>14} {'预计回收':>14}")
+        for row in forecast['results'] + [{'month': '合计', 'contracts': '', **forecast['totals']}]:
+            self.stdout.write(
+                f"{row['month']:<8} {row['contracts']:>6} {row['rent']:>14} {row['management_fee']:>12} "
+                f"{row['promotion_fee']:>12} {row['billed']:>14} {row['expected_collected']:>14}"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"有效合同 {forecast['contracts']} 份，历史回收率 {forecast['collection_rate']}%"
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from rental_app.schedule import backfill_fee_schedules
+from rental_app.tasks import backfill_fee_schedules_task
+
+
+class Command(BaseCommand):
+    help = '为合同生成从开始到结束每月的租金和物业管理费（跳过装修期、免租期），已存在的费用不会重复生成'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--contract', type=int, action='append', dest='contract_ids',
+            help='只处理指定合同，可重复使用；默认处理所有有效合同',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='每个事务处理的合同数（默认 500）',
+        )
+        parser.add_argument(
+            '--async', action='store_true', dest='run_async',
+            help='交给 Celery 任务在后台执行',
+        )
+
+    def handle(self, *args, **options):
+        if options['run_async']:
+            result = backfill_fee_schedules_task.delay(options['contract_ids'], options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(f'已提交任务 {result.id}'))
+            return
+
+        contracts, fees = backfill_fee_schedules(options['contract_ids'], options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'处理合同 {contracts} 份，新建费用 {fees} 条'))
@@ -0,0 +1,42 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from rental_app.imports import IMPORT_BATCH_SIZE, IMPORT_FORMATS, detect_encoding, run_import
+from rental_app.models import Tenant, Property, Contract
+
+MODELS = {'tenants': Tenant, 'properties': Property, 'contracts': Contract}
+
+
+class Command(BaseCommand):
+    help = '从 CSV 或 JSON Lines 文件批量导入租户、房源或合同，出错的行跳过并报告行号与原因'
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(MODELS), help='导入的数据')
+        parser.add_argument('path', help='导入文件')
+        parser.add_argument('--file-format', choices=IMPORT_FORMATS, help='默认按扩展名判断，.jsonl 以外按 CSV')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='完整校验并执行后回滚，不写入数据')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['file_format'] or ('jsonl' if path.endswith('.jsonl') else 'csv')
+        try:
+            with open(path, 'rb') as f:
+                encoding = detect_encoding(f)
+            if encoding is None:
+                raise CommandError('文件须为 UTF-8 或 GBK 编码')
+            with open(path, encoding=encoding, newline='') as lines:
+                report = run_import(
+                    MODELS[options['model']], lines, file_format,
+                    dry_run=options['dry_run'], batch_size=options['batch_size'],
+                )
+        except OSError as exc:
+            raise CommandError(exc)
+
+        for error in report['errors']:
+            self.stderr.write(f"第 {error['line']} 行: {json.dumps(error['errors'], ensure_ascii=False)}")
+        summary = f"共 {report['rows']} 行，导入 {report['created']} 行，出错 {len(report['errors'])} 行"
+        if 'fees' in report:
+            summary += f"，生成费用 {report['fees']} 条"
+        if report['dry_run']:
+            summary += '（试运行，未写入）'
+        self.stdout.write(self.style.SUCCESS(summary))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from rental_app.balances import find_balance_drift, refresh_contract_balances
+
+
+class Command(BaseCommand):
+    help = '按费用明细重算合同余额（应收、未结、逾期），检查并修复增量维护产生的偏差'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--contract', type=int, action='append', dest='contract_ids',
+            help='只检查指定合同，可重复使用',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='只报告偏差，不写回数据库',
+        )
+
+    def handle(self, *args, **options):
+        contract_ids = options['contract_ids']
+        drifted = list(find_balance_drift(contract_ids))
+
+        for contract in drifted:
+            self.stdout.write(
+                f"合同 {contract.id}: "
+                f"应收 {contract.current_receivable} -> {contract.expected_receivable}, "
+                f"未结 {contract.current_outstanding} -> {contract.expected_outstanding}, "
+                f"逾期 {contract.total_overdue} -> {contract.expected_overdue}"
+            )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('合同余额与费用明细一致'))
+            return
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'发现 {len(drifted)} 份合同余额存在偏差（未修复）'))
+            return
+
+        updated = refresh_contract_balances([contract.id for contract in drifted])
+        self.stdout.write(self.style.SUCCESS(f'已修复 {updated} 份合同的余额'))
@@ -0,0 +1,204 @@
+# rental_app/metrics.py
+
+import os
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+METRICS_INDEX_KEY = 'rental_app:metrics:processes'
+METRICS_KEY_PREFIX = 'rental_app:metrics:process:'
+# 进程快照的保留时间（秒），进程退出后其数据在此之后不再计入
+METRICS_PROCESS_TTL = 24 * 3600
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 耗时直方图各桶的上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 指标名: (类型, 说明)
+METRICS = {
+    'rental_http_requests_total': ('counter', '请求数，按路由、方法、状态码'),
+    'rental_http_request_duration_seconds': ('histogram', '请求总耗时'),
+    'rental_http_db_queries_total': ('counter', '请求执行的 SQL 条数'),
+    'rental_http_db_duration_seconds': ('histogram', '每个请求的 SQL 总耗时'),
+    'rental_http_response_bytes_total': ('counter', '响应字节数'),
+    'rental_task_duration_seconds': ('histogram', 'Celery 任务耗时，按任务和结束状态'),
+    'rental_task_items_total': ('counter', 'Celery 任务返回统计中的处理条数，按任务和统计项'),
+    'rental_cache_requests_total': ('counter', '列表读穿缓存的请求数，result 为 hit / miss / wait（等待其他请求写入）'),
+}
+
+
+class MetricsRegistry:
+    """
+    进程内的计数器和直方图。各进程（Web worker、Celery worker）按 METRICS_FLUSH_INTERVAL
+    把自己的累计值整体写入缓存，/metrics 读取所有进程的快照相加后输出；
+    多进程部署时缓存需使用 Redis 等共享后端。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.key = f'{METRICS_KEY_PREFIX}{socket.gethostname()}:{self.pid}'
+        # {(指标名, 标签元组): 值}；直方图的值为 [各桶计数..., +Inf 桶计数, 总和]
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def _check_fork(self):
+        # fork 出的子进程不继承父进程的累计值，避免重复计数
+        if os.getpid() != self.pid:
+            self.reset()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self._check_fork()
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(LATENCY_BUCKETS) + 2)
+            index = next(
+                (i for i, bound in enumerate(LATENCY_BUCKETS) if value <= bound), len(LATENCY_BUCKETS)
+            )
+            histogram[index] += 1
+            histogram[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            self._check_fork()
+            return {
+                'counters': dict(self.counters),
+                'histograms': {key: list(values) for key, values in self.histograms.items()},
+            }
+
+    def flush(self, force=False):
+        """把本进程的累计值写入缓存；未到刷新间隔时直接返回"""
+        now = time.monotonic()
+        if not force and now - self.flushed_at < getattr(settings, 'METRICS_FLUSH_INTERVAL', 10):
+            return
+        self.flushed_at = now
+        snapshot = self.snapshot()
+        cache.set(self.key, snapshot, METRICS_PROCESS_TTL)
+        # 索引的读改写不加锁，偶尔丢失的登记会在本进程下次刷新时补上
+        index = cache.get(METRICS_INDEX_KEY) or []
+        if self.key not in index:
+            cache.set(METRICS_INDEX_KEY, index + [self.key], None)
+
+
+registry = MetricsRegistry()
+
+
+def collect_metrics():
+    """读取所有进程的快照并相加，过期进程从索引中移除"""
+    registry.flush(force=True)
+    index = cache.get(METRICS_INDEX_KEY) or []
+    snapshots = cache.get_many(index)
+    if len(snapshots) < len(index):
+        cache.set(METRICS_INDEX_KEY, [key for key in index if key in snapshots], None)
+    counters, histograms = {}, {}
+    for snapshot in snapshots.values():
+        for key, value in snapshot['counters'].items():
+            counters[key] = counters.get(key, 0) + value
+        for key, values in snapshot['histograms'].items():
+            total = histograms.setdefault(key, [0] * len(values))
+            for i, value in enumerate(values):
+                total[i] += value
+    return counters, histograms
+
+
+def format_labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in items
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics(counters, histograms):
+    """按 Prometheus 文本格式输出，直方图的桶为累计计数"""
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        series = counters if kind == 'counter' else histograms
+        keys = sorted(key for key in series if key[0] == name)
+        if not keys:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for key in keys:
+            labels = key[1]
+            if kind == 'counter':
+                lines.append(f'{name}{format_labels(labels)} {format_value(series[key])}')
+                continue
+            *buckets, total = series[key]
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_value(total)}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class QueryStats:
+    """connection.execute_wrapper 的包装函数：统计执行的 SQL 条数和耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+def record_request(route, method, status, duration, queries, response_bytes):
+    registry.inc('rental_http_requests_total', route=route, method=method, status=status)
+    registry.observe('rental_http_request_duration_seconds', duration, route=route, method=method)
+    registry.inc('rental_http_db_queries_total', queries.count, route=route, method=method)
+    registry.observe('rental_http_db_duration_seconds', queries.duration, route=route, method=method)
+    registry.inc('rental_http_response_bytes_total', response_bytes, route=route, method=method)
+    registry.flush()
+
+
+# 正在执行的 Celery 任务的开始时间，按 task_id
+_task_started = {}
+
+
+def task_started(task_id):
+    _task_started[task_id] = time.perf_counter()
+
+
+def record_task(task_name, task_id, state, retval=None):
+    """记录任务耗时；任务返回统计字典时，其中的整数项计入处理条数"""
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        registry.observe(
+            'rental_task_duration_seconds', time.perf_counter() - started, task=task_name, state=state or 'UNKNOWN'
+        )
+    if isinstance(retval, dict):
+        for item, value in retval.items():
+            if isinstance(value, int) and not isinstance(value, bool):
+                registry.inc('rental_task_items_total', value, task=task_name, item=item)
+    # worker 进程可能长时间空闲，任务结束后立即写入
+    registry.flush(force=True)
@@ -0,0 +1,51 @@
+# rental_app/middleware.py
+
+import time
+from django.db import connection
+from .metrics import QueryStats, record_request
+
+
+def route_label(request):
+    """按 URL 名称（如 payment-list）归类，未匹配的请求统一记为 unmatched，避免标签数量随路径增长"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.view_name or match.route
+
+
+class RequestMetricsMiddleware:
+    """
+    记录每个请求的路由、状态码、耗时、SQL 条数和耗时、响应字节数，汇总到 metrics。
+    流式响应（导出、文件下载）在内容发送完毕后记录，耗时和 SQL 包括生成内容的部分。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryStats()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        if response.streaming:
+            content = response.streaming_content
+            response.streaming_content = self.stream(content, request, response, queries, started)
+        else:
+            self.record(request, response, queries, started, len(response.content))
+        return response
+
+    def stream(self, content, request, response, queries, started):
+        sent = 0
+        try:
+            with connection.execute_wrapper(queries):
+                for chunk in content:
+                    sent += len(chunk)
+                    yield chunk
+        finally:
+            self.record(request, response, queries, started, sent)
+
+    def record(self, request, response, queries, started, response_bytes):
+        record_request(
+            route_label(request), request.method, str(response.status_code),
+            time.perf_counter() - started, queries, response_bytes,
+        )
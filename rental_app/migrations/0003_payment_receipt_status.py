@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+def set_existing_receipt_status(apps, schema_editor):
+    Payment = apps.get_model('rental_app', 'Payment')
+    # 已有收据文件的记为已生成，其余此前生成失败
+    Payment.objects.exclude(receipt='').exclude(receipt__isnull=True).update(receipt_status='ready')
+    Payment.objects.filter(receipt_status='pending').update(receipt_status='failed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_app', '0002_contract_business_type_contract_contract_file_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='receipt_status',
+            field=models.CharField(choices=[('pending', '生成中'), ('ready', '已生成'), ('failed', '生成失败')], default='pending', max_length=20, verbose_name='收据状态'),
+        ),
+        migrations.RunPython(set_existing_receipt_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 4.2 on 2026-10-18 14:57
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def remove_duplicate_fees(apps, schema_editor):
+    """
+    加唯一约束前处理同一 (合同, 类别, term) 的重复费用：每组保留一条（优先已收取或有支付的，其次 id 最小的），
+    删除其余未收取且没有支付的费用，并按费用明细重算受影响合同的余额；
+    仍有多条已收取或有支付的费用时终止迁移并列出冲突的费用 id，需人工合并
+    """
+    Fee = apps.get_model('rental_app', 'Fee')
+    Payment = apps.get_model('rental_app', 'Payment')
+    Contract = apps.get_model('rental_app', 'Contract')
+
+    groups = (
+        Fee.objects.values('contract_id', 'category', 'term')
+        .annotate(n=Count('id')).filter(n__gt=1).order_by()
+    )
+    removable, conflicts, contract_ids = [], [], set()
+    for group in groups:
+        fees = list(
+            Fee.objects.filter(contract_id=group['contract_id'], category=group['category'], term=group['term'])
+            .order_by('id')
+        )
+        paid = set(Payment.objects.filter(fee__in=fees).values_list('fee_id', flat=True))
+        settled = [fee.id for fee in fees if fee.is_collected or fee.id in paid]
+        if len(settled) > 1:
+            conflicts.append(f"合同 {group['contract_id']} {group['category']} {group['term']}: 费用 {settled}")
+            continue
+        keep = settled[0] if settled else fees[0].id
+        removable.extend(fee.id for fee in fees if fee.id != keep)
+        contract_ids.add(group['contract_id'])
+
+    if conflicts:
+        raise RuntimeError(
+            '以下费用重复且已收取或有支付，请先合并后再执行迁移：\n' + '\n'.join(conflicts)
+        )
+    if not removable:
+        return
+
+    Fee.objects.filter(id__in=removable).delete()
+
+    def fee_total(**filters):
+        return Coalesce(
+            Subquery(
+                Fee.objects.filter(contract=OuterRef('pk'), **filters).order_by()
+                .values('contract').annotate(total=Sum('amount')).values('total')[:1]
+            ),
+            Value(0, output_field=models.DecimalField(max_digits=12, decimal_places=2)),
+        )
+
+    Contract.objects.filter(pk__in=contract_ids).update(
+        current_receivable=fee_total(is_collected=False),
+        current_outstanding=fee_total(is_collected=False, overdue_status='overdue'),
+        total_overdue=fee_total(overdue_status='overdue'),
+    )
+    # 删除触发的延迟外键检查先执行完，否则同一事务内随后的 ALTER TABLE 会报 pending trigger events
+    schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_app', '0003_payment_receipt_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_fees, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fee',
+            constraint=models.UniqueConstraint(fields=('contract', 'category', 'term'), name='unique_fee_per_term'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2 on 2026-10-18 14:59
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # 费用表较大，并发建索引避免长时间锁表
+    atomic = False
+
+    dependencies = [
+        ('rental_app', '0004_fee_unique_per_term'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='fee',
+            index=models.Index(fields=['contract', 'is_collected', 'overdue_status'], name='fee_contract_status_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fee',
+            index=models.Index(condition=models.Q(('is_collected', False)), fields=['-id'], name='fee_open_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fee',
+            index=models.Index(condition=models.Q(('is_collected', False)), fields=['overdue_status', '-id'], name='fee_open_overdue_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fee',
+            index=models.Index(fields=['term'], name='fee_term_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
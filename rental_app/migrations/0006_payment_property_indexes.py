@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 14:59
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('rental_app', '0005_fee_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['fee', 'amount'], name='payment_fee_amount_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='property',
+            index=models.Index(fields=['rental_status', '-id'], name='property_status_id_idx'),
+        ),
+    ]
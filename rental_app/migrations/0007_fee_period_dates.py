@@ -0,0 +1,69 @@
+# Generated by Django 4.2 on 2026-10-18 15:02
+
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+
+BATCH_SIZE = 10000
+
+# 与 rental_app/periods.py 中的规则一致：月度 term 的所属期为该月月初，
+# 到期日为该月的收租日（超出月末按月末），其他费用在合同收租日到期
+BACKFILL_SQL = """
+UPDATE {fee} f
+SET period_start = CASE WHEN f.term ~ '^[0-9]{{4}}-(0[1-9]|1[0-2])$' THEN to_date(f.term, 'YYYY-MM') END,
+    due_date = CASE
+        WHEN f.term ~ '^[0-9]{{4}}-(0[1-9]|1[0-2])$' THEN to_date(f.term, 'YYYY-MM') + LEAST(
+            EXTRACT(DAY FROM c.rent_collection_time)::int,
+            EXTRACT(DAY FROM to_date(f.term, 'YYYY-MM') + interval '1 month' - interval '1 day')::int
+        ) - 1
+        ELSE c.rent_collection_time
+    END
+FROM {contract} c
+WHERE c.id = f.contract_id AND f.id > %s AND f.id <= %s AND f.due_date IS NULL
+"""
+
+
+def backfill_period_dates(apps, schema_editor):
+    Fee = apps.get_model('rental_app', 'Fee')
+    Contract = apps.get_model('rental_app', 'Contract')
+    quote = schema_editor.connection.ops.quote_name
+    sql = BACKFILL_SQL.format(fee=quote(Fee._meta.db_table), contract=quote(Contract._meta.db_table))
+    max_id = Fee.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    # 迁移不在事务中执行，每批按主键范围单独提交，避免长时间持有大量行锁
+    with schema_editor.connection.cursor() as cursor:
+        for low in range(0, max_id, BATCH_SIZE):
+            cursor.execute(sql, [low, low + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+    # 费用表较大：分批回填、并发建索引
+    atomic = False
+
+    dependencies = [
+        ('rental_app', '0006_payment_property_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fee',
+            name='due_date',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='到期日'),
+        ),
+        migrations.AddField(
+            model_name='fee',
+            name='period_start',
+            field=models.DateField(blank=True, editable=False, null=True, verbose_name='所属期'),
+        ),
+        migrations.RunPython(backfill_period_dates, migrations.RunPython.noop),
+        AddIndexConcurrently(
+            model_name='fee',
+            index=models.Index(fields=['period_start'], name='fee_period_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='fee',
+            index=models.Index(condition=models.Q(('is_collected', False), ('overdue_status', 'on_time')), fields=['due_date'], name='fee_open_due_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='fee',
+            name='fee_term_prefix_idx',
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 15:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_app', '0008_payment_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='NotificationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('payment', '缴费通知'), ('overdue', '逾期缴费通知')], max_length=20)),
+                ('run_date', models.DateField(verbose_name='通知日期')),
+                ('status', models.CharField(choices=[('running', '发送中'), ('completed', '已完成')], default='running', max_length=20)),
+                ('chunks_total', models.PositiveIntegerField(default=0, verbose_name='分块数')),
+                ('chunks_done', models.PositiveIntegerField(default=0, verbose_name='已完成分块数')),
+                ('tenants', models.PositiveIntegerField(default=0)),
+                ('fees', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='notificationrun',
+            constraint=models.UniqueConstraint(fields=('kind', 'run_date'), name='unique_notification_run'),
+        ),
+        migrations.AddField(
+            model_name='notificationdelivery',
+            name='run',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='rental_app.notificationrun'),
+        ),
+        migrations.AddField(
+            model_name='notificationdelivery',
+            name='tenant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_deliveries', to='rental_app.tenant'),
+        ),
+        migrations.AddConstraint(
+            model_name='notificationdelivery',
+            constraint=models.UniqueConstraint(fields=('run', 'tenant'), name='unique_notification_delivery'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_app', '0009_notification_runs'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='notificationrun',
+            name='unique_notification_run',
+        ),
+        migrations.AddField(
+            model_name='notificationrun',
+            name='recipients',
+            field=models.ManyToManyField(blank=True, related_name='notification_runs', to='rental_app.tenant'),
+        ),
+        migrations.AlterField(
+            model_name='notificationrun',
+            name='kind',
+            field=models.CharField(choices=[('payment', '缴费通知'), ('overdue', '逾期缴费通知'), ('unpaid', '未缴费用提醒')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='notificationrun',
+            name='status',
+            field=models.CharField(choices=[('queued', '排队中'), ('running', '发送中'), ('completed', '已完成')], default='running', max_length=20),
+        ),
+        migrations.AddConstraint(
+            model_name='notificationrun',
+            constraint=models.UniqueConstraint(condition=models.Q(('kind', 'unpaid'), _negated=True), fields=('kind', 'run_date'), name='unique_notification_run'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 4.2 on 2026-10-18 15:54
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# 按合同的起止日期和状态回填已有关联；起止日期颠倒的合同不写租期（排他约束忽略 NULL）
+BACKFILL_SQL = """
+UPDATE rental_app_contract_properties cp
+SET period = CASE WHEN c.start_date <= c.end_date THEN daterange(c.start_date, c.end_date, '[]') END,
+    active = c.status = 'active'
+FROM rental_app_contract c
+WHERE c.id = cp.contract_id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_app', '0010_notification_jobs'),
+    ]
+
+    operations = [
+        # 沿用自动生成的关联表 rental_app_contract_properties（列名和唯一约束不变），只在状态中改为显式的关联模型
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ContractProperty',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('contract', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rental_app.contract')),
+                        ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='rental_app.property')),
+                    ],
+                    options={
+                        'db_table': 'rental_app_contract_properties',
+                        'unique_together': {('contract', 'property')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='contract',
+                    name='properties',
+                    field=models.ManyToManyField(related_name='contracts', through='rental_app.ContractProperty', to='rental_app.property'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='contractproperty',
+            name='period',
+            field=django.contrib.postgres.fields.ranges.DateRangeField(blank=True, editable=False, null=True, verbose_name='租期'),
+        ),
+        migrations.AddField(
+            model_name='contractproperty',
+            name='active',
+            field=models.BooleanField(default=True, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, migrations.RunSQL.noop),
+        # 已有数据中存在租期重叠的有效合同时，此步会失败并列出冲突的房源和租期，需先处理这些合同
+        migrations.AddConstraint(
+            model_name='contractproperty',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('active', True)), expressions=[(models.Func(models.F('property'), models.F('property'), models.Value('[]'), function='int8range', output_field=django.contrib.postgres.fields.ranges.BigIntegerRangeField()), '&&'), ('period', '&&')], name='exclude_overlapping_leases'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-18 18:20
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rental_app', '0011_contract_lease_periods'),
+    ]
+
+    operations = [
+        # 约束的 GiST 索引改为租期在前，只带租期条件的空置房源查询可以直接按第一列检索
+        migrations.RemoveConstraint(
+            model_name='contractproperty',
+            name='exclude_overlapping_leases',
+        ),
+        migrations.AddConstraint(
+            model_name='contractproperty',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('active', True)), expressions=[('period', '&&'), (models.Func(models.F('property'), models.F('property'), models.Value('[]'), function='int8range', output_field=django.contrib.postgres.fields.ranges.BigIntegerRangeField()), '&&')], name='exclude_overlapping_leases'),
+        ),
+    ]
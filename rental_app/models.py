@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import BigIntegerRangeField, DateRangeField, RangeOperators
 from django.db import models
-from django.db.models import Sum
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 import tempfile
@@ -32,12 +33,19 @@ class Property(models.Model):
     current_value = models.DecimalField(max_digits=12, decimal_places=2)
     maintenance_status = models.TextField(blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # available 接口与数据分析按租赁状态过滤，列表按 id 倒序翻页
+            models.Index(fields=['rental_status', '-id'], name='property_status_id_idx'),
+        ]
+
     def __str__(self):
         return f"{self.house_number} - {self.address}"
 
     def update_rental_status(self, new_status):
+        from .occupancy import set_rental_status
+        set_rental_status([self.pk], new_status)
         self.rental_status = new_status
-        self.save()
 
 class Contract(models.Model):
     STATUS_CHOICES = [
@@ -46,8 +54,11 @@ class Contract(models.Model):
         ('expired', '过期'),
     ]
 
+    # 由费用增量维护的余额字段，见 rental_app/balances.py
+    BALANCE_FIELDS = ('current_receivable', 'current_outstanding', 'total_overdue')
+
     tenant = models.ForeignKey(Tenant, related_name='contracts', on_delete=models.CASCADE)
-    properties = models.ManyToManyField(Property, related_name='contracts')
+    properties = models.ManyToManyField(Property, related_name='contracts', through='ContractProperty')
     start_date = models.DateField()
     end_date = models.DateField()
     monthly_rent = models.DecimalField(max_digits=10, decimal_places=2)
@@ -92,15 +103,40 @@ class Contract(models.Model):
 
     def save(self, *args, **kwargs):
         is_new = self.pk is None
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            # 余额字段由费用原子增量维护，常规保存不能用内存中的旧值覆盖
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.BALANCE_FIELDS
+            ]
         super().save(*args, **kwargs)
         
         if is_new:
             # 只创建初始费用，房源状态已在序列化器中处理
             self.create_initial_fees()
+        elif self.rent_collection_time_changed(kwargs.get('update_fields')):
+            # 费用到期日取决于收租日
+            from .periods import refresh_fee_dates
+            refresh_fee_dates([self.pk])
+        self._loaded_rent_collection_time = self.rent_collection_time
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的收租日，保存时只在收租日变化后重算费用到期日
+        if 'rent_collection_time' in field_names:
+            instance._loaded_rent_collection_time = instance.rent_collection_time
+        return instance
+
+    def rent_collection_time_changed(self, update_fields=None):
+        if update_fields is not None and 'rent_collection_time' not in update_fields:
+            return False
+        # 没有加载时的值（如只加载了部分字段）时按已变化处理
+        return getattr(self, '_loaded_rent_collection_time', None) != self.rent_collection_time
 
     def create_initial_fees(self):
         from .models import Fee
-        # 创建保证金费用
+        # 创建保证金费用（月度租金和物业管理费由 rental_app/schedule.py 生成）
         Fee.objects.create(
             contract=self,
             category='deposit',
@@ -108,14 +144,40 @@ class Contract(models.Model):
             term='一次性',
             is_collected=False
         )
-        # 创建首月物业管理费
-        Fee.objects.create(
-            contract=self,
-            category='management_fee',
-            amount=self.management_fee,
-            term=self.start_date.strftime('%Y-%m'),
-            is_collected=False
-        )
+
+class ContractProperty(models.Model):
+    """
+    合同与房源的关联。冗余合同的租期（period，闭区间的日期范围）和是否有效（active），
+    由 rental_app/availability.py 在关联或合同变化时同步，用于按日期查询空置房源，
+    并由排他约束在数据库层面防止同一房源的有效合同租期重叠
+    """
+    contract = models.ForeignKey(Contract, on_delete=models.CASCADE)
+    property = models.ForeignKey(Property, on_delete=models.CASCADE)
+    period = DateRangeField(null=True, blank=True, editable=False, verbose_name='租期')
+    active = models.BooleanField(default=True, editable=False)
+
+    class Meta:
+        db_table = 'rental_app_contract_properties'
+        unique_together = [('contract', 'property')]
+        constraints = [
+            # 房源 id 写成单点范围 [id, id]，两列都使用内置的 GiST range_ops，不依赖 btree_gist 扩展；
+            # 租期放在第一列，约束自带的 GiST 索引也用于只按租期查询空置房源（vacant_properties）
+            ExclusionConstraint(
+                name='exclude_overlapping_leases',
+                expressions=[
+                    ('period', RangeOperators.OVERLAPS),
+                    (
+                        models.Func(
+                            models.F('property'), models.F('property'), models.Value('[]'),
+                            function='int8range', output_field=BigIntegerRangeField(),
+                        ),
+                        RangeOperators.OVERLAPS,
+                    ),
+                ],
+                condition=models.Q(active=True),
+            ),
+        ]
+
 
 class Fee(models.Model):
     CATEGORY_CHOICES = [
@@ -142,27 +204,91 @@ class Fee(models.Model):
     category = models.CharField(max_length=50, choices=CATEGORY_CHOICES)
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     term = models.CharField(max_length=50)  # 例如 '2025-01'
+    # 由 term 和合同收租日推导，见 rental_app/periods.py
+    period_start = models.DateField(blank=True, null=True, editable=False, verbose_name='所属期')
+    due_date = models.DateField(blank=True, null=True, editable=False, verbose_name='到期日')
     is_collected = models.BooleanField(default=False)
     overdue_status = models.CharField(max_length=20, choices=OVERDUE_STATUS_CHOICES, default='on_time')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES, blank=True, null=True)
     receipt = models.FileField(upload_to='receipts/', blank=True, null=True)
     bank_slip = models.FileField(upload_to='bank_slips/', blank=True, null=True)
 
+    class Meta:
+        constraints = [
+            # 同一合同同一期同类费用只能有一条，保证费用计划生成幂等
+            models.UniqueConstraint(fields=['contract', 'category', 'term'], name='unique_fee_per_term'),
+        ]
+        indexes = [
+            # 合同余额汇总、对账按合同和收取/逾期状态过滤
+            models.Index(fields=['contract', 'is_collected', 'overdue_status'], name='fee_contract_status_idx'),
+            # receivables：未收费用按 id 倒序翻页
+            models.Index(fields=['-id'], name='fee_open_id_idx', condition=models.Q(is_collected=False)),
+            # payables、逾期标记、通知任务：未收费用按逾期状态过滤
+            models.Index(
+                fields=['overdue_status', '-id'], name='fee_open_overdue_idx',
+                condition=models.Q(is_collected=False),
+            ),
+            # 通知任务、列表接口、数据分析按所属期范围查询
+            models.Index(fields=['period_start'], name='fee_period_start_idx'),
+            # 逾期标记：按时状态的未收费用按到期日范围查询
+            models.Index(
+                fields=['due_date'], name='fee_open_due_idx',
+                condition=models.Q(is_collected=False, overdue_status='on_time'),
+            ),
+        ]
+
     def __str__(self):
         return f"{self.category} - {self.amount} - {self.contract}"
 
+    BALANCE_STATE_FIELDS = ('contract_id', 'amount', 'is_collected', 'overdue_status')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 记录加载时的状态，保存时据此计算合同余额的差额
+        if all(name in field_names for name in cls.BALANCE_STATE_FIELDS):
+            instance._balance_state = instance.get_balance_state()
+        return instance
+
+    def get_balance_state(self):
+        return tuple(getattr(self, name) for name in self.BALANCE_STATE_FIELDS)
+
+    def set_period_dates(self):
+        from .periods import fee_due_date, term_period_start
+        self.period_start = term_period_start(self.term)
+        self.due_date = fee_due_date(self.period_start, self.contract.rent_collection_time)
+
     def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            self.set_period_dates()
+        elif 'term' in update_fields:
+            self.set_period_dates()
+            kwargs['update_fields'] = {*update_fields, 'period_start', 'due_date'}
+        if self._state.adding:
+            previous = None
+        elif hasattr(self, '_balance_state'):
+            previous = self._balance_state
+        else:
+            previous = Fee.objects.filter(pk=self.pk).values_list(*self.BALANCE_STATE_FIELDS).first()
         super().save(*args, **kwargs)
         # 更新合同状态
-        self.update_contract_status()
+        self.update_contract_status(previous, kwargs.get('update_fields'))
 
-    def update_contract_status(self):
-        contract = self.contract
-        # 更新合同相关金额
-        contract.current_receivable = contract.fees.filter(is_collected=False).aggregate(total=Sum('amount'))['total'] or 0
-        contract.current_outstanding = contract.fees.filter(is_collected=False, overdue_status='overdue').aggregate(total=Sum('amount'))['total'] or 0
-        contract.total_overdue = contract.fees.filter(overdue_status='overdue').aggregate(total=Sum('amount'))['total'] or 0
-        contract.save()
+    def update_contract_status(self, previous=None, update_fields=None):
+        """按费用新旧状态的差额原子更新合同余额，不再重新汇总整份合同的费用"""
+        from .balances import apply_fee_change
+        current = self.get_balance_state()
+        if previous is not None and update_fields is not None:
+            # 只保存了部分字段时，未保存的字段在数据库中仍是旧值
+            saved = {self._meta.get_field(name).attname for name in update_fields}
+            current = tuple(
+                value if name in saved else old
+                for name, value, old in zip(self.BALANCE_STATE_FIELDS, current, previous)
+            )
+        contract = self.contract if Fee.contract.is_cached(self) else None
+        apply_fee_change(previous, current, contract)
+        self._balance_state = current
 
 class Payment(models.Model):
     PAYMENT_METHOD_CHOICES = [
@@ -173,11 +299,33 @@ class Payment(models.Model):
         ('other', '其他'),
     ]
 
+    RECEIPT_STATUS_CHOICES = [
+        ('pending', '生成中'),
+        ('ready', '已生成'),
+        ('failed', '生成失败'),
+    ]
+
     fee = models.ForeignKey(Fee, related_name='payments', on_delete=models.CASCADE)
     payment_date = models.DateTimeField(auto_now_add=True)
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES)
     receipt = models.FileField(upload_to='payment_receipts/', blank=True, null=True)
+    receipt_status = models.CharField(
+        max_length=20, choices=RECEIPT_STATUS_CHOICES, default='pending', verbose_name='收据状态'
+    )
+    reference = models.CharField(max_length=64, blank=True, default='', verbose_name='银行流水号')
+
+    class Meta:
+        constraints = [
+            # 同一笔银行流水只能记账一次，防止对账批次重复导入
+            models.UniqueConstraint(
+                fields=['reference'], name='unique_payment_reference', condition=~models.Q(reference=''),
+            ),
+        ]
+        indexes = [
+            # 已支付总额（按费用 SUM(amount)）可走仅索引扫描
+            models.Index(fields=['fee', 'amount'], name='payment_fee_amount_idx'),
+        ]
 
     def __str__(self):
         return f"Payment {self.id} - {self.amount}"
@@ -208,4 +356,57 @@ class Payment(models.Model):
             return None
         except Exception as e:
             logger.error(f"生成收据时发生错误: {str(e)}")
-            return None
\ No newline at end of file
+            return None
+
+class NotificationRun(models.Model):
+    """
+    一次通知任务：每日的缴费、逾期通知，或前台按租户、楼栋发起的未缴费用提醒（recipients 为通知对象）。
+    按租户分块并行发送，各块完成时累加计数
+    """
+    KIND_CHOICES = [
+        ('payment', '缴费通知'),
+        ('overdue', '逾期缴费通知'),
+        ('unpaid', '未缴费用提醒'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', '排队中'),
+        ('running', '发送中'),
+        ('completed', '已完成'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    run_date = models.DateField(verbose_name='通知日期')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    recipients = models.ManyToManyField(Tenant, related_name='notification_runs', blank=True)
+    chunks_total = models.PositiveIntegerField(default=0, verbose_name='分块数')
+    chunks_done = models.PositiveIntegerField(default=0, verbose_name='已完成分块数')
+    tenants = models.PositiveIntegerField(default=0)
+    fees = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            # 同一天同类的每日通知只执行一次，beat 重复触发时不会重复发送
+            models.UniqueConstraint(
+                fields=['kind', 'run_date'], name='unique_notification_run', condition=~models.Q(kind='unpaid'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.run_date}"
+
+
+class NotificationDelivery(models.Model):
+    """已成功发送的租户，分块重试时跳过"""
+    run = models.ForeignKey(NotificationRun, related_name='deliveries', on_delete=models.CASCADE)
+    tenant = models.ForeignKey(Tenant, related_name='notification_deliveries', on_delete=models.CASCADE)
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'tenant'], name='unique_notification_delivery'),
+        ]
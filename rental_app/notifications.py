@@ -0,0 +1,217 @@
+# rental_app/notifications.py
+
+import logging
+import time
+from itertools import groupby
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F, Q
+from django.template.loader import render_to_string
+from django.utils import timezone
+from .models import Fee, NotificationDelivery, NotificationRun
+from .periods import month_range
+
+logger = logging.getLogger(__name__)
+
+# 通知类型: (邮件主题, 模板)
+NOTIFICATION_KINDS = {
+    'payment': ("缴费通知", 'emails/payment_notification.html'),
+    'overdue': ("逾期缴费通知", 'emails/overdue_notification.html'),
+    'unpaid': ("费用缴纳提醒", 'emails/unpaid_notification.html'),
+}
+
+# 每个分块任务负责的租户数
+DEFAULT_NOTIFICATION_CHUNK_SIZE = 500
+
+# 前台一次提醒最多列出的租户 id 数（按楼栋地址选择的租户不受此限制）
+NOTIFICATION_JOB_MAX_TENANTS = 1000
+
+RUN_COUNTERS = ('tenants', 'fees', 'sent', 'failed')
+
+
+def notification_fees(kind, run_date, recipients=None):
+    """
+    通知涉及的费用：缴费通知为 run_date 所在月份未缴、未逾期的费用，逾期通知为所有未缴的逾期费用，
+    未缴费用提醒为 recipients（租户查询集或 id 列表）的所有未缴费用
+    """
+    if kind == 'unpaid':
+        return Fee.objects.filter(contract__tenant__in=recipients, is_collected=False)
+    if kind == 'payment':
+        month_start, next_month = month_range(run_date)
+        return Fee.objects.filter(
+            period_start__gte=month_start,
+            period_start__lt=next_month,
+            is_collected=False,
+            overdue_status='on_time'
+        )
+    return Fee.objects.filter(overdue_status='overdue', is_collected=False)
+
+
+def tenant_chunks(fees, chunk_size=None):
+    """
+    按租户 id 把费用切成键集范围 [(起始租户 id, 结束租户 id)]，每块 chunk_size 个租户；
+    分块任务按范围查询，不需要传递 id 列表
+    """
+    chunk_size = chunk_size or getattr(settings, 'NOTIFICATION_CHUNK_SIZE', DEFAULT_NOTIFICATION_CHUNK_SIZE)
+    tenant_ids = list(
+        fees.order_by('contract__tenant_id').values_list('contract__tenant_id', flat=True).distinct()
+    )
+    return [
+        (tenant_ids[i], tenant_ids[min(i + chunk_size, len(tenant_ids)) - 1])
+        for i in range(0, len(tenant_ids), chunk_size)
+    ]
+
+
+def run_fees(run):
+    recipients = run.recipients.values('id') if run.kind == 'unpaid' else None
+    return notification_fees(run.kind, run.run_date, recipients)
+
+
+def plan_notification_run(run):
+    """切分 run 的通知范围并标记为发送中，返回分块列表；没有需要通知的租户时直接完成"""
+    chunks = tenant_chunks(run_fees(run))
+    run.chunks_total = len(chunks)
+    run.chunks_done = 0
+    run.status = 'running' if chunks else 'completed'
+    run.finished_at = None if chunks else timezone.now()
+    run.save(update_fields=['chunks_total', 'chunks_done', 'status', 'finished_at'])
+    return chunks
+
+
+def start_notification_run(kind, run_date, resume=False):
+    """
+    登记当天的通知执行并返回 (run, 分块列表)。当天已有执行记录时返回 (run, None) 不再分发，
+    resume 为 True 时重新分发未完成的执行：已发送的租户由分块任务跳过
+    """
+    with transaction.atomic():
+        run, created = NotificationRun.objects.select_for_update().get_or_create(kind=kind, run_date=run_date)
+        if not created and (run.status == 'completed' or not resume):
+            return run, None
+        return run, plan_notification_run(run)
+
+
+def unpaid_recipients(tenant_ids=(), address=None):
+    """
+    未缴费用提醒的通知对象：tenant_ids 中的租户，加上地址以 address 开头的房源（如整栋楼）上有效合同的租户，
+    只保留有未缴费用的租户，返回排序后的 id 列表
+    """
+    tenants = Q(contract__tenant_id__in=tenant_ids)
+    if address:
+        tenants |= Q(contract__status='active', contract__properties__address__startswith=address)
+    return list(
+        Fee.objects.filter(tenants, is_collected=False)
+        .order_by('contract__tenant_id').values_list('contract__tenant_id', flat=True).distinct()
+    )
+
+
+def create_notification_job(tenant_ids):
+    """登记一次未缴费用提醒，分块和发送由 Celery 任务在后台完成"""
+    run = NotificationRun.objects.create(kind='unpaid', run_date=timezone.localdate(), status='queued')
+    NotificationRun.recipients.through.objects.bulk_create(
+        [NotificationRun.recipients.through(notificationrun=run, tenant_id=tenant_id) for tenant_id in tenant_ids]
+    )
+    return run
+
+
+def send_fee_digests(fees, subject, template_name, run=None):
+    """
+    按租户合并费用，每个租户一封摘要邮件；复用同一个邮件连接，
+    按 NOTIFICATION_EMAIL_BATCH_SIZE 分批发送，返回发送统计。
+    传入 run 时跳过该次执行中已发送的租户，每批发送后登记送达并累加 run 的计数。
+    发送出错（如 SMTP 连接中断）时异常向上抛出，由分块任务重试，已送达的租户不会重复发送
+    """
+    batch_size = getattr(settings, 'NOTIFICATION_EMAIL_BATCH_SIZE', 100)
+    stats = {'tenants': 0, 'fees': 0, 'sent': 0, 'failed': 0}
+    started = time.monotonic()
+
+    if run is not None:
+        fees = fees.exclude(contract__tenant__notification_deliveries__run=run)
+    fees = fees.select_related('contract__tenant').order_by('contract__tenant_id', 'id')
+    with get_connection() as connection:
+        batch = []
+        grouped = groupby(fees.iterator(chunk_size=2000), key=lambda fee: fee.contract.tenant_id)
+        for _, tenant_fees in grouped:
+            tenant_fees = list(tenant_fees)
+            tenant = tenant_fees[0].contract.tenant
+            message = EmailMessage(
+                subject,
+                render_to_string(template_name, {
+                    'tenant': tenant,
+                    'fees': tenant_fees,
+                    'total_amount': sum(fee.amount for fee in tenant_fees),
+                }),
+                settings.DEFAULT_FROM_EMAIL,
+                [tenant.email],
+                connection=connection,
+            )
+            message.content_subtype = 'html'
+            batch.append((tenant.id, len(tenant_fees), message))
+            if len(batch) >= batch_size:
+                _send_batch(connection, batch, stats, run)
+                batch = []
+        if batch:
+            _send_batch(connection, batch, stats, run)
+
+    duration = time.monotonic() - started
+    stats['duration'] = round(duration, 3)
+    stats['per_second'] = round(stats['sent'] / duration, 2) if duration else stats['sent']
+    logger.info(
+        f"{subject}: 租户 {stats['tenants']}，费用 {stats['fees']}，"
+        f"成功 {stats['sent']}，失败 {stats['failed']}，{stats['per_second']} 封/秒"
+    )
+    return stats
+
+
+def _send_batch(connection, batch, stats, run=None):
+    """
+    逐封发送以区分成功和失败的租户（连接在整批之间复用）；即使中途出错，
+    已发送的租户也会登记，失败的租户不登记，重试时重新发送
+    """
+    delivered = []
+    counts = dict.fromkeys(RUN_COUNTERS, 0)
+    try:
+        for tenant_id, fee_count, message in batch:
+            sent = connection.send_messages([message]) or 0
+            counts['tenants'] += 1
+            counts['fees'] += fee_count
+            if sent:
+                counts['sent'] += 1
+                delivered.append(tenant_id)
+            else:
+                counts['failed'] += 1
+    finally:
+        for name, value in counts.items():
+            stats[name] += value
+        if run is not None and counts['tenants']:
+            with transaction.atomic():
+                NotificationDelivery.objects.bulk_create(
+                    [NotificationDelivery(run=run, tenant_id=tenant_id) for tenant_id in delivered],
+                    ignore_conflicts=True,
+                )
+                NotificationRun.objects.filter(pk=run.pk).update(
+                    **{name: F(name) + value for name, value in counts.items()}
+                )
+
+
+def send_notification_chunk(run_id, first_tenant_id, last_tenant_id):
+    """发送一个租户范围的通知并把分块计入 run 的进度"""
+    run = NotificationRun.objects.get(pk=run_id)
+    subject, template_name = NOTIFICATION_KINDS[run.kind]
+    fees = run_fees(run).filter(
+        contract__tenant_id__gte=first_tenant_id, contract__tenant_id__lte=last_tenant_id,
+    )
+    stats = send_fee_digests(fees, subject, template_name, run=run)
+    NotificationRun.objects.filter(pk=run_id).update(chunks_done=F('chunks_done') + 1)
+    return stats
+
+
+def finish_notification_run(run_id):
+    """所有分块完成后标记执行结束，返回 run 的汇总计数"""
+    NotificationRun.objects.filter(pk=run_id).update(status='completed', finished_at=timezone.now())
+    run = NotificationRun.objects.get(pk=run_id)
+    logger.info(
+        f"{run}: 分块 {run.chunks_done}/{run.chunks_total}，租户 {run.tenants}，"
+        f"成功 {run.sent}，失败 {run.failed}"
+    )
+    return {name: getattr(run, name) for name in RUN_COUNTERS}
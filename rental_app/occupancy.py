@@ -0,0 +1,37 @@
+# rental_app/occupancy.py
+
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from .analytics import invalidate_kpi_snapshot
+from .caching import invalidate_list_cache
+from .models import ContractProperty, Property
+
+
+def set_rental_status(property_ids, status):
+    """
+    房源租赁状态的统一入口：用一条 UPDATE 把一批房源改为 status，已是该状态的行不重复写入。
+    property_ids 可以是主键集合，也可以是 values('id') 子查询。返回实际更新的行数。
+    有更新时使数据分析快照和房源列表缓存失效。
+    """
+    updated = (
+        Property.objects.filter(id__in=property_ids)
+        .exclude(rental_status=status)
+        .update(rental_status=status)
+    )
+    if updated:
+        transaction.on_commit(invalidate_kpi_snapshot)
+        invalidate_list_cache('properties')
+    return updated
+
+
+def release_properties(property_ids, exclude_contracts=()):
+    """
+    合同删除、终止或移除房源后调用：只把不再有有效合同关联（ContractProperty.active）的房源改为未租赁，
+    同一房源上还有其他有效合同时保持已出租。exclude_contracts 为即将删除、关联行尚在的合同
+    """
+    leased = ContractProperty.objects.filter(active=True, property_id=OuterRef('pk'))
+    if exclude_contracts:
+        leased = leased.exclude(contract_id__in=exclude_contracts)
+    return set_rental_status(
+        Property.objects.filter(id__in=property_ids).exclude(Exists(leased)).values('id'), 'available'
+    )
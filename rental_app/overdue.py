@@ -0,0 +1,56 @@
+# rental_app/overdue.py
+
+import time
+from datetime import date, timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from .analytics import invalidate_kpi_snapshot
+from .models import Contract, Fee
+
+# 一条语句完成：把到期未缴的费用标记为逾期，并按合同汇总差额更新合同的未结、逾期金额。
+# 到期日（due_date）在费用写入时按所属期和合同收租日计算，见 rental_app/periods.py
+MARK_OVERDUE_SQL = """
+WITH marked AS (
+    UPDATE {fee}
+    SET overdue_status = 'overdue'
+    WHERE NOT is_collected AND overdue_status = 'on_time' AND due_date < %s
+    RETURNING contract_id, amount
+),
+per_contract AS (
+    SELECT contract_id, SUM(amount) AS total, COUNT(*) AS fees
+    FROM marked
+    GROUP BY contract_id
+)
+UPDATE {contract} c
+SET current_outstanding = c.current_outstanding + per_contract.total,
+    total_overdue = c.total_overdue + per_contract.total
+FROM per_contract
+WHERE c.id = per_contract.contract_id
+RETURNING per_contract.fees
+"""
+
+
+def mark_overdue_fees(as_of=None):
+    """
+    把截至 as_of（默认今天，扣除 OVERDUE_GRACE_DAYS 宽限天数）已到期未缴的费用标记为逾期，
+    只调整受影响合同的余额。返回 {'fees', 'contracts', 'duration'}。
+    """
+    as_of = as_of or date.today()
+    cutoff = as_of - timedelta(days=getattr(settings, 'OVERDUE_GRACE_DAYS', 0))
+    sql = MARK_OVERDUE_SQL.format(
+        fee=connection.ops.quote_name(Fee._meta.db_table),
+        contract=connection.ops.quote_name(Contract._meta.db_table),
+    )
+
+    started = time.monotonic()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [cutoff])
+            per_contract = [row[0] for row in cursor.fetchall()]
+        if per_contract:
+            transaction.on_commit(invalidate_kpi_snapshot)
+    return {
+        'fees': sum(per_contract),
+        'contracts': len(per_contract),
+        'duration': round(time.monotonic() - started, 3),
+    }
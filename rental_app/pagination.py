@@ -0,0 +1,11 @@
+# rental_app/pagination.py
+
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """按主键做游标分页，翻到多深每页的查询代价都不变"""
+    ordering = '-id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
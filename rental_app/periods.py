@@ -0,0 +1,67 @@
+# rental_app/periods.py
+
+import calendar
+import re
+from datetime import date, timedelta
+from django.db import connection
+
+# 月度费用的 term 为 YYYY-MM，其他取值（如 '一次性'）没有所属期
+MONTH_TERM = re.compile(r'^(\d{4})-(0[1-9]|1[0-2])$')
+
+# 按 term 和合同收租日重算费用的所属期和到期日，与 term_period_start / fee_due_date 的规则一致；
+# 所属期和到期日已经正确的费用不重写
+FEE_DATES_SQL = """
+UPDATE {fee} f
+SET period_start = d.period_start, due_date = d.due_date
+FROM (
+    SELECT f.id,
+           CASE WHEN f.term ~ '^[0-9]{{4}}-(0[1-9]|1[0-2])$' THEN to_date(f.term, 'YYYY-MM') END AS period_start,
+           CASE
+               WHEN f.term ~ '^[0-9]{{4}}-(0[1-9]|1[0-2])$' THEN to_date(f.term, 'YYYY-MM') + LEAST(
+                   EXTRACT(DAY FROM c.rent_collection_time)::int,
+                   EXTRACT(DAY FROM to_date(f.term, 'YYYY-MM') + interval '1 month' - interval '1 day')::int
+               ) - 1
+               ELSE c.rent_collection_time
+           END AS due_date
+    FROM {fee} f
+    JOIN {contract} c ON c.id = f.contract_id
+    WHERE f.contract_id = ANY(%s)
+) d
+WHERE f.id = d.id
+  AND (f.period_start, f.due_date) IS DISTINCT FROM (d.period_start, d.due_date)
+"""
+
+
+def term_period_start(term):
+    """返回月度 term 所属月的第一天，非月度 term 返回 None"""
+    match = MONTH_TERM.match(term or '')
+    if match is None:
+        return None
+    return date(int(match[1]), int(match[2]), 1)
+
+
+def fee_due_date(period_start, rent_collection_time):
+    """月度费用在所属月的收租日（取 rent_collection_time 的日，超出月末按月末）到期，其他费用在收租日当天到期"""
+    if period_start is None:
+        return rent_collection_time
+    last_day = calendar.monthrange(period_start.year, period_start.month)[1]
+    return period_start.replace(day=min(rent_collection_time.day, last_day))
+
+
+def month_range(day):
+    """返回 day 所在月的 [月初, 下月初)"""
+    month_start = day.replace(day=1)
+    next_month = (month_start + timedelta(days=31)).replace(day=1)
+    return month_start, next_month
+
+
+def refresh_fee_dates(contract_ids):
+    """合同收租日变化后，用一条 UPDATE 重算这些合同所有费用的所属期和到期日，返回更新行数"""
+    from .models import Contract, Fee
+    sql = FEE_DATES_SQL.format(
+        fee=connection.ops.quote_name(Fee._meta.db_table),
+        contract=connection.ops.quote_name(Contract._meta.db_table),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [list(contract_ids)])
+        return cursor.rowcount
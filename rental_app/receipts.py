@@ -0,0 +1,60 @@
+# rental_app/receipts.py
+
+import hashlib
+from io import BytesIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import letter
+
+# 修改收据版式时递增，使已存储的收据全部失效
+RECEIPT_LAYOUT_VERSION = 1
+PRINTED_RECEIPT_DIR = 'printed_receipts'
+
+
+def receipt_lines(payment):
+    """收据上打印的文字行，同时作为内容哈希的输入"""
+    lines = [
+        f"收据编号: {payment.id}",
+        f"日期: {payment.payment_date.strftime('%Y-%m-%d')}",
+        f"支付方式: {payment.get_payment_method_display()}",
+        f"金额: ¥{payment.amount}",
+    ]
+    if payment.fee and payment.fee.contract:
+        tenant = payment.fee.contract.tenant
+        lines += [
+            f"租户: {tenant.first_name} {tenant.last_name}",
+            f"费用类型: {payment.fee.get_category_display()}",
+            f"所属期限: {payment.fee.term}",
+        ]
+    return lines
+
+
+def receipt_digest(lines):
+    content = '\n'.join([f'v{RECEIPT_LAYOUT_VERSION}', *lines])
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def render_receipt_pdf(lines):
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    c.setFont("Helvetica", 12)
+    y = 800
+    for line in lines:
+        c.drawString(100, y, line)
+        y -= 20
+    c.save()
+    return buffer.getvalue()
+
+
+def get_printed_receipt(payment):
+    """
+    返回 (存储路径, 内容哈希)。收据按内容哈希存储，相同内容只渲染一次，
+    之后直接从存储读取。
+    """
+    lines = receipt_lines(payment)
+    digest = receipt_digest(lines)
+    name = f'{PRINTED_RECEIPT_DIR}/{digest}.pdf'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(render_receipt_pdf(lines)))
+    return name, digest
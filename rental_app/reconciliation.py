@@ -0,0 +1,120 @@
+# rental_app/reconciliation.py
+
+from collections import defaultdict
+from functools import partial
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .analytics import invalidate_kpi_snapshot
+from .balances import apply_balance_delta, fee_contribution
+from .models import Fee, Payment
+from .serializers import PaymentEntrySerializer
+from .services import (
+    DUPLICATE_REFERENCE, ZERO, check_payment, duplicate_references_as_errors, paid_total, taken_references,
+)
+from .tasks import queue_payment_receipts
+
+# 单个对账批次的最大行数
+RECONCILE_MAX_ENTRIES = 1000
+
+
+def rejected(line, errors):
+    return {'line': line, 'status': 'rejected', 'errors': errors}
+
+
+def reconcile_payments(entries, dry_run=False):
+    """
+    批量记入银行流水（[{fee_id, amount, payment_method, reference}]），逐行返回结果，出错的行跳过。
+    与逐笔 post_payment 的校验相同，但整批只用固定几条语句：一次锁定所有相关费用并取出已支付总额，
+    一次流水号查重，一次写入全部支付（带流水号时在保存点内，并发写入相同流水号时整批返回 400），每种支付方式一条费用状态 UPDATE，每个合同一条余额 UPDATE。
+    同一费用的多行按顺序累计校验；收据在提交后作为一个任务入队。
+    """
+    results = [None] * len(entries)
+    valid = []
+    for index, entry in enumerate(entries):
+        serializer = PaymentEntrySerializer(data=entry)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = rejected(index + 1, serializer.errors)
+
+    payments = []
+    with transaction.atomic():
+        # 按主键顺序加锁，与其他批次并发时不会互相死锁
+        fees = {
+            fee.pk: fee for fee in Fee.objects.select_for_update()
+            .filter(pk__in={data['fee_id'] for _, data in valid})
+            .annotate(paid_amount=paid_total())
+            .order_by('pk')
+        }
+        before = {pk: fee.get_balance_state() for pk, fee in fees.items()}
+        uncollected = {pk for pk, fee in fees.items() if not fee.is_collected}
+        references = {data['reference'] for _, data in valid if data['reference']}
+        taken = taken_references(references)
+
+        for index, data in valid:
+            fee = fees.get(data['fee_id'])
+            reference = data['reference']
+            try:
+                if fee is None:
+                    raise ValidationError({'fee_id': '费用不存在'})
+                if reference in taken:
+                    raise ValidationError({'reference': DUPLICATE_REFERENCE})
+                check_payment(fee, data['amount'], fee.paid_amount)
+            except ValidationError as exc:
+                results[index] = rejected(index + 1, exc.detail)
+                continue
+            if reference:
+                taken.add(reference)
+            fee.paid_amount += data['amount']
+            if fee.paid_amount >= fee.amount:
+                # 后续同一费用的行按已支付处理
+                fee.is_collected = True
+                fee.payment_method = data['payment_method']
+            # 记录这一行记入后费用是否结清，分次支付的前几行仍为未结清
+            payments.append((index, fee.is_collected, Payment(
+                fee=fee, amount=data['amount'],
+                payment_method=data['payment_method'], reference=reference,
+            )))
+
+        # 查重之后其他批次或单笔接口写入了相同流水号时整批回滚，返回 400
+        with duplicate_references_as_errors(references):
+            Payment.objects.bulk_create([payment for _, _, payment in payments])
+
+        settled = defaultdict(list)
+        deltas = defaultdict(lambda: (ZERO, ZERO, ZERO))
+        for pk, fee in fees.items():
+            if fee.is_collected and pk in uncollected:
+                settled[fee.payment_method].append(pk)
+                old = fee_contribution(before[pk])
+                new = fee_contribution(fee.get_balance_state())
+                deltas[fee.contract_id] = tuple(
+                    d + n - o for d, n, o in zip(deltas[fee.contract_id], new, old)
+                )
+        for payment_method, fee_ids in settled.items():
+            Fee.objects.filter(pk__in=fee_ids).update(is_collected=True, payment_method=payment_method)
+        for contract_id in sorted(deltas):
+            apply_balance_delta(contract_id, deltas[contract_id])
+
+        if dry_run:
+            transaction.set_rollback(True)
+        elif payments:
+            # 批量写入不触发信号，收据和数据分析快照在提交后统一处理
+            transaction.on_commit(partial(queue_payment_receipts, [payment.pk for _, _, payment in payments]))
+            transaction.on_commit(invalidate_kpi_snapshot)
+
+    for index, fee_collected, payment in payments:
+        results[index] = {
+            'line': index + 1,
+            'status': 'posted',
+            'payment_id': None if dry_run else payment.pk,
+            'fee_id': payment.fee_id,
+            'fee_collected': fee_collected,
+        }
+    return {
+        'entries': len(entries),
+        'posted': len(payments),
+        'rejected': len(entries) - len(payments),
+        'amount': sum((payment.amount for _, _, payment in payments), ZERO),
+        'dry_run': dry_run,
+        'results': results,
+    }
@@ -0,0 +1,183 @@
+# rental_app/schedule.py
+
+import calendar
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from django.db import transaction
+from .analytics import invalidate_kpi_snapshot
+from .balances import refresh_contract_balances
+from .models import Contract, Fee, Payment
+from .periods import fee_due_date, refresh_fee_dates
+
+# 按月生成的费用类别及其在合同上的金额字段
+MONTHLY_CATEGORIES = (
+    ('rent', 'monthly_rent'),
+    ('management_fee', 'management_fee'),
+)
+
+# 旧版本新建合同时生成的租金占位费用的 term
+PLACEHOLDER_RENT_TERM = '每月'
+
+
+def month_periods(start_date, end_date):
+    """按自然月切分合同期，返回 [(月初, 该月计费起日, 该月计费止日)]"""
+    periods = []
+    month_start = start_date.replace(day=1)
+    while month_start <= end_date:
+        last_day = calendar.monthrange(month_start.year, month_start.month)[1]
+        month_end = month_start.replace(day=last_day)
+        periods.append((month_start, max(month_start, start_date), min(month_end, end_date)))
+        month_start = month_end + timedelta(days=1)
+    return periods
+
+
+def free_period_end(contract):
+    """装修期和免租期从合同开始日起连续计算，返回第一天需要计费的日期"""
+    return contract.start_date + timedelta(
+        days=(contract.decoration_period or 0) + (contract.rent_free_period or 0)
+    )
+
+
+def prorate(amount, billed_days, month_days):
+    """按计费天数占该月天数的比例折算金额，四舍五入到分"""
+    if billed_days == month_days:
+        return amount
+    return (Decimal(amount) * billed_days / month_days).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+def schedule_rows(contract):
+    """
+    返回合同从开始到结束每个月的 (类别, 金额, term, 所属期首日, 到期日)。
+    整月落在装修期/免租期内的月份跳过。第一个计费月不从月初开始计费时（合同月中开始，
+    或装修期、免租期在月中结束），按该月计费天数占当月天数的比例折算，两种情况规则相同；
+    之后的月份（包括月中结束的最后一个月）按整月计费
+    """
+    billable_from = free_period_end(contract)
+    rows = []
+    for month_start, covered_from, billed_until in month_periods(contract.start_date, contract.end_date):
+        if billed_until < billable_from:
+            continue
+        month_days = calendar.monthrange(month_start.year, month_start.month)[1]
+        billed_from = max(covered_from, billable_from)
+        billed_days = (billed_until - billed_from).days + 1 if billed_from > month_start else month_days
+        term = month_start.strftime('%Y-%m')
+        due_date = fee_due_date(month_start, contract.rent_collection_time)
+        for category, amount_field in MONTHLY_CATEGORIES:
+            amount = getattr(contract, amount_field)
+            if not amount:
+                continue
+            rows.append((category, prorate(amount, billed_days, month_days), term, month_start, due_date))
+    return rows
+
+
+def build_schedule(contract):
+    """返回合同每个月的租金和物业费（未保存的 Fee）"""
+    return [
+        Fee(
+            contract_id=contract.id, category=category, amount=amount,
+            term=term, period_start=period_start, due_date=due_date,
+        )
+        for category, amount, term, period_start, due_date in schedule_rows(contract)
+    ]
+
+
+def generate_fee_schedules(contracts, batch_size=1000):
+    """
+    为一批合同批量写入缺失的月度费用，依靠 (contract, category, term) 唯一约束保证幂等；
+    写入后用一条集合式 UPDATE 重算这些合同的余额。返回新建的费用数。
+    """
+    contracts = list(contracts)
+    if not contracts:
+        return 0
+    contract_ids = [contract.id for contract in contracts]
+    existing = set(
+        Fee.objects.filter(
+            contract_id__in=contract_ids,
+            category__in=[category for category, _ in MONTHLY_CATEGORIES],
+        ).values_list('contract_id', 'category', 'term')
+    )
+    new_fees = [
+        fee
+        for contract in contracts
+        for fee in build_schedule(contract)
+        if (fee.contract_id, fee.category, fee.term) not in existing
+    ]
+    if not new_fees:
+        return 0
+
+    with transaction.atomic():
+        Fee.objects.bulk_create(new_fees, batch_size=batch_size, ignore_conflicts=True)
+        # bulk_create 不经过 Fee.save，余额按费用明细整体重算
+        refresh_contract_balances(contract_ids)
+        transaction.on_commit(invalidate_kpi_snapshot)
+    return len(new_fees)
+
+
+def convert_placeholder_rents(contracts):
+    """
+    旧版本新建合同时只生成一条 term 为 '每月' 的租金占位费用，补齐费用计划前先处理：
+    占位费用转为合同第一个计费月的租金（保留支付和收取状态，按 term 重算所属期和到期日）；
+    该月租金已存在时删除未收取且没有支付的占位费用，否则保留。返回受影响的合同 id
+    """
+    contracts = {contract.id: contract for contract in contracts}
+    placeholders = list(
+        Fee.objects.filter(contract_id__in=contracts, category='rent', term=PLACEHOLDER_RENT_TERM).order_by('id')
+    )
+    if not placeholders:
+        return set()
+    first_terms = {}
+    for contract_id, contract in contracts.items():
+        rent_terms = [term for category, _, term, _, _ in schedule_rows(contract) if category == 'rent']
+        if rent_terms:
+            first_terms[contract_id] = rent_terms[0]
+    taken = set(
+        Fee.objects.filter(
+            contract_id__in=first_terms, category='rent', term__in=set(first_terms.values()),
+        ).values_list('contract_id', 'term')
+    )
+    paid = set(Payment.objects.filter(fee__in=placeholders).values_list('fee_id', flat=True))
+
+    converted, removable = [], []
+    for fee in placeholders:
+        term = first_terms.get(fee.contract_id)
+        if term is not None and (fee.contract_id, term) not in taken:
+            fee.term = term
+            converted.append(fee)
+            taken.add((fee.contract_id, term))
+        elif not fee.is_collected and fee.id not in paid:
+            removable.append(fee.id)
+
+    if converted:
+        Fee.objects.bulk_update(converted, ['term'])
+        refresh_fee_dates({fee.contract_id for fee in converted})
+    if removable:
+        Fee.objects.filter(id__in=removable).delete()
+    return {fee.contract_id for fee in converted} | {
+        fee.contract_id for fee in placeholders if fee.id in removable
+    }
+
+
+def backfill_fee_schedules(contract_ids=None, chunk_size=500):
+    """按主键分块为合同补齐月度费用，每块一个事务，返回 (处理的合同数, 新建的费用数)"""
+    queryset = Contract.objects.order_by('pk')
+    if contract_ids:
+        queryset = queryset.filter(pk__in=contract_ids)
+    else:
+        queryset = queryset.filter(status='active')
+
+    contracts_done = fees_created = 0
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            break
+        with transaction.atomic():
+            affected = convert_placeholder_rents(chunk)
+            fees_created += generate_fee_schedules(chunk)
+            if affected:
+                # 占位费用删除或转换后余额按费用明细重算
+                refresh_contract_balances(affected)
+                transaction.on_commit(invalidate_kpi_snapshot)
+        contracts_done += len(chunk)
+        last_pk = chunk[-1].pk
+    return contracts_done, fees_created
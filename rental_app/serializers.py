@@ -1,27 +1,189 @@
 # rental_app/serializers.py
 
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from rest_framework.reverse import reverse
-from .models import Tenant, Property, Contract, Fee, Payment
-from django.db import models
+from .models import Tenant, Property, Contract, Fee, Payment, NotificationRun
+from .availability import is_lease_conflict
+from .notifications import NOTIFICATION_JOB_MAX_TENANTS
+from .services import post_payment
+from contextlib import contextmanager
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 
-class TenantSerializer(serializers.ModelSerializer):
+
+def parse_field_paths(value):
+    """把 'id,fee.amount,fee.contract' 解析为 {'id': {}, 'fee': {'amount': {}, 'contract': {}}}"""
+    tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+    return tree
+
+
+class DynamicFieldsMixin:
+    """
+    支持 ?fields= 与 ?expand= 的序列化器：
+    - fields 只输出列出的字段，可用点号指定嵌套字段（fee.amount）
+    - expand 只展开列出的嵌套关系（fee.contract.tenant），其余关系只输出主键
+    两个参数都未提供时保持原来的完整嵌套输出
+    """
+
+    def __init__(self, *args, **kwargs):
+        field_tree = kwargs.pop('fields', None)
+        expand_tree = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request') if 'context' in kwargs else None
+        if request is not None and field_tree is None and expand_tree is None:
+            params = getattr(request, 'query_params', request.GET)
+            if params.get('fields'):
+                field_tree = parse_field_paths(params['fields'])
+            if 'expand' in params:
+                expand_tree = parse_field_paths(params['expand'])
+        self._field_tree = field_tree
+        self._expand_tree = expand_tree
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self._field_tree is None and self._expand_tree is None:
+            return fields
+
+        if self._field_tree is not None:
+            for name, field in list(fields.items()):
+                if name in self._field_tree or field.write_only:
+                    continue
+                if field.read_only:
+                    fields.pop(name)
+                else:
+                    # 可写字段仍接受输入，只是不再输出
+                    field.write_only = True
+
+        for name, field in list(fields.items()):
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if not isinstance(nested, DynamicFieldsMixin):
+                continue
+            subfields = (self._field_tree or {}).get(name) or None
+            if self._expand_tree is not None and name not in self._expand_tree and not subfields:
+                # 未展开的关系只输出主键
+                fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True, many=many, source=field.source)
+                continue
+            subexpand = None if self._expand_tree is None else self._expand_tree.get(name, {})
+            fields[name] = nested.__class__(
+                many=many, read_only=True, source=field.source,
+                fields=subfields, expand=subexpand,
+            )
+        return fields
+
+
+def plan_related(serializer, prefix='', in_prefetch=False):
+    """根据序列化器实际输出的字段推导 select_related / prefetch_related 路径"""
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    select, prefetch = [], []
+    model = serializer.Meta.model
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*' or '.' in field.source:
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation:
+            continue
+
+        path = prefix + field.source
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        is_nested = isinstance(nested, serializers.BaseSerializer)
+        to_many = model_field.many_to_many or model_field.one_to_many
+
+        if is_nested:
+            if to_many or in_prefetch:
+                prefetch.append(path)
+            else:
+                select.append(path)
+            sub_select, sub_prefetch = plan_related(nested, path + '__', in_prefetch or to_many)
+            select.extend(sub_select)
+            prefetch.extend(sub_prefetch)
+        elif to_many:
+            # 只输出主键时只取关联表的 id
+            prefetch.append(Prefetch(path, queryset=model_field.related_model.objects.only('pk')))
+    return select, prefetch
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """多个主键用一条 IN 查询取回，而不是每个主键各执行一次 get()"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pks = list(dict.fromkeys(self.coerce_pk(child, queryset.model._meta.pk, item) for item in data))
+        found = {obj.pk: obj for obj in queryset.filter(pk__in=pks)}
+        for pk in pks:
+            if pk not in found:
+                child.fail('does_not_exist', pk_value=pk)
+        return [found[pk] for pk in pks]
+
+    @staticmethod
+    def coerce_pk(child, model_pk, item):
+        """与 PrimaryKeyRelatedField 相同的校验，并按模型主键类型转换（'05' 与 5 视为同一主键）"""
+        try:
+            if isinstance(item, bool):
+                raise TypeError
+            if child.pk_field is not None:
+                item = child.pk_field.to_internal_value(item)
+            return model_pk.to_python(item)
+        except (TypeError, ValueError, DjangoValidationError):
+            child.fail('incorrect_type', data_type=type(item).__name__)
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class TenantSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Tenant
         fields = ['id', 'first_name', 'last_name', 'email', 'phone_number']
 
-class PropertySerializer(serializers.ModelSerializer):
+class PropertySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Property
         fields = '__all__'
 
-class ContractSerializer(serializers.ModelSerializer):
+@contextmanager
+def lease_conflicts_as_errors():
+    """在事务中保存合同，同一房源租期重叠（排他约束）时回滚并返回 400"""
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as exc:
+        if not is_lease_conflict(exc):
+            raise
+        raise serializers.ValidationError({'property_ids': ['所选房源在合同期内已有其他有效合同']})
+
+class ContractSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     tenant = TenantSerializer(read_only=True)
     tenant_id = serializers.PrimaryKeyRelatedField(
         queryset=Tenant.objects.all(), source='tenant', write_only=True
     )
     properties = PropertySerializer(many=True, read_only=True)
-    property_ids = serializers.PrimaryKeyRelatedField(
+    property_ids = BulkPrimaryKeyRelatedField(
         many=True, queryset=Property.objects.all(), write_only=True, source='properties'
     )
 
@@ -37,14 +199,10 @@ class ContractSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         tenant = validated_data.pop('tenant')
         properties = validated_data.pop('properties')
-        contract = Contract.objects.create(tenant=tenant, **validated_data)
-        contract.properties.set(properties)
-        
-        # 更新房源状态
-        for property in properties:
-            property.rental_status = 'rented'
-            property.save()
-        
+        with lease_conflicts_as_errors():
+            contract = Contract.objects.create(tenant=tenant, **validated_data)
+            # 房源状态和关联的租期由 m2m_changed 信号一次性更新
+            contract.properties.set(properties)
         return contract
 
     def update(self, instance, validated_data):
@@ -54,28 +212,18 @@ class ContractSerializer(serializers.ModelSerializer):
         if tenant is not None:
             instance.tenant = tenant
 
-        # 如果更新了房源，需要处理旧房源和新房源的状态
-        if properties is not None:
-            # 将原有房源状态改为可用
-            for property in instance.properties.all():
-                property.rental_status = 'available'
-                property.save()
-            
-            # 设置新的房源关系
-            instance.properties.set(properties)
-            
-            # 将新房源状态改为已租赁
-            for property in properties:
-                property.rental_status = 'rented'
-                property.save()
-
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save()
+        with lease_conflicts_as_errors():
+            # 先保存新的起止日期，再按新租期写入新增的房源关联
+            instance.save()
+            # 如果更新了房源：移除的房源改为可用、新增的房源改为已租赁，由 m2m_changed 信号各用一条 UPDATE 完成
+            if properties is not None:
+                instance.properties.set(properties)
 
         return instance
 
-class FeeSerializer(serializers.ModelSerializer):
+class FeeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     contract = ContractSerializer(read_only=True)
     contract_id = serializers.PrimaryKeyRelatedField(
         queryset=Contract.objects.all(), source='contract', write_only=True
@@ -85,11 +233,11 @@ class FeeSerializer(serializers.ModelSerializer):
         model = Fee
         fields = [
             'id', 'contract', 'contract_id',
-            'category', 'amount', 'term',
+            'category', 'amount', 'term', 'period_start', 'due_date',
             'is_collected', 'overdue_status', 'payment_method', 'receipt', 'bank_slip',
         ]
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     fee = FeeSerializer(read_only=True)
     fee_id = serializers.PrimaryKeyRelatedField(
         queryset=Fee.objects.all(), source='fee', write_only=True
@@ -100,26 +248,19 @@ class PaymentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = ['id', 'fee', 'fee_id', 'payment_date', 'amount', 
-                 'payment_method', 'receipt', 'receipt_url', 'print_receipt_url']
+                 'payment_method', 'reference', 'receipt', 'receipt_status', 'receipt_url', 'print_receipt_url']
+        read_only_fields = ['receipt_status']
 
     def validate(self, data):
-        """验证支付金额"""
-        fee = data.get('fee')
+        """验证支付金额（剩余应付金额在记账时锁定费用后校验）"""
         amount = data.get('amount')
-        
-        if fee and amount:
-            if amount <= 0:
-                raise serializers.ValidationError({"amount": "支付金额必须大于0"})
-            # 检查剩余应付金额
-            total_paid = Payment.objects.filter(fee=fee).aggregate(
-                total=models.Sum('amount'))['total'] or 0
-            remaining = fee.amount - total_paid
-            if amount > remaining:
-                raise serializers.ValidationError(
-                    {"amount": f"支付金额不能超过剩余应付金额 {remaining}"}
-                )
+        if amount is not None and amount <= 0:
+            raise serializers.ValidationError({"amount": "支付金额必须大于0"})
         return data
 
+    def create(self, validated_data):
+        return post_payment(Payment(**validated_data))
+
     def get_receipt_url(self, obj):
         if obj.receipt:
             return obj.receipt.url
@@ -129,4 +270,78 @@ class PaymentSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request is None:
             return None
-        return reverse('payment-print-receipt', args=[obj.pk], request=request)
\ No newline at end of file
+        return reverse('payment-print-receipt', args=[obj.pk], request=request)
+
+class PaymentEntrySerializer(serializers.Serializer):
+    """批量对账中的一行银行流水；费用是否存在、金额是否超出在整批锁定费用后统一校验"""
+    fee_id = serializers.IntegerField(min_value=1)
+    amount = serializers.DecimalField(max_digits=12, decimal_places=2)
+    payment_method = serializers.ChoiceField(choices=Payment.PAYMENT_METHOD_CHOICES, default='bank_transfer')
+    reference = serializers.CharField(max_length=64, required=False, allow_blank=True, default='')
+
+
+class NotificationRequestSerializer(serializers.Serializer):
+    """批量未缴费用提醒：按租户 id 列表，或按房源地址前缀（如整栋楼）选择有效合同的租户，两者可同时提供"""
+    tenant_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, default=list,
+        max_length=NOTIFICATION_JOB_MAX_TENANTS,
+    )
+    address = serializers.CharField(max_length=255, required=False)
+
+    def validate(self, data):
+        if not data['tenant_ids'] and not data.get('address'):
+            raise serializers.ValidationError('需要提供 tenant_ids 或 address')
+        return data
+
+
+class NotificationJobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = NotificationRun
+        fields = ['id', 'kind', 'run_date', 'status', 'chunks_total', 'chunks_done',
+                  'tenants', 'fees', 'sent', 'failed', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+
+class StatementPropertySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Property
+        fields = ['id', 'house_number', 'address', 'area']
+
+
+class StatementContractSerializer(serializers.ModelSerializer):
+    """对账单中的合同：基本信息、房源和费用汇总（汇总由视图放在 contract.rollup 中）"""
+    properties = StatementPropertySerializer(many=True, read_only=True)
+    fees = serializers.IntegerField(source='rollup.fees')
+    billed = serializers.DecimalField(source='rollup.billed', max_digits=14, decimal_places=2)
+    paid = serializers.DecimalField(source='rollup.paid', max_digits=14, decimal_places=2)
+    outstanding = serializers.DecimalField(source='rollup.outstanding', max_digits=14, decimal_places=2)
+    overdue = serializers.DecimalField(source='rollup.overdue', max_digits=14, decimal_places=2)
+
+    class Meta:
+        model = Contract
+        fields = [
+            'id', 'start_date', 'end_date', 'status', 'monthly_rent', 'properties',
+            'fees', 'billed', 'paid', 'outstanding', 'overdue',
+        ]
+
+
+class StatementTotalsSerializer(serializers.Serializer):
+    """对账单合计，字段和金额格式与合同汇总相同"""
+    fees = serializers.IntegerField()
+    billed = serializers.DecimalField(max_digits=14, decimal_places=2)
+    paid = serializers.DecimalField(max_digits=14, decimal_places=2)
+    outstanding = serializers.DecimalField(max_digits=14, decimal_places=2)
+    overdue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class StatementFeeSerializer(serializers.ModelSerializer):
+    """对账单中的费用明细，只给出合同 id，合同和房源信息见 contracts"""
+    contract_id = serializers.IntegerField(read_only=True)
+    paid_amount = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = Fee
+        fields = [
+            'id', 'contract_id', 'category', 'amount', 'paid_amount', 'term', 'period_start', 'due_date',
+            'is_collected', 'overdue_status', 'payment_method',
+        ]
@@ -0,0 +1,117 @@
+# rental_app/services.py
+
+from contextlib import contextmanager
+from decimal import Decimal
+from functools import partial
+from django.db import IntegrityError, transaction
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import ValidationError
+from .models import Fee, Payment
+from .tasks import queue_payment_receipt
+
+ZERO = Decimal('0.00')
+
+DUPLICATE_REFERENCE = '该银行流水号已记账，请勿重复支付！'
+
+REFERENCE_CONSTRAINT = 'unique_payment_reference'
+
+
+def paid_total():
+    """费用已支付总额的相关子查询，可用于 annotate"""
+    return Coalesce(
+        Subquery(
+            Payment.objects.filter(fee=OuterRef('pk'))
+            .order_by()
+            .values('fee')
+            .annotate(total=Sum('amount'))
+            .values('total')
+        ),
+        Value(ZERO),
+    )
+
+
+def lock_fee(fee_id):
+    """锁定费用行，并在同一条语句中取出已支付总额（paid_amount）"""
+    return Fee.objects.select_for_update().annotate(paid_amount=paid_total()).get(pk=fee_id)
+
+
+def taken_references(references):
+    """已记账的银行流水号"""
+    references = {reference for reference in references if reference}
+    if not references:
+        return set()
+    return set(Payment.objects.filter(reference__in=references).values_list('reference', flat=True))
+
+
+@contextmanager
+def duplicate_references_as_errors(references=True):
+    """
+    在保存点中写入带流水号的支付：查重之后其他事务写入了相同流水号时，
+    唯一约束报错回滚到保存点，并返回与查重相同的 400。没有流水号时不建保存点
+    """
+    if not references:
+        yield
+        return
+    try:
+        with transaction.atomic():
+            yield
+    except IntegrityError as exc:
+        if REFERENCE_CONSTRAINT not in str(exc):
+            raise
+        raise ValidationError({'reference': DUPLICATE_REFERENCE})
+
+
+def check_payment(fee, amount, paid_amount):
+    """校验一笔支付能否记入该费用，不通过时抛出 ValidationError"""
+    if amount is None or amount <= 0:
+        raise ValidationError({'amount': '支付金额必须大于0'})
+    if fee.is_collected:
+        raise ValidationError({'detail': '该费用已支付，请勿重复支付！'})
+    remaining = fee.amount - paid_amount
+    if amount > remaining:
+        raise ValidationError({'amount': f'支付金额不能超过剩余应付金额 {remaining}'})
+
+
+def settle_fee(fee, paid_amount, payment_method=None):
+    """按已支付总额更新费用的收取状态，合同余额由 Fee.save 按差额更新"""
+    collected = paid_amount >= fee.amount
+    if collected == fee.is_collected:
+        return
+    fee.is_collected = collected
+    update_fields = ['is_collected']
+    if collected and payment_method:
+        fee.payment_method = payment_method
+        update_fields.append('payment_method')
+    fee.save(update_fields=update_fields)
+
+
+@transaction.atomic
+def post_payment(payment):
+    """
+    记入一笔支付（未保存的 Payment 实例）：锁定费用行、校验金额、写入支付，
+    并在需要时更新费用状态和合同余额。整个过程在一个事务内完成，最多四条语句（带流水号时多一条查重，写入支付在保存点内）；
+    收据在事务提交后交给 Celery 异步生成。
+    """
+    fee = lock_fee(payment.fee_id)
+    check_payment(fee, payment.amount, fee.paid_amount)
+    if taken_references([payment.reference]):
+        raise ValidationError({'reference': DUPLICATE_REFERENCE})
+    payment.fee = fee
+    # 告知 post_save 信号费用已在此结算
+    payment._fee_settled = True
+    with duplicate_references_as_errors(payment.reference):
+        payment.save()
+    settle_fee(fee, fee.paid_amount + payment.amount, payment.payment_method)
+    transaction.on_commit(partial(queue_payment_receipt, payment.pk))
+    return payment
+
+
+@transaction.atomic
+def resettle_fee(fee_id, payment_method=None):
+    """支付在 post_payment 之外新增或被删除后，按实际支付总额重新结算费用"""
+    try:
+        fee = lock_fee(fee_id)
+    except Fee.DoesNotExist:
+        return
+    settle_fee(fee, fee.paid_amount, payment_method)
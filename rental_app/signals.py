@@ -1,76 +1,116 @@
+from celery.signals import task_prerun, task_postrun
+from django.db.models import QuerySet
 from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Contract, Fee, Payment, Property
-from django.db.models import Sum
+from functools import partial
+from django.db import transaction
+from .models import Contract, Fee, Payment, Property, Tenant
+from .analytics import invalidate_kpi_snapshot
+from .availability import sync_lease_periods
+from .balances import apply_fee_change
+from .caching import invalidate_list_cache
+from .metrics import record_task, task_started
+from .occupancy import release_properties, set_rental_status
+from .schedule import generate_fee_schedules
+from .services import resettle_fee
+from .tasks import queue_payment_receipt
+
+def deleted_with(origin, *models):
+    """级联删除的起点（单个实例或 QuerySet.delete() 的查询集）是否为 models 之一"""
+    if isinstance(origin, QuerySet):
+        return issubclass(origin.model, models)
+    return isinstance(origin, models)
 
 @receiver(post_save, sender=Contract)
 def create_fees(sender, instance, created, **kwargs):
     if created:
-        # 生成租金费用（假设每月一次）
-        Fee.objects.create(
-            contract=instance,
-            category='rent',
-            amount=instance.monthly_rent,
-            term='每月',
-            is_collected=False
-        )
-        '''
-        # 生成保证金（一次性）
-        Fee.objects.create(
-            contract=instance,
-            category='deposit',
-            amount=instance.monthly_rent * 2,  # 假设保证金为2个月租金
-            term='一次性',
-            is_collected=False
-        )
-        
-        # 生成物业管理费（假设每月一次）
-        Fee.objects.create(
-            contract=instance,
-            category='management_fee',
-            amount=100,  # 示例金额
-            term='每月',
-            is_collected=False
-        )
-        '''
-        # 根据需求生成其他费用
+        # 按合同期生成每月的租金和物业管理费（跳过装修期、免租期）
+        if generate_fee_schedules([instance]):
+            instance.refresh_from_db(fields=Contract.BALANCE_FIELDS)
+    elif sync_lease_periods([instance.pk]):
+        # 起止日期或状态有变化并已同步到房源关联的租期；合同不再有效时释放没有其他有效合同的房源
+        if instance.status == 'active':
+            set_rental_status(instance.properties.values('id'), 'rented')
+        else:
+            release_properties(instance.properties.values('id'))
 
 @receiver(post_save, sender=Payment)
 def update_fee_status(sender, instance, created, **kwargs):
-    if created:
-        fee = instance.fee
-        
-        # 检查该费用的所有支付总额是否达到或超过费用金额
-        total_paid = Payment.objects.filter(fee=fee).aggregate(total=Sum('amount'))['total'] or 0
-        
-        if total_paid >= fee.amount:
-            fee.is_collected = True
-            fee.payment_method = instance.payment_method
-            fee.receipt = instance.receipt
-            fee.save()
+    # 通过 services.post_payment 记入的支付已经结算过费用
+    if created and not getattr(instance, '_fee_settled', False):
+        resettle_fee(instance.fee_id, instance.payment_method)
+        transaction.on_commit(partial(queue_payment_receipt, instance.pk))
 
 @receiver(post_delete, sender=Payment)
-def revert_fee_status(sender, instance, **kwargs):
-    fee = instance.fee
-    # 重新计算总支付金额
-    total_paid = Payment.objects.filter(fee=fee).exclude(id=instance.id).aggregate(total=Sum('amount'))['total'] or 0
-    
-    if total_paid < fee.amount:
-        fee.is_collected = False
-        fee.save()
+def revert_fee_status(sender, instance, origin=None, **kwargs):
+    if deleted_with(origin, Fee, Contract, Tenant):
+        # 费用本身被删除，无需重新结算
+        return
+    resettle_fee(instance.fee_id)
 
 @receiver(pre_delete, sender=Contract)
 def update_property_status(sender, instance, **kwargs):
-    # 合同删除时更新房产状态
-    for property in instance.properties.all():
-        property.update_rental_status('available')
+    # 合同删除时更新房产状态（关联表随合同级联删除，不会触发 m2m_changed）
+    release_properties(instance.properties.values('id'), exclude_contracts=[instance.pk])
 
 @receiver(m2m_changed, sender=Contract.properties.through)
 def handle_property_changes(sender, instance, action, reverse, model, pk_set, **kwargs):
-    """处理合同和房源多对多关系变化"""
+    """处理合同和房源多对多关系变化，每次变化一条 UPDATE"""
+    if action == "pre_clear":
+        # post_clear 拿不到被清除的房源，先记下来
+        instance._cleared_property_ids = (
+            {instance.pk} if reverse else set(instance.properties.values_list('id', flat=True))
+        )
+        return
+    if action == "post_clear":
+        release_properties(instance.__dict__.pop('_cleared_property_ids', set()))
+        return
+    if action not in ("post_remove", "post_add"):
+        return
+    # 从房源一侧修改关系时，instance 是房源，pk_set 是合同
+    property_ids = {instance.pk} if reverse else pk_set
     if action == "post_remove":
-        # 当房源从合同中移除时，将状态改为可用
-        Property.objects.filter(id__in=pk_set).update(rental_status='available')
-    elif action == "post_add":
-        # 当新房源添加到合同时，将状态改为已租赁
-        Property.objects.filter(id__in=pk_set).update(rental_status='rented')
\ No newline at end of file
+        # 当房源从合同中移除时，没有其他有效合同的房源改为可用
+        release_properties(property_ids)
+    else:
+        # 当新房源添加到合同时，将状态改为已租赁，并写入关联的租期（租期重叠时排他约束报错）
+        sync_lease_periods(pk_set if reverse else [instance.pk])
+        set_rental_status(property_ids, 'rented')
+
+@receiver(post_delete, sender=Fee)
+def revert_contract_balances(sender, instance, origin=None, **kwargs):
+    """删除费用时从合同余额中扣除该费用的贡献"""
+    if deleted_with(origin, Contract, Tenant):
+        # 合同本身被删除（直接删除、批量删除或随租户删除），无需维护余额
+        return
+    apply_fee_change(instance.get_balance_state(), None)
+
+
+@receiver([post_save, post_delete], sender=Fee)
+@receiver([post_save, post_delete], sender=Payment)
+@receiver([post_save, post_delete], sender=Property)
+def invalidate_data_analysis(sender, **kwargs):
+    """费用、支付或房源变化提交后使数据分析快照失效"""
+    transaction.on_commit(invalidate_kpi_snapshot)
+
+
+@receiver([post_save, post_delete], sender=Tenant)
+def invalidate_tenant_lists(sender, **kwargs):
+    invalidate_list_cache('tenants')
+
+
+@receiver([post_save, post_delete], sender=Property)
+def invalidate_property_lists(sender, **kwargs):
+    # 通过 set_rental_status 批量修改状态不触发此信号，由其自行失效
+    invalidate_list_cache('properties')
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    task_started(task_id)
+
+
+@task_postrun.connect
+def record_task_metrics(task_id=None, task=None, retval=None, state=None, **kwargs):
+    """Celery 任务的耗时和处理条数与请求指标一起在 /metrics 输出"""
+    record_task(task.name, task_id, state, retval)
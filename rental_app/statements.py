@@ -0,0 +1,50 @@
+# rental_app/statements.py
+
+from decimal import Decimal
+from django.db import connection
+from .models import Payment
+
+ZERO = Decimal('0.00')
+
+ROLLUP_FIELDS = ('fees', 'billed', 'paid', 'outstanding', 'overdue')
+
+# 一条语句按合同汇总：应收（全部费用金额）、已付（支付合计）、未结（未收费用扣除部分支付后的余额）、
+# 逾期（未结中已逾期的部分）。{fees} 为已按租户、日期过滤的费用子查询，
+# 每笔费用的支付合计用 LATERAL 子查询走 payment_fee_amount_idx 仅索引扫描
+ROLLUP_SQL = """
+SELECT f.contract_id,
+       COUNT(*),
+       COALESCE(SUM(f.amount), 0),
+       COALESCE(SUM(p.paid), 0),
+       COALESCE(SUM(f.amount - COALESCE(p.paid, 0)) FILTER (WHERE NOT f.is_collected), 0),
+       COALESCE(SUM(f.amount - COALESCE(p.paid, 0))
+                FILTER (WHERE NOT f.is_collected AND f.overdue_status = 'overdue'), 0)
+FROM ({fees}) f
+LEFT JOIN LATERAL (SELECT SUM(amount) AS paid FROM {payment} WHERE fee_id = f.id) p ON true
+GROUP BY f.contract_id
+"""
+
+
+def empty_rollup():
+    return {'fees': 0, **{name: ZERO for name in ROLLUP_FIELDS[1:]}}
+
+
+def contract_rollups(fees):
+    """按合同汇总费用查询集，返回 {合同 id: {fees, billed, paid, outstanding, overdue}}"""
+    sql, params = fees.order_by().values(
+        'id', 'contract_id', 'amount', 'is_collected', 'overdue_status'
+    ).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            ROLLUP_SQL.format(fees=sql, payment=connection.ops.quote_name(Payment._meta.db_table)), params
+        )
+        return {row[0]: dict(zip(ROLLUP_FIELDS, row[1:])) for row in cursor.fetchall()}
+
+
+def rollup_totals(rollups):
+    totals = empty_rollup()
+    for rollup in rollups:
+        for name in ROLLUP_FIELDS:
+            totals[name] += rollup[name]
+    return totals
+
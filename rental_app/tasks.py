@@ -1,36 +1,138 @@
-from celery import shared_task
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.conf import settings
+from celery import chord, shared_task
+from django.core.files import File
+from django.db import transaction
 from datetime import date
-from .models import Fee
+import logging
+import os
+from .models import NotificationRun, Payment
+from .notifications import (
+    finish_notification_run, plan_notification_run, send_notification_chunk, start_notification_run,
+)
+from .overdue import mark_overdue_fees
+from .schedule import backfill_fee_schedules
+
+logger = logging.getLogger(__name__)
+
+@shared_task
+def mark_overdue_fees_task():
+    """每日把到期未缴的费用标记为逾期，需在逾期通知之前执行"""
+    stats = mark_overdue_fees()
+    logger.info(f"逾期标记：费用 {stats['fees']}，合同 {stats['contracts']}，耗时 {stats['duration']} 秒")
+    return stats
+
+def dispatch_chunks(run, chunks):
+    """以 chord 把分块分发给各 worker 并行发送，全部分块完成后由 finish_notifications 标记结束"""
+    if chunks:
+        chord(
+            [send_notifications_chunk.si(run.pk, first, last) for first, last in chunks]
+        )(finish_notifications.si(run.pk))
+    logger.info(f"{run}: 分发 {len(chunks)} 个分块")
+    return {'chunks': len(chunks)}
+
+def dispatch_notifications(kind, resume=False):
+    """登记当天的通知执行，把租户按键集范围分块后分发。当天已执行过时不再发送"""
+    run, chunks = start_notification_run(kind, date.today(), resume=resume)
+    if chunks is None:
+        logger.info(f"{run} 已于 {run.started_at:%H:%M} 开始执行（{run.get_status_display()}），跳过")
+        return {'chunks': 0}
+    return dispatch_chunks(run, chunks)
+
+@shared_task
+def send_payment_notifications(resume=False):
+    # 每天发送当月的缴费通知，同一租户当天只收到一次
+    return dispatch_notifications('payment', resume)
+
+@shared_task
+def send_overdue_notifications(resume=False):
+    return dispatch_notifications('overdue', resume)
+
+@shared_task(bind=True, max_retries=3, acks_late=True)
+def send_notifications_chunk(self, run_id, first_tenant_id, last_tenant_id):
+    """发送一个租户范围的通知；出错时重试，已发送的租户不会重复发送"""
+    try:
+        return send_notification_chunk(run_id, first_tenant_id, last_tenant_id)
+    except Exception as exc:
+        logger.warning(f"通知分块 {run_id}:{first_tenant_id}-{last_tenant_id} 失败: {exc}")
+        raise self.retry(exc=exc, countdown=30 * 2 ** self.request.retries)
+
+@shared_task
+def finish_notifications(run_id):
+    return finish_notification_run(run_id)
+
+@shared_task
+def dispatch_notification_job(run_id):
+    """前台发起的未缴费用提醒：在后台切分并分发，接口不等待邮件发送"""
+    with transaction.atomic():
+        # 消息重复投递时只分发一次
+        run = NotificationRun.objects.select_for_update().filter(pk=run_id, status='queued').first()
+        if run is None:
+            return {'chunks': 0}
+        chunks = plan_notification_run(run)
+    return dispatch_chunks(run, chunks)
+
+
+def queue_notification_job(run_id):
+    """把通知任务交给 Celery；消息队列不可用时任务保持 queued，可稍后重新分发"""
+    try:
+        dispatch_notification_job.delay(run_id)
+    except Exception as e:
+        logger.error(f"通知任务 {run_id} 入队失败: {str(e)}")
+
+
+@shared_task(bind=True, max_retries=3)
+def generate_payment_receipt(self, payment_id):
+    """渲染支付收据 PDF，失败时按指数退避重试，重试耗尽后标记为 failed"""
+    payment = Payment.objects.select_related(
+        'fee__contract__tenant'
+    ).prefetch_related(
+        'fee__contract__properties'
+    ).filter(pk=payment_id).first()
+    if payment is None or payment.receipt_status == 'ready':
+        return
+
+    pdf_path = payment.generate_receipt()
+    if not pdf_path:
+        if self.request.retries >= self.max_retries:
+            Payment.objects.filter(pk=payment_id).update(receipt_status='failed')
+            logger.error(f"支付 {payment_id} 的收据生成失败，已放弃重试")
+            return
+        raise self.retry(countdown=30 * 2 ** self.request.retries)
+
+    try:
+        with open(pdf_path, 'rb') as pdf:
+            payment.receipt.save(f'receipt_{payment.id}.pdf', File(pdf), save=False)
+    finally:
+        os.unlink(pdf_path)  # 清理临时文件
+    payment.receipt_status = 'ready'
+    payment.save(update_fields=['receipt', 'receipt_status'])
+
+
+def queue_payment_receipt(payment_id):
+    """把收据生成交给 Celery；消息队列不可用时收据保持 pending，不影响记账"""
+    try:
+        generate_payment_receipt.delay(payment_id)
+    except Exception as e:
+        logger.error(f"收据生成任务入队失败: {str(e)}")
+
 
 @shared_task
-def send_payment_notifications():
-    today = date.today()
-    # 假设每月的第一天发送通知
-    fees_due = Fee.objects.filter(
-        term__startswith=f"{today.year}-{today.month:02}",
-        is_collected=False,
-        overdue_status='on_time'
-    )
-    for fee in fees_due:
-        tenant = fee.contract.tenant
-        subject = "缴费通知"
-        message = render_to_string('emails/payment_notification.html', {
-            'tenant': tenant,
-            'fee': fee,
-        })
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [tenant.email])
+def generate_payment_receipts(payment_ids):
+    """批量记账的收据：拆分为逐笔的 generate_payment_receipt 任务，各自重试"""
+    for payment_id in payment_ids:
+        generate_payment_receipt.delay(payment_id)
+
+
+def queue_payment_receipts(payment_ids):
+    """一批支付的收据只发一条消息入队，消息队列不可用时收据保持 pending"""
+    try:
+        generate_payment_receipts.delay(list(payment_ids))
+    except Exception as e:
+        logger.error(f"批量收据生成任务入队失败: {str(e)}")
+
 
 @shared_task
-def send_overdue_notifications():
-    overdue_fees = Fee.objects.filter(overdue_status='overdue', is_collected=False)
-    for fee in overdue_fees:
-        tenant = fee.contract.tenant
-        subject = "逾期缴费通知"
-        message = render_to_string('emails/overdue_notification.html', {
-            'tenant': tenant,
-            'fee': fee,
-        })
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, [tenant.email])
\ No newline at end of file
+def backfill_fee_schedules_task(contract_ids=None, chunk_size=500):
+    """分块为（有效）合同补齐月度租金和物业管理费"""
+    contracts, fees = backfill_fee_schedules(contract_ids, chunk_size)
+    logger.info(f"费用计划补齐：合同 {contracts}，新建费用 {fees}")
+    return {'contracts': contracts, 'fees': fees}
@@ -1,6 +1,1146 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import re
+import smtplib
+import tempfile
+import time
+from datetime import date
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.utils.http import http_date
+from rental_management.celery import app as celery_app
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+from .aging import build_aging_report
+from .balances import find_balance_drift
+from .benchmarks import bench_tenants
+from .caching import LIST_CACHE_PREFIX, namespace_version, read_through
+from .forecast import build_revenue_forecast
+from .metrics import METRICS_CONTENT_TYPE, collect_metrics, registry
+from .models import Tenant, Property, Contract, Fee, Payment, NotificationRun
+from .notifications import (
+    create_notification_job, send_fee_digests, send_notification_chunk, start_notification_run,
+)
+from .overdue import mark_overdue_fees
+from .periods import refresh_fee_dates
+from .schedule import schedule_rows
+from .services import post_payment
+from .tasks import (
+    dispatch_notification_job, generate_payment_receipt, mark_overdue_fees_task, send_overdue_notifications,
+)
+
+
+def create_contract(tenant=None, **kwargs):
+    if tenant is None:
+        tenant = Tenant.objects.create(email=f'tenant{Tenant.objects.count()}@example.com')
+    values = {
+        'start_date': date(2025, 1, 1),
+        'end_date': date(2025, 1, 31),
+        'monthly_rent': Decimal('1000.00'),
+        'yearly_rent': Decimal('12000.00'),
+        'total_rent': Decimal('12000.00'),
+        'rental_area': Decimal('100.00'),
+        'rental_unit_price': Decimal('10.00'),
+        'rent_collection_time': date(2025, 1, 1),
+        'deposit_amount': Decimal('2000.00'),
+        'management_fee': Decimal('100.00'),
+    }
+    values.update(kwargs)
+    return Contract.objects.create(tenant=tenant, **values)
+
 
 class BasicTest(TestCase):
     def test_homepage(self):
         response = self.client.get('/')
-        self.assertEqual(response.status_code, 404)  # 只做最简单的示例
\ No newline at end of file
+        self.assertEqual(response.status_code, 404)  # 只做最简单的示例
+
+
+class ContractBalanceTest(TestCase):
+    def setUp(self):
+        self.contract = create_contract()
+
+    def assertBalances(self, receivable, outstanding, overdue):
+        self.contract.refresh_from_db()
+        self.assertEqual(self.contract.current_receivable, Decimal(receivable))
+        self.assertEqual(self.contract.current_outstanding, Decimal(outstanding))
+        self.assertEqual(self.contract.total_overdue, Decimal(overdue))
+
+    def test_initial_fees_counted(self):
+        # 一个月的合同：租金 1000 + 物业费 100 + 保证金 2000
+        self.assertBalances('3100.00', '0.00', '0.00')
+
+    def test_fee_state_changes_apply_deltas(self):
+        fee = Fee.objects.get(contract=self.contract, category='rent')
+        fee.overdue_status = 'overdue'
+        fee.save()
+        self.assertBalances('3100.00', '1000.00', '1000.00')
+
+        fee = Fee.objects.get(pk=fee.pk)
+        fee.is_collected = True
+        fee.save()
+        self.assertBalances('2100.00', '0.00', '1000.00')
+
+        fee.delete()
+        self.assertBalances('2100.00', '0.00', '0.00')
+
+    def test_cascade_from_contract_or_tenant_skips_balance_updates(self):
+        others = [create_contract() for _ in range(2)]
+        with mock.patch('rental_app.signals.apply_fee_change') as apply:
+            Contract.objects.filter(pk=others[0].pk).delete()
+            others[1].tenant.delete()
+            Tenant.objects.filter(pk=self.contract.tenant_id).delete()
+        apply.assert_not_called()
+        self.assertFalse(Fee.objects.exists())
+
+    def test_contract_save_keeps_balances(self):
+        stale = Contract.objects.get(pk=self.contract.pk)
+        Fee.objects.create(contract=self.contract, category='rent', amount=Decimal('500.00'), term='2025-02')
+        stale.status = 'terminated'
+        stale.save()
+        self.assertBalances('3600.00', '0.00', '0.00')
+
+    def test_reconcile_command_repairs_drift(self):
+        Contract.objects.filter(pk=self.contract.pk).update(current_receivable=0)
+        out = StringIO()
+        call_command('reconcile_contract_balances', '--dry-run', stdout=out)
+        self.assertIn(f'合同 {self.contract.id}', out.getvalue())
+        self.assertBalances('0.00', '0.00', '0.00')
+
+        call_command('reconcile_contract_balances', stdout=StringIO())
+        self.assertBalances('3100.00', '0.00', '0.00')
+
+
+class DataAnalysisTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('analyst'))
+        self.contract = create_contract()
+        Property.objects.create(house_number='A101', area=Decimal('60.00'), address='一号楼',
+                                rental_status='rented', current_value=Decimal('1.00'))
+        Property.objects.create(house_number='A102', area=Decimal('40.00'), address='一号楼',
+                                current_value=Decimal('1.00'))
+
+    def test_kpis_computed_in_two_queries_and_cached(self):
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/data-analysis/').json()
+        self.assertEqual(Decimal(str(data['financial']['receivable_amount'])), Decimal('3100.00'))
+        self.assertEqual(Decimal(str(data['property']['rented_area'])), Decimal('60.00'))
+        self.assertEqual(data['property']['available_properties'], 1)
+
+        with self.assertNumQueries(0):
+            self.client.get('/api/data-analysis/')
+
+    def test_snapshot_invalidated_on_payment(self):
+        self.client.get('/api/data-analysis/')
+        fee = Fee.objects.get(contract=self.contract, category='rent')
+        with self.captureOnCommitCallbacks(execute=True), \
+                mock.patch('rental_app.signals.queue_payment_receipt'):
+            Payment.objects.create(fee=fee, amount=Decimal('1000.00'), payment_method='wechat')
+        data = self.client.get('/api/data-analysis/').json()
+        self.assertEqual(Decimal(str(data['financial']['received_amount'])), Decimal('1000.00'))
+        self.assertEqual(Decimal(str(data['financial']['receivable_amount'])), Decimal('2100.00'))
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('clerk'))
+        for i in range(5):
+            Tenant.objects.create(email=f'page{i}@example.com')
+
+    def test_cursor_walks_all_rows_once(self):
+        seen = []
+        url = '/api/tenants/?page_size=2'
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data['results']), 2)
+            seen.extend(row['id'] for row in data['results'])
+            url = data['next']
+        self.assertEqual(seen, sorted(Tenant.objects.values_list('id', flat=True), reverse=True))
+
+
+class SparseFieldsetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('viewer'))
+        for i in range(3):
+            contract = create_contract()
+            for j in range(2):
+                contract.properties.add(Property.objects.create(
+                    house_number=f'B{i}{j}', area=Decimal('50.00'), address='二号楼',
+                    current_value=Decimal('1.00')))
+            for fee in contract.fees.all():
+                Payment.objects.create(fee=fee, amount=fee.amount, payment_method='POS')
+
+    def test_full_payment_list_has_constant_queries(self):
+        # 支付+费用+合同+租户一次联表，房源一次预取
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/payments/').json()
+        self.assertEqual(len(data['results']), 9)
+        self.assertEqual(len(data['results'][0]['fee']['contract']['properties']), 2)
+
+    def test_fields_skip_related_tables(self):
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/payments/?fields=id,amount,fee').json()
+        row = data['results'][0]
+        self.assertEqual(set(row), {'id', 'amount', 'fee'})
+        self.assertIsInstance(row['fee'], dict)
+
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/payments/?fields=id,amount,fee&expand=').json()
+        self.assertIsInstance(data['results'][0]['fee'], int)
+
+    def test_expand_nested_path(self):
+        with self.assertNumQueries(2):
+            data = self.client.get('/api/fees/?expand=contract&fields=id,contract.id,contract.properties').json()
+        contract = data['results'][0]['contract']
+        self.assertEqual(set(contract), {'id', 'properties'})
+        self.assertTrue(all(isinstance(pk, int) for pk in contract['properties']))
+
+
+class PostPaymentTest(TestCase):
+    def setUp(self):
+        self.contract = create_contract()
+        self.fee = Fee.objects.get(contract=self.contract, category='rent')
+
+    def test_posting_payment_uses_fixed_statements(self):
+        # SAVEPOINT、锁定费用并取已付总额、写入支付、更新费用、更新合同余额、RELEASE
+        with self.assertNumQueries(6):
+            post_payment(Payment(fee_id=self.fee.pk, amount=Decimal('1000.00'), payment_method='POS'))
+        self.fee.refresh_from_db()
+        self.contract.refresh_from_db()
+        self.assertTrue(self.fee.is_collected)
+        self.assertEqual(self.fee.payment_method, 'POS')
+        self.assertEqual(self.contract.current_receivable, Decimal('2100.00'))
+
+    def test_partial_payments_settle_on_full_amount(self):
+        post_payment(Payment(fee_id=self.fee.pk, amount=Decimal('400.00'), payment_method='POS'))
+        self.fee.refresh_from_db()
+        self.assertFalse(self.fee.is_collected)
+        with self.assertRaises(ValidationError):
+            post_payment(Payment(fee_id=self.fee.pk, amount=Decimal('700.00'), payment_method='POS'))
+        post_payment(Payment(fee_id=self.fee.pk, amount=Decimal('600.00'), payment_method='POS'))
+        self.fee.refresh_from_db()
+        self.assertTrue(self.fee.is_collected)
+        with self.assertRaises(ValidationError):
+            post_payment(Payment(fee_id=self.fee.pk, amount=Decimal('1.00'), payment_method='POS'))
+
+    def test_deleting_payment_reopens_fee(self):
+        payment = post_payment(Payment(fee_id=self.fee.pk, amount=Decimal('1000.00'), payment_method='POS'))
+        payment.delete()
+        self.fee.refresh_from_db()
+        self.contract.refresh_from_db()
+        self.assertFalse(self.fee.is_collected)
+        self.assertEqual(self.contract.current_receivable, Decimal('3100.00'))
+
+
+class ReceiptTaskTest(TestCase):
+    def setUp(self):
+        contract = create_contract()
+        fee = Fee.objects.get(contract=contract, category='rent')
+        with mock.patch('rental_app.services.queue_payment_receipt') as queue:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.payment = post_payment(Payment(fee=fee, amount=fee.amount, payment_method='POS'))
+        queue.assert_called_once_with(self.payment.pk)
+        self.assertEqual(self.payment.receipt_status, 'pending')
+
+    def test_rendered_receipt_marks_ready(self):
+        media_root = tempfile.mkdtemp()
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+            tmp.write(b'%PDF-1.4')
+        with self.settings(MEDIA_ROOT=media_root), \
+                mock.patch.object(Payment, 'generate_receipt', return_value=tmp.name):
+            generate_payment_receipt.apply(args=[self.payment.pk])
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.receipt_status, 'ready')
+        self.assertTrue(self.payment.receipt.name.endswith('.pdf'))
+        self.assertFalse(os.path.exists(tmp.name))
+
+    def test_failed_render_marked_after_retries(self):
+        with mock.patch.object(Payment, 'generate_receipt', return_value=None):
+            generate_payment_receipt.apply(args=[self.payment.pk], retries=generate_payment_receipt.max_retries)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.receipt_status, 'failed')
+
+
+class PrintReceiptTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('cashier'))
+        contract = create_contract()
+        fee = Fee.objects.get(contract=contract, category='rent')
+        self.payment = Payment.objects.create(fee=fee, amount=fee.amount, payment_method='POS')
+        self.url = f'/api/payments/{self.payment.pk}/print_receipt/'
+
+    def test_reprint_served_from_storage_with_validators(self):
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp()), \
+                mock.patch('rental_app.receipts.render_receipt_pdf', return_value=b'%PDF-1.4') as render:
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4')
+            etag = response['ETag']
+            self.assertFalse(response.has_header('Last-Modified'))
+
+            response = self.client.get(self.url)
+            self.assertEqual(b''.join(response.streaming_content), b'%PDF-1.4')
+
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+        render.assert_called_once()
+
+    def test_tenant_change_and_revert_validated_by_etag(self):
+        tenant = Tenant.objects.filter(pk=self.payment.fee.contract.tenant_id)
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp()), \
+                mock.patch('rental_app.receipts.render_receipt_pdf', return_value=b'%PDF-1.4'):
+            first = self.client.get(self.url)['ETag']
+            tenant.update(first_name='新')
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first)
+            self.assertEqual(response.status_code, 200)
+            second = response['ETag']
+            self.assertNotEqual(second, first)
+
+            # 改回原值后复用第一版文件：旧版本的 ETag 重新匹配，新版本的 ETag 不再匹配
+            tenant.update(first_name=None)
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first).status_code, 304)
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=second)
+            self.assertEqual((response.status_code, response['ETag']), (200, first))
+            # 不发送 Last-Modified，单独的 If-Modified-Since 不会得到 304
+            response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 3600))
+            self.assertEqual(response.status_code, 200)
+
+
+class TenantStatementTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('accountant'))
+        self.first = create_contract()
+        self.second = create_contract(tenant=self.first.tenant, start_date=date(2025, 2, 1), end_date=date(2025, 2, 28))
+        for i, contract in enumerate([self.first, self.second]):
+            contract.properties.add(*[
+                Property.objects.create(house_number=f'S-{i}-{j}', area=Decimal('30.00'), address='五号楼',
+                                        current_value=Decimal('0.00'))
+                for j in range(2)
+            ])
+        fees = {fee.category: fee for fee in self.first.fees.all()}
+        with mock.patch('rental_app.services.queue_payment_receipt'):
+            post_payment(Payment(fee=fees['rent'], amount=Decimal('1000.00'), payment_method='POS'))
+            post_payment(Payment(fee=fees['deposit'], amount=Decimal('500.00'), payment_method='POS'))
+        fees['management_fee'].overdue_status = 'overdue'
+        fees['management_fee'].save()
+        self.url = f'/api/tenants/{self.first.tenant_id}/statement/'
+
+    def test_rollups_and_flat_fees(self):
+        with self.assertNumQueries(5):
+            data = self.client.get(self.url, {'page_size': 4}).json()
+        contracts = {contract['id']: contract for contract in data['contracts']}
+        first, second = contracts[self.first.pk], contracts[self.second.pk]
+        self.assertEqual(
+            (first['fees'], first['billed'], first['paid'], first['outstanding'], first['overdue']),
+            (3, '3100.00', '1500.00', '1600.00', '100.00'))
+        self.assertEqual((second['billed'], second['paid'], second['outstanding']), ('3100.00', '0.00', '3100.00'))
+        self.assertEqual(len(first['properties']), 2)
+        self.assertEqual(data['totals']['outstanding'], '4700.00')
+
+        # 费用明细不再嵌套合同和房源
+        self.assertEqual(len(data['results']), 4)
+        self.assertNotIn('contract', data['results'][0])
+        self.assertIsNotNone(data['next'])
+        rest = self.client.get(data['next']).json()['results']
+        self.assertEqual(len(rest), 2)
+        paid = {fee['id']: fee['paid_amount'] for fee in data['results'] + rest}
+        self.assertEqual(paid[self.first.fees.get(category='deposit').pk], '500.00')
+
+        # 日期过滤同时作用于汇总
+        data = self.client.get(self.url, {'period_from': '2025-02-01'}).json()
+        self.assertEqual({c['id']: c['fees'] for c in data['contracts']}, {self.first.pk: 0, self.second.pk: 2})
+
+
+class NotificationDigestTest(TestCase):
+    def setUp(self):
+        first = create_contract()
+        second = create_contract(tenant=first.tenant)
+        Fee.objects.filter(contract__in=[first, second]).update(overdue_status='overdue')
+        create_contract()  # 另一租户没有逾期费用
+        third = create_contract()
+        Fee.objects.filter(contract=third, category='rent').update(overdue_status='overdue')
+
+    def test_one_digest_per_tenant_in_batches(self):
+        fees = Fee.objects.filter(overdue_status='overdue', is_collected=False)
+        with self.settings(NOTIFICATION_EMAIL_BATCH_SIZE=1), self.assertNumQueries(1):
+            stats = send_fee_digests(fees, "逾期缴费通知", 'emails/overdue_notification.html')
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual((stats['tenants'], stats['fees'], stats['sent'], stats['failed']), (2, 7, 2, 0))
+        self.assertIn('6 笔费用', mail.outbox[0].body)
+
+    @override_settings(NOTIFICATION_CHUNK_SIZE=1)
+    def test_sharded_run_sends_once(self):
+        # 分块和汇总任务在本进程内同步执行
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        self.assertEqual(send_overdue_notifications.apply().get(), {'chunks': 2})
+        # 当天再次触发不会重复发送
+        self.assertEqual(send_overdue_notifications.apply().get(), {'chunks': 0})
+        self.assertEqual(len(mail.outbox), 2)
+        run = NotificationRun.objects.get(kind='overdue')
+        self.assertEqual(run.status, 'completed')
+        self.assertEqual(
+            (run.chunks_total, run.chunks_done, run.tenants, run.fees, run.sent, run.failed), (2, 2, 2, 7, 2, 0))
+
+        # 分块重试时跳过已送达的租户
+        tenant_ids = sorted(run.deliveries.values_list('tenant_id', flat=True))
+        stats = send_notification_chunk(run.pk, tenant_ids[0], tenant_ids[-1])
+        self.assertEqual((stats['tenants'], stats['sent']), (0, 0))
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_send_error_propagates_and_retry_sends_the_rest(self):
+        run, chunks = start_notification_run('overdue', date.today())
+        (first_id, last_id), = chunks
+        failing = Tenant.objects.get(pk=last_id).email
+        send_messages = locmem.EmailBackend.send_messages
+
+        def flaky(backend, messages):
+            if messages[0].to == [failing]:
+                raise smtplib.SMTPServerDisconnected('连接中断')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', flaky), \
+                self.assertRaises(smtplib.SMTPServerDisconnected):
+            send_notification_chunk(run.pk, first_id, last_id)
+        self.assertEqual(list(run.deliveries.values_list('tenant_id', flat=True)), [first_id])
+
+        # 分块任务重试时只发送未送达的租户
+        stats = send_notification_chunk(run.pk, first_id, last_id)
+        self.assertEqual((stats['tenants'], stats['sent']), (1, 1))
+        self.assertEqual([message.to for message in mail.outbox], [[Tenant.objects.get(pk=first_id).email], [failing]])
+        run.refresh_from_db()
+        self.assertEqual((run.tenants, run.sent, run.failed, run.chunks_done), (2, 2, 0, 1))
+
+
+class NotificationJobTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('frontdesk'))
+        self.tenants = []
+        for i, address in enumerate(['二号楼 101', '二号楼 102', '三号楼 201']):
+            contract = create_contract()
+            contract.properties.add(Property.objects.create(
+                house_number=f'N-{i}', area=Decimal('50.00'), address=address, current_value=Decimal('0.00')))
+            self.tenants.append(contract.tenant)
+        self.paid = create_contract().tenant
+        Fee.objects.filter(contract__tenant=self.paid).update(is_collected=True)
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+    def test_notification_queued_and_tracked(self):
+        url = f'/api/tenants/{self.tenants[0].pk}/send_notification/'
+        with mock.patch('rental_app.views.queue_notification_job') as queue, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        queue.assert_called_once_with(job_id)
+        # 请求内不发送邮件
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(self.client.get(response['Location']).json()['status'], 'queued')
+
+        dispatch_notification_job.apply(args=[job_id])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [self.tenants[0].email])
+        job = self.client.get(f'/api/notification-jobs/{job_id}/').json()
+        self.assertEqual((job['kind'], job['status'], job['sent'], job['chunks_done']), ('unpaid', 'completed', 1, 1))
+
+        response = self.client.post(f'/api/tenants/{self.paid.pk}/send_notification/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_by_building_and_ids(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/tenants/send_notifications/', {
+                'address': '二号楼', 'tenant_ids': [self.tenants[2].pk, self.paid.pk],
+            }, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['tenants'], 3)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), sorted(t.email for t in self.tenants))
+        self.assertEqual(NotificationRun.objects.get().status, 'completed')
+
+        self.assertEqual(self.client.post('/api/tenants/send_notifications/', {}, format='json').status_code, 400)
+
+
+class FeeScheduleTest(TestCase):
+    def test_schedule_skips_free_periods(self):
+        # 装修期 20 天 + 免租期 25 天，2025-01、2025-02-14 之前不计费；2 月 28 天中计费 14 天，按半月折算
+        contract = create_contract(end_date=date(2025, 6, 30), decoration_period=20, rent_free_period=25)
+        rents = dict(contract.fees.filter(category='rent').order_by('term').values_list('term', 'amount'))
+        self.assertEqual(list(rents), ['2025-02', '2025-03', '2025-04', '2025-05', '2025-06'])
+        self.assertEqual(rents['2025-02'], Decimal('500.00'))
+        self.assertEqual(rents['2025-03'], Decimal('1000.00'))
+        management = contract.fees.get(category='management_fee', term='2025-02')
+        self.assertEqual(management.amount, Decimal('50.00'))
+        self.assertEqual(management.due_date, date(2025, 2, 1))
+        self.assertEqual(contract.current_receivable, Decimal('6950.00'))
+
+        # 合同月中开始与免租期月中结束按同一规则折算：1 月 22 日起计费 10/31，免租 3 天后计费 7/31；
+        # 月中结束的最后一个月按整月计费
+        contract = create_contract(start_date=date(2025, 1, 22), end_date=date(2025, 2, 10))
+        rents = dict(contract.fees.filter(category='rent').values_list('term', 'amount'))
+        self.assertEqual(rents, {'2025-01': Decimal('322.58'), '2025-02': Decimal('1000.00')})
+        contract = create_contract(start_date=date(2025, 1, 22), end_date=date(2025, 2, 28), rent_free_period=3)
+        rents = dict(contract.fees.filter(category='rent').values_list('term', 'amount'))
+        self.assertEqual(rents, {'2025-01': Decimal('225.81'), '2025-02': Decimal('1000.00')})
+
+    def test_backfill_is_idempotent(self):
+        contract = create_contract(end_date=date(2025, 3, 31))
+        Fee.objects.filter(contract=contract, term='2025-02').delete()
+        out = StringIO()
+        call_command('generate_fee_schedules', stdout=out)
+        self.assertIn('新建费用 2 条', out.getvalue())
+        call_command('generate_fee_schedules', stdout=out)
+        self.assertIn('新建费用 0 条', out.getvalue())
+        contract.refresh_from_db()
+        self.assertEqual(contract.fees.count(), 7)
+        self.assertEqual(contract.current_receivable, Decimal('5300.00'))
+
+    def test_backfill_converts_placeholder_rent(self):
+        # 旧版本建合同时的费用：保证金、首月物业费和一条 term 为 '每月' 的租金占位
+        legacy = create_contract(end_date=date(2025, 3, 31))
+        Fee.objects.filter(contract=legacy).exclude(category='deposit').delete()
+        Fee.objects.create(contract=legacy, category='management_fee', amount=Decimal('100.00'), term='2025-01')
+        placeholder = Fee.objects.create(contract=legacy, category='rent', amount=Decimal('1000.00'), term='每月')
+        # 首月租金已存在时，未收取的占位费用直接删除
+        duplicated = create_contract(end_date=date(2025, 3, 31))
+        Fee.objects.create(contract=duplicated, category='rent', amount=Decimal('1000.00'), term='每月')
+
+        call_command('generate_fee_schedules', stdout=StringIO())
+        for contract in (legacy, duplicated):
+            contract.refresh_from_db()
+            rents = contract.fees.filter(category='rent')
+            self.assertEqual(sorted(rents.values_list('term', flat=True)), ['2025-01', '2025-02', '2025-03'])
+            self.assertEqual(rents.aggregate(total=Sum('amount'))['total'], Decimal('3000.00'))
+            self.assertEqual(contract.current_receivable, Decimal('5300.00'))
+        placeholder.refresh_from_db()
+        self.assertEqual((placeholder.term, placeholder.due_date), ('2025-01', date(2025, 1, 1)))
+
+
+
+class FeePeriodTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('clerk'))
+        self.contract = create_contract(end_date=date(2025, 2, 28), rent_collection_time=date(2025, 1, 31))
+
+    def test_period_and_due_dates(self):
+        dates = set(self.contract.fees.values_list('term', 'period_start', 'due_date'))
+        self.assertIn(('2025-02', date(2025, 2, 1), date(2025, 2, 28)), dates)
+        self.assertIn(('一次性', None, date(2025, 1, 31)), dates)
+
+        # 收租日未变化时保存合同不重算
+        with mock.patch('rental_app.periods.refresh_fee_dates') as refresh:
+            self.contract.monthly_rent = Decimal('1200.00')
+            self.contract.save()
+            Contract.objects.get(pk=self.contract.pk).save()
+        refresh.assert_not_called()
+
+        # 收租日变化后重算到期日，已正确的费用不重写
+        self.contract.rent_collection_time = date(2025, 1, 10)
+        self.contract.save()
+        self.assertEqual(refresh_fee_dates([self.contract.pk]), 0)
+        fee = self.contract.fees.get(category='rent', term='2025-02')
+        self.assertEqual(fee.due_date, date(2025, 2, 10))
+        fee.term = '2025-03'
+        fee.save(update_fields=['term'])
+        fee.refresh_from_db()
+        self.assertEqual((fee.period_start, fee.due_date), (date(2025, 3, 1), date(2025, 3, 10)))
+
+    def test_filter_by_date_range(self):
+        data = self.client.get('/api/fees/?period_from=2025-02-01&period_to=2025-02-28').json()
+        self.assertEqual({row['term'] for row in data['results']}, {'2025-02'})
+        data = self.client.get('/api/payments/receivables/?due_to=2025-01-31').json()
+        self.assertEqual(len(data['results']), 3)
+        response = self.client.get('/api/fees/?period_from=2025-02')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('period_from', response.json())
+
+class OverdueSweepTest(TestCase):
+    def setUp(self):
+        self.contract = create_contract(
+            end_date=date(2025, 2, 28), rent_collection_time=date(2025, 1, 31))
+        self.paid = Fee.objects.get(contract=self.contract, category='rent', term='2025-01')
+        post_payment(Payment(fee=self.paid, amount=self.paid.amount, payment_method='POS'))
+
+    def test_marks_due_fees_and_updates_balances_in_one_statement(self):
+        with self.assertNumQueries(3):  # SAVEPOINT、标记并更新余额、RELEASE
+            stats = mark_overdue_fees(as_of=date(2025, 2, 1))
+        # 一月物业费和保证金到期；二月费用按月末（28 日）到期
+        self.assertEqual((stats['fees'], stats['contracts']), (2, 1))
+        overdue = set(Fee.objects.filter(overdue_status='overdue').values_list('category', 'term'))
+        self.assertEqual(overdue, {('management_fee', '2025-01'), ('deposit', '一次性')})
+
+        self.contract.refresh_from_db()
+        self.assertEqual(self.contract.current_outstanding, Decimal('2100.00'))
+        self.assertEqual(self.contract.total_overdue, Decimal('2100.00'))
+        self.assertFalse(list(find_balance_drift()))
+
+        self.assertEqual(mark_overdue_fees(as_of=date(2025, 2, 1))['fees'], 0)
+        self.assertEqual(mark_overdue_fees(as_of=date(2025, 3, 1))['fees'], 2)
+
+
+class IndexBenchmarkTest(TestCase):
+    def test_compares_plans_and_rolls_back(self):
+        out = StringIO()
+        call_command('benchmark_indexes', '--seed-contracts', '20', '--months', '6', stdout=out)
+        self.assertIn('缴费通知 所属期', out.getvalue())
+        self.assertIn('有索引', out.getvalue())
+        self.assertFalse(Tenant.objects.filter(email__startswith='bench-').exists())
+        # 删除的索引随事务回滚恢复
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s', [Fee._meta.db_table])
+            self.assertIn('fee_period_start_idx', {row[0] for row in cursor.fetchall()})
+
+
+class AgingReportTest(TestCase):
+    def setUp(self):
+        self.old = create_contract()  # 费用 1 月 1 日到期
+        self.old.properties.add(Property.objects.create(
+            house_number='A-101', area=Decimal('50.00'), address='一号楼', current_value=Decimal('0.00')))
+        # 3 月费用 3 月 20 日到期；4 月所属期未开始，不计入
+        self.new = create_contract(
+            start_date=date(2025, 3, 1), end_date=date(2025, 4, 30), rent_collection_time=date(2025, 3, 20))
+        rent = Fee.objects.get(contract=self.old, category='rent')
+        with mock.patch('rental_app.services.queue_payment_receipt'):
+            post_payment(Payment(fee=rent, amount=rent.amount, payment_method='POS'))
+
+    def test_buckets_in_one_query(self):
+        with self.assertNumQueries(1):
+            report = build_aging_report(date(2025, 3, 15))
+        # 支付发生在 as_of 之后，截至 3 月 15 日租金仍未收
+        self.assertEqual(report['total']['61-90'], Decimal('3100.00'))
+        self.assertEqual(report['total']['current'], Decimal('3100.00'))
+        self.assertEqual(report['total']['total'], Decimal('6200.00'))
+        self.assertEqual(len(report['by_tenant']), 2)
+        self.assertEqual(report['by_property'][0]['label'], 'A-101')
+        categories = {entry['id']: entry['total'] for entry in report['by_category']}
+        self.assertEqual(categories['rent'], Decimal('2000.00'))
+
+        report = build_aging_report(date.today(), tenant_id=self.old.tenant_id)
+        self.assertEqual(report['total']['90+'], Decimal('2100.00'))
+        self.assertEqual([entry['id'] for entry in report['by_tenant']], [self.old.tenant_id])
+
+    def test_endpoint_validates_params(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('finance'))
+        data = client.get(f'/api/aging-report/?as_of=2025-03-15&contract={self.new.id}').json()
+        self.assertEqual(data['total']['current'], 3100.0)
+        self.assertEqual(client.get('/api/aging-report/?as_of=2025-3').status_code, 400)
+        self.assertEqual(client.get('/api/aging-report/?tenant=x').status_code, 400)
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('clerk'))
+        self.contract = create_contract(end_date=date(2025, 2, 28))
+
+    def test_streams_csv_with_list_filters(self):
+        response = self.client.get('/api/fees/export/?period_from=2025-02-01')
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['ID', '合同ID', '租户邮箱'])
+        self.assertEqual(len(lines), 3)  # 表头 + 二月租金、物业费
+        self.assertTrue(all(',2025-02,' in line for line in lines[1:]))
+        self.assertEqual(self.client.get('/api/fees/export/?file_format=pdf').status_code, 400)
+
+    def test_xlsx_and_command(self):
+        from openpyxl import load_workbook
+        response = self.client.get('/api/contracts/export/?file_format=xlsx')
+        sheet = load_workbook(BytesIO(b''.join(response.streaming_content))).active
+        self.assertEqual([row[0] for row in sheet.iter_rows(min_row=2, values_only=True)], [self.contract.id])
+
+        out = StringIO()
+        call_command('export_data', 'tenants', stdout=out)
+        self.assertIn(self.contract.tenant.email, out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('export_data', 'fees', '--filter', 'due_to=2025-02', stdout=out)
+
+
+class BulkImportTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('clerk'))
+
+    def test_tenant_csv_with_errors_and_dry_run(self):
+        Tenant.objects.create(email='old@example.com')
+        body = 'email,first_name\na@example.com,甲\nold@example.com,乙\nbad-email,丙\na@example.com,丁\n'
+        response = self.client.post(
+            '/api/tenants/import/?dry_run=1', body, content_type='text/csv')
+        report = response.json()
+        self.assertEqual((report['rows'], report['created']), (4, 1))
+        self.assertEqual([error['line'] for error in report['errors']], [3, 4, 5])
+        self.assertFalse(Tenant.objects.filter(email='a@example.com').exists())
+
+        response = self.client.post('/api/tenants/import/', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Tenant.objects.filter(email='a@example.com', first_name='甲').exists())
+
+        # 没有写入任何行时不返回 201
+        response = self.client.post('/api/tenants/import/', body, content_type='text/csv')
+        self.assertEqual((response.status_code, response.json()['created']), (200, 0))
+
+    def test_gbk_file_and_undecodable_file(self):
+        body = 'email,first_name\ngbk@example.com,张三\n'.encode('gbk')
+        upload = SimpleUploadedFile('tenants.csv', body, content_type='text/csv')
+        response = self.client.post('/api/tenants/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Tenant.objects.get(email='gbk@example.com').first_name, '张三')
+
+        response = self.client.post('/api/tenants/import/', b'email\n\xff\xfe\x80@example.com\n', content_type='text/csv')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.json())
+
+    def test_contracts_are_inserted_set_based(self):
+        tenant = Tenant.objects.create(email='owner@example.com')
+        Property.objects.bulk_create([
+            Property(house_number=f'B-{i}', area=Decimal('50.00'), address='二号楼', current_value=Decimal('0.00'))
+            for i in range(50)
+        ])
+        # B-0 上已有 3 月至 6 月的有效合同
+        create_contract(tenant=tenant, start_date=date(2025, 3, 1), end_date=date(2025, 6, 30)).properties.add(
+            Property.objects.get(house_number='B-0'))
+        row = {
+            'tenant_email': tenant.email, 'start_date': '2025-01-01', 'end_date': '2025-03-31',
+            'monthly_rent': '1000', 'yearly_rent': '12000', 'total_rent': '3000', 'rental_area': '50',
+            'rental_unit_price': '20', 'rent_collection_time': '2025-01-05', 'deposit_amount': '500',
+        }
+        lines = [json.dumps({**row, 'house_numbers': [f'B-{i}']}) for i in range(49)]
+        # 已过期的合同不占用房源
+        lines.append(json.dumps({**row, 'house_numbers': ['B-49'], 'status': 'expired'}))
+        lines.append(json.dumps({**row, 'tenant_email': 'nobody@example.com', 'house_numbers': 'B-1'}))
+        # 文件内同一房源：与前面的行租期不重叠的可以导入，重叠的拒绝
+        lines.append(json.dumps({**row, 'house_numbers': ['B-48'], 'start_date': '2025-04-01', 'end_date': '2025-06-30'}))
+        lines.append(json.dumps({**row, 'house_numbers': ['B-47'], 'start_date': '2025-03-31', 'end_date': '2025-04-30'}))
+        # 查租户、查房源、查房源租期、插入合同、COPY 房源关系、更新房源状态、COPY 费用、重算余额，外加 SAVEPOINT/RELEASE
+        with self.assertNumQueries(10):
+            report = self.client.post(
+                '/api/contracts/import/?file_format=jsonl', '\n'.join(lines),
+                content_type='application/x-ndjson').json()
+        self.assertEqual((report['created'], report['fees']), (50, 50 * 4))
+        self.assertEqual([error['line'] for error in report['errors']], [1, 51, 53])
+        self.assertIn('tenant_email', report['errors'][1]['errors'])
+        self.assertIn('house_numbers', report['errors'][2]['errors'])
+        self.assertEqual(Property.objects.filter(rental_status='rented').count(), 49)
+        self.assertEqual(Property.objects.get(house_number='B-49').rental_status, 'available')
+        self.assertEqual(tenant.contracts.get(properties__house_number='B-1').current_receivable, Decimal('3500.00'))
+        self.assertFalse(list(find_balance_drift()))
+
+    def test_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('house_number,area,address,current_value\nC-1,30,三号楼,0\nC-2,abc,三号楼,0\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_data', 'properties', f.name, stdout=out, stderr=err)
+        os.unlink(f.name)
+        self.assertIn('导入 1 行', out.getvalue())
+        self.assertIn('第 3 行', err.getvalue())
+
+
+class PropertyOccupancyTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('clerk'))
+        self.tenant = Tenant.objects.create(email='occupant@example.com')
+        Property.objects.bulk_create([
+            Property(house_number=f'D-{i}', area=Decimal('20.00'), address='四号楼', current_value=Decimal('0.00'))
+            for i in range(100)
+        ])
+        ids = list(Property.objects.order_by('id').values_list('id', flat=True))
+        self.first, self.second = ids[:50], ids[50:]
+
+    def statuses(self, ids):
+        return set(Property.objects.filter(id__in=ids).values_list('rental_status', flat=True))
+
+    def test_create_update_delete_with_50_units(self):
+        payload = {
+            'tenant_id': self.tenant.id, 'property_ids': self.first,
+            'start_date': '2025-01-01', 'end_date': '2025-12-31', 'monthly_rent': '1000',
+            'yearly_rent': '12000', 'total_rent': '12000', 'rental_area': '1000',
+            'rental_unit_price': '1', 'rent_collection_time': '2025-01-05',
+        }
+        # 查询次数与房源数量无关：房源一次 IN 查询取回，状态变化、租期同步各只有一条 UPDATE
+        with self.assertNumQueries(18):
+            response = self.client.post('/api/contracts/', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.statuses(self.first), {'rented'})
+        contract_id = response.json()['id']
+
+        # 保留前 25 个房源，换入 25 个新房源
+        kept = self.first[:25] + self.second[:25]
+        with self.assertNumQueries(15):
+            response = self.client.patch(f'/api/contracts/{contract_id}/', {'property_ids': kept}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.statuses(self.first[25:]), {'available'})
+        self.assertEqual(self.statuses(kept), {'rented'})
+
+        with self.assertNumQueries(8):
+            self.client.delete(f'/api/contracts/{contract_id}/')
+        self.assertEqual(self.statuses(self.first + self.second), {'available'})
+
+    def test_property_ids_validated_and_coerced(self):
+        payload = {
+            'tenant_id': self.tenant.id,
+            'start_date': '2025-01-01', 'end_date': '2025-12-31', 'monthly_rent': '1000',
+            'yearly_rent': '12000', 'total_rent': '12000', 'rental_area': '1000',
+            'rental_unit_price': '1', 'rent_collection_time': '2025-01-05',
+        }
+        for bad in ([{'id': self.first[0]}], [[self.first[0]]], [True], ['abc']):
+            response = self.client.post('/api/contracts/', {**payload, 'property_ids': bad}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('property_ids', response.json())
+        # '05' 与 5 是同一主键，重复的只关联一次
+        pk = self.first[0]
+        response = self.client.post(
+            '/api/contracts/', {**payload, 'property_ids': [pk, f'0{pk}', str(pk)]}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(Contract.objects.get(pk=response.json()['id']).properties.values_list('id', flat=True)), [pk])
+
+
+class RevenueForecastTest(TestCase):
+    def setUp(self):
+        # 免租 45 天：1 月整月免租，2 月 15 日起计费（2 月折半）
+        self.paid = create_contract(end_date=date(2025, 12, 31), rent_free_period=45,
+                                    promotion_fee=Decimal('50.00'))
+        self.half = create_contract(start_date=date(2025, 3, 1), end_date=date(2025, 5, 31),
+                                    monthly_rent=Decimal('2000.00'), management_fee=Decimal('0.00'))
+        self.new = create_contract(start_date=date(2025, 4, 1), end_date=date(2025, 6, 15),
+                                   monthly_rent=Decimal('500.00'), management_fee=Decimal('0.00'))
+        create_contract(end_date=date(2025, 12, 31), status='terminated')
+        with mock.patch('rental_app.signals.queue_payment_receipt'):
+            for fee in Fee.objects.filter(contract=self.paid, due_date__lt=date(2025, 4, 1)).exclude(category='deposit'):
+                Payment.objects.create(fee=fee, amount=fee.amount, payment_method='POS')
+            fee = Fee.objects.get(contract=self.half, category='rent', term='2025-03')
+            Payment.objects.create(fee=fee, amount=Decimal('1000.00'), payment_method='POS')
+
+    def test_projection_uses_schedule_and_collection_history(self):
+        with self.assertNumQueries(1):
+            forecast = build_revenue_forecast(3, date(2025, 4, 1), as_of=date(2025, 4, 1))
+        self.assertEqual(forecast['contracts'], 3)
+        # 历史窗口内应收 1650 + 2000，已付 1650 + 1000；没有历史的合同按整体回收率
+        self.assertEqual(forecast['collection_rate'], 72.6)
+        rows = {row['month']: row for row in forecast['results']}
+        self.assertEqual(list(rows), ['2025-04', '2025-05', '2025-06'])
+        self.assertEqual(rows['2025-04']['contracts'], 3)
+        self.assertEqual(rows['2025-04']['rent'], Decimal('3500.00'))
+        self.assertEqual(rows['2025-04']['promotion_fee'], Decimal('50.00'))
+        self.assertEqual(rows['2025-04']['billed'], Decimal('3600.00'))
+        self.assertEqual(rows['2025-04']['expected_collected'], Decimal('2463.01'))
+        self.assertEqual(rows['2025-06']['billed'], Decimal('1600.00'))
+        self.assertEqual(rows['2025-06']['expected_collected'], Decimal('1463.01'))
+        self.assertEqual(forecast['totals']['billed'], Decimal('8800.00'))
+
+        # 按月计费与费用计划生成的租金和物业费一致，包括月中开始（有无免租期）的合同
+        mid_month = [
+            create_contract(start_date=date(2025, 7, 22), end_date=date(2025, 9, 10)),
+            create_contract(start_date=date(2025, 7, 22), end_date=date(2025, 9, 30), rent_free_period=3),
+        ]
+        forecast = build_revenue_forecast(12, date(2025, 1, 1), as_of=date(2025, 4, 1))
+        scheduled = {}
+        for contract in (self.paid, self.half, self.new, *mid_month):
+            for _, amount, term, _, _ in schedule_rows(contract):
+                scheduled[term] = scheduled.get(term, Decimal('0.00')) + amount
+        self.assertEqual({row['month']: row['billed'] for row in forecast['results'] if row['billed']}, scheduled)
+
+    def test_endpoint_validates_params(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user('planner'))
+        data = client.get('/api/revenue-forecast/?months=24&start=2025-04').json()
+        self.assertEqual(data['start'], '2025-04')
+        self.assertEqual(len(data['results']), 24)
+        self.assertEqual(client.get('/api/revenue-forecast/?months=0').status_code, 400)
+        self.assertEqual(client.get('/api/revenue-forecast/?months=121').status_code, 400)
+        self.assertEqual(client.get('/api/revenue-forecast/?start=2025-13').status_code, 400)
+
+        out = StringIO()
+        call_command('forecast_revenue', '--months', '2', '--start', '2025-04', stdout=out)
+        self.assertIn('2025-05', out.getvalue())
+
+
+class AvailabilitySearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('leasing'))
+        self.tenant = Tenant.objects.create(email='lessee@example.com')
+        self.units = {
+            name: Property.objects.create(house_number=name, area=Decimal(area), address=address,
+                                          current_value=Decimal('0.00'), rental_status=status)
+            for name, area, address, status in [
+                ('L-1', '80.00', '六号楼 101', 'available'),
+                ('L-2', '40.00', '六号楼 102', 'available'),
+                ('L-3', '80.00', '七号楼 201', 'available'),
+                ('L-4', '80.00', '六号楼 103', 'maintenance'),
+            ]
+        }
+        self.contract_id = self.lease('L-1', '2025-01-01', '2025-06-30').json()['id']
+
+    def lease(self, unit, start, end):
+        return self.client.post('/api/contracts/', {
+            'tenant_id': self.tenant.id, 'property_ids': [self.units[unit].id],
+            'start_date': start, 'end_date': end, 'monthly_rent': '1000', 'yearly_rent': '12000',
+            'total_rent': '6000', 'rental_area': '80', 'rental_unit_price': '12.5', 'rent_collection_time': start,
+        }, format='json')
+
+    def search(self, **params):
+        response = self.client.get('/api/properties/availability/', params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(unit['house_number'] for unit in response.json()['results'])
+
+    def test_search_by_dates_area_and_address(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.search(start='2025-03-01', end='2025-09-30'), ['L-2', 'L-3'])
+        self.assertEqual(self.search(start='2025-07-01', end='2025-12-31'), ['L-1', 'L-2', 'L-3'])
+        self.assertEqual(self.search(start='2025-03-01', end='2025-09-30', min_area='50'), ['L-3'])
+        self.assertEqual(self.search(start='2025-03-01', end='2025-09-30', address='六号楼'), ['L-2'])
+        response = self.client.get('/api/properties/availability/', {'start': '2025-09-30', 'end': '2025-03-01'})
+        self.assertEqual(response.status_code, 400)
+
+        # 终止的合同不再占用房源
+        contract = Contract.objects.get(pk=self.contract_id)
+        contract.status = 'terminated'
+        contract.save()
+        self.assertEqual(self.search(start='2025-03-01', end='2025-09-30'), ['L-1', 'L-2', 'L-3'])
+
+    def test_double_booking_rejected(self):
+        response = self.lease('L-1', '2025-06-30', '2025-12-31')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('property_ids', response.json())
+        self.assertEqual(Contract.objects.count(), 1)
+        self.assertEqual(self.lease('L-1', '2025-07-01', '2025-12-31').status_code, 201)
+
+        # 绕过接口直接关联时由数据库的排他约束拒绝
+        other = create_contract(tenant=self.tenant, start_date=date(2025, 3, 1), end_date=date(2025, 3, 31))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            other.properties.add(self.units['L-1'])
+
+
+    def test_unit_released_only_without_other_active_lease(self):
+        later = Contract.objects.get(pk=self.lease('L-1', '2025-07-01', '2025-12-31').json()['id'])
+        Contract.objects.get(pk=self.contract_id).delete()
+        self.units['L-1'].refresh_from_db()
+        self.assertEqual(self.units['L-1'].rental_status, 'rented')
+
+        later.status = 'terminated'
+        later.save()
+        self.units['L-1'].refresh_from_db()
+        self.assertEqual(self.units['L-1'].rental_status, 'available')
+
+
+class PaymentReconciliationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('accountant'))
+        self.first, self.second = create_contract(), create_contract()
+        self.rent = Fee.objects.get(contract=self.first, category='rent')
+        self.deposit = Fee.objects.get(contract=self.first, category='deposit')
+        self.management = Fee.objects.get(contract=self.second, category='management_fee')
+        self.entries = [
+            {'fee_id': self.rent.pk, 'amount': '400', 'reference': 'R1'},
+            {'fee_id': self.rent.pk, 'amount': '600', 'reference': 'R2'},
+            {'fee_id': self.rent.pk, 'amount': '1', 'reference': 'R3'},
+            {'fee_id': self.management.pk, 'amount': '100', 'reference': 'R1'},
+            {'fee_id': self.management.pk, 'amount': '100', 'reference': 'R4', 'payment_method': 'wechat'},
+            {'fee_id': 999999, 'amount': '100'},
+            {'fee_id': self.deposit.pk, 'amount': 'abc'},
+            {'fee_id': self.deposit.pk, 'amount': '5000'},
+        ]
+
+    def test_batch_posts_valid_lines(self):
+        # SAVEPOINT、锁定费用、流水号查重、保存点内写入支付、两种支付方式各一条费用 UPDATE、
+        # 两个合同各一条余额 UPDATE、RELEASE
+        with mock.patch('rental_app.reconciliation.queue_payment_receipts') as queue, \
+                self.captureOnCommitCallbacks(execute=True), \
+                self.assertNumQueries(11):
+            response = self.client.post('/api/payments/reconcile/', {'entries': self.entries}, format='json')
+        self.assertEqual(response.status_code, 201)
+        report = response.json()
+        self.assertEqual((report['posted'], report['rejected']), (3, 5))
+        self.assertEqual(
+            [result['status'] for result in report['results']],
+            ['posted', 'posted', 'rejected', 'rejected', 'posted', 'rejected', 'rejected', 'rejected'],
+        )
+        self.assertIn('reference', report['results'][3]['errors'])
+        # 分两笔结清的租金：第一行记入后仍未结清
+        self.assertEqual([report['results'][i]['fee_collected'] for i in (0, 1, 4)], [False, True, True])
+        self.assertIn('fee_id', report['results'][5]['errors'])
+        queue.assert_called_once_with([report['results'][i]['payment_id'] for i in (0, 1, 4)])
+
+        self.rent.refresh_from_db()
+        self.management.refresh_from_db()
+        self.assertTrue(self.rent.is_collected)
+        self.assertEqual(self.management.payment_method, 'wechat')
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.current_receivable, Decimal('2100.00'))
+        self.assertFalse(find_balance_drift().exists())
+
+        # 同一流水再次导入被拒绝，单笔接口同样查重
+        response = self.client.post('/api/payments/reconcile/', {'entries': self.entries[:1]}, format='json')
+        self.assertEqual(response.json()['results'][0]['status'], 'rejected')
+        with self.assertRaises(ValidationError):
+            post_payment(Payment(fee=self.deposit, amount=Decimal('1.00'), payment_method='POS', reference='R4'))
+
+    def test_concurrent_duplicate_reference(self):
+        # 查重之后另一事务写入了相同流水号：唯一约束报错转为 400，整批不写入
+        Payment.objects.create(fee=self.deposit, amount=Decimal('1.00'), payment_method='POS', reference='R1')
+        with mock.patch('rental_app.reconciliation.taken_references', return_value=set()):
+            response = self.client.post('/api/payments/reconcile/', {'entries': self.entries[:2]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('reference', response.json())
+        self.assertEqual(Payment.objects.count(), 1)
+
+        with mock.patch('rental_app.services.taken_references', return_value=set()), \
+                self.assertRaises(ValidationError):
+            post_payment(Payment(fee=self.rent, amount=Decimal('1.00'), payment_method='POS', reference='R1'))
+        self.assertEqual(Payment.objects.count(), 1)
+
+    def test_dry_run_writes_nothing(self):
+        response = self.client.post(
+            '/api/payments/reconcile/', {'entries': self.entries, 'dry_run': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['posted'], 3)
+        self.assertFalse(Payment.objects.exists())
+        self.rent.refresh_from_db()
+        self.assertFalse(self.rent.is_collected)
+
+
+class RequestMetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('operator'))
+        create_contract()
+
+    def test_requests_and_tasks_reported(self):
+        self.client.get('/api/fees/')
+        b''.join(self.client.get('/api/fees/export/').streaming_content)
+        with mock.patch('rental_app.tasks.mark_overdue_fees', return_value={'fees': 3, 'contracts': 1, 'duration': 0.5}):
+            mark_overdue_fees_task.apply()
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], METRICS_CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn('rental_http_requests_total{method="GET",route="fee-list",status="200"} 1', text)
+        self.assertIn('rental_http_request_duration_seconds_bucket{method="GET",route="fee-list",le="+Inf"} 1', text)
+        queries = re.search(r'rental_http_db_queries_total\{method="GET",route="fee-list"\} (\d+)', text)
+        self.assertGreater(int(queries.group(1)), 0)
+        # 流式导出在内容发送完毕后记录字节数
+        exported = re.search(r'rental_http_response_bytes_total\{method="GET",route="fee-export"\} (\d+)', text)
+        self.assertGreater(int(exported.group(1)), 0)
+        self.assertIn(
+            'rental_task_items_total{item="fees",task="rental_app.tasks.mark_overdue_fees_task"} 3', text)
+        self.assertIn(
+            'rental_task_duration_seconds_count{state="SUCCESS",task="rental_app.tasks.mark_overdue_fees_task"} 1',
+            text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_required_when_configured(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+
+class BenchmarkSuiteTest(TestCase):
+    def seed(self, *extra):
+        call_command(
+            'seed_benchmark_data', '--tenants', '3', '--contracts', '6', '--months', '6',
+            '--start', '2025-01-01', *extra, stdout=StringIO(),
+        )
+        return list(Fee.objects.order_by('contract__tenant__email', 'contract_id', 'term', 'category').values_list(
+            'contract__tenant__email', 'category', 'amount', 'term', 'due_date', 'is_collected', 'overdue_status'))
+
+    def test_seed_is_deterministic_and_consistent(self):
+        fees = self.seed()
+        self.assertEqual(len(fees), 6 * (6 * 2 + 1))
+        self.assertEqual(Payment.objects.count(), Fee.objects.filter(is_collected=True).count())
+        self.assertEqual(Property.objects.filter(rental_status='rented', contracts__isnull=False).count(), 6)
+        self.assertFalse(find_balance_drift().exists())
+        with self.assertRaises(CommandError):
+            self.seed()
+        self.assertEqual(self.seed('--clear'), fees)
+
+    def test_clear_after_notification_run(self):
+        self.seed()
+        run = create_notification_job(bench_tenants().values_list('id', flat=True))
+        send_notification_chunk(run.pk, 0, Tenant.objects.order_by('-id').first().id)
+        self.assertEqual(run.deliveries.count(), 3)
+        self.seed('--clear')
+        self.assertEqual(run.recipients.count(), 0)
+        self.assertEqual(run.deliveries.count(), 0)
+
+    def test_fails_on_regression(self):
+        self.seed()
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        cases = ['--case', 'fees-list', '--case', 'payment-create', '--repeat', '1']
+        out = StringIO()
+        call_command('benchmark_endpoints', *cases, '--save-baseline', path, stdout=out)
+        self.assertIn('payment-create', out.getvalue())
+        # 写操作已回滚
+        self.assertEqual(Payment.objects.count(), Fee.objects.filter(is_collected=True).count())
+
+        with open(path) as fileobj:
+            baseline = json.load(fileobj)
+        baseline['fees-list']['queries'] -= 1
+        with open(path, 'w') as fileobj:
+            json.dump(baseline, fileobj)
+        with self.assertRaisesMessage(CommandError, 'fees-list: SQL'):
+            call_command('benchmark_endpoints', *cases, '--baseline', path, stdout=StringIO())
+
+
+class ListCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user('reader'))
+        self.unit = Property.objects.create(
+            house_number='E-1', area=Decimal('30.00'), address='五号楼', current_value=Decimal('0.00'))
+
+    def house_numbers(self, url):
+        return [row['house_number'] for row in self.client.get(url).json()['results']]
+
+    def test_hits_until_invalidated(self):
+        url = '/api/properties/available/'
+        self.assertEqual(self.house_numbers(url), ['E-1'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.house_numbers(url), ['E-1'])
+        # 不同的查询参数分别缓存
+        self.assertEqual(self.client.get(url + '?fields=id').json()['results'], [{'id': self.unit.id}])
+
+        Property.objects.create(
+            house_number='E-2', area=Decimal('30.00'), address='五号楼', current_value=Decimal('0.00'))
+        self.assertEqual(self.house_numbers(url), ['E-2', 'E-1'])
+        # 合同关联房源时状态经 set_rental_status 批量更新，同样使缓存失效
+        create_contract().properties.add(self.unit)
+        self.assertEqual(self.house_numbers(url), ['E-2'])
+
+        counters, _ = collect_metrics()
+        self.assertEqual(
+            counters[('rental_cache_requests_total', (('cache', 'property-available'), ('result', 'hit')))], 1)
+        self.assertEqual(
+            counters[('rental_cache_requests_total', (('cache', 'property-available'), ('result', 'miss')))], 4)
+
+    def test_cold_cache_computed_once(self):
+        # 另一个请求持有锁时，等待其写入结果而不是同时查询数据库
+        build = mock.Mock(return_value=['fresh'])
+        version = namespace_version('properties')
+        key = f"{LIST_CACHE_PREFIX}properties:{version}:property-list:{hashlib.sha1(b'/x').hexdigest()}"
+        cache.add(f'{key}:lock', 1)
+        with mock.patch('rental_app.caching.time.sleep', side_effect=lambda _: cache.set(key, ['cached'])):
+            self.assertEqual(read_through('properties', 'property-list', '/x', build), ['cached'])
+        build.assert_not_called()
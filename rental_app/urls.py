@@ -2,7 +2,8 @@ from django.urls import include, path
 from rest_framework import routers
 from .views import (
     TenantViewSet, PropertyViewSet, ContractViewSet,
-    FeeViewSet, PaymentViewSet, data_analysis
+    FeeViewSet, PaymentViewSet, NotificationJobViewSet, data_analysis, aging_report,
+    revenue_forecast
 )
 
 router = routers.DefaultRouter()
@@ -11,8 +12,11 @@ router.register(r'properties', PropertyViewSet)
 router.register(r'contracts', ContractViewSet)
 router.register(r'fees', FeeViewSet)
 router.register(r'payments', PaymentViewSet)
+router.register(r'notification-jobs', NotificationJobViewSet, basename='notification-job')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('data-analysis/', data_analysis, name='data-analysis'),
+    path('aging-report/', aging_report, name='aging-report'),
+    path('revenue-forecast/', revenue_forecast, name='revenue-forecast'),
 ]
\ No newline at end of file
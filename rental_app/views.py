@@ -3,264 +3,376 @@
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
-from django.db.models import Sum
-from django.core.files import File  # 添加这行导入
-from django.http import FileResponse, HttpResponseServerError
-import os
+from rest_framework.reverse import reverse
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.http import FileResponse, HttpResponse, HttpResponseServerError
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import quote_etag
+import codecs
+import io
 import logging
-import tempfile
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from .models import Tenant, Property, Contract, Fee, Payment
+from decimal import Decimal, InvalidOperation
+from functools import partial
+from .models import Tenant, Property, Contract, Fee, Payment, NotificationRun
+from .aging import build_aging_report
+from .analytics import get_kpi_snapshot
+from .availability import vacant_properties
+from .caching import read_through
+from .exports import EXPORT_FORMATS, export_response
+from .filters import date_param, filter_fee_dates, filter_payments
+from .forecast import MAX_FORECAST_MONTHS, build_revenue_forecast
+from .imports import IMPORT_FORMATS, detect_encoding, run_import
+from .metrics import METRICS_CONTENT_TYPE, collect_metrics, render_metrics
+from .notifications import create_notification_job, unpaid_recipients
+from .periods import term_period_start
+from .receipts import get_printed_receipt
+from .services import paid_total
+from .statements import contract_rollups, empty_rollup, rollup_totals
+from .reconciliation import RECONCILE_MAX_ENTRIES, reconcile_payments
 from .serializers import (
     TenantSerializer, PropertySerializer,
-    ContractSerializer, FeeSerializer, PaymentSerializer
+    ContractSerializer, FeeSerializer, PaymentSerializer,
+    NotificationJobSerializer, NotificationRequestSerializer, StatementContractSerializer,
+    StatementFeeSerializer, StatementTotalsSerializer, plan_related,
 )
-from django.core.mail import send_mail
+from .tasks import queue_notification_job
 from django.conf import settings
 from rest_framework import status  # 添加这行导入
 from rest_framework.exceptions import ValidationError  # 添加这行导入
 
 logger = logging.getLogger(__name__)
 
-class TenantViewSet(viewsets.ModelViewSet):
+class QueryPlanMixin:
+    """按序列化器实际输出的字段（受 ?fields= / ?expand= 影响）自动规划关联查询"""
+
+    def plan_queryset(self, queryset, serializer_class=None):
+        serializer_class = serializer_class or self.get_serializer_class()
+        serializer = serializer_class(context=self.get_serializer_context())
+        select, prefetch = plan_related(serializer)
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    def get_queryset(self):
+        return self.plan_queryset(super().get_queryset())
+
+class CachedListMixin:
+    """
+    列表类接口的读穿缓存：按完整 URL（含 ?fields= / ?cursor= 等参数）缓存序列化结果，
+    数据变化时由信号按 cache_namespace 整体失效
+    """
+    cache_namespace = None
+
+    def cached_response(self, request, build):
+        data = read_through(
+            self.cache_namespace, request.resolver_match.url_name, request.build_absolute_uri(),
+            lambda: build().data,
+        )
+        return Response(data)
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, lambda: super(CachedListMixin, self).list(request, *args, **kwargs))
+
+class ExportMixin:
+    """GET <列表地址>/export/?file_format=csv|xlsx：按列表接口相同的过滤条件流式导出全部数据"""
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            raise ValidationError({'file_format': f"仅支持 {', '.join(EXPORT_FORMATS)}"})
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            return export_response(queryset, file_format)
+        except ImportError:
+            raise ValidationError({'file_format': '服务器未安装 openpyxl，无法导出 XLSX'})
+
+class ImportMixin:
+    """
+    POST <列表地址>/import/?file_format=csv|jsonl[&dry_run=1]：批量导入，
+    数据可作为 multipart 的 file 字段上传，也可直接作为请求体发送
+    """
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        if file_format not in IMPORT_FORMATS:
+            raise ValidationError({'file_format': f"仅支持 {', '.join(IMPORT_FORMATS)}"})
+        if request.content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                raise ValidationError({'file': '请上传文件'})
+        else:
+            upload = io.BytesIO(request.body)
+        encoding = detect_encoding(upload)
+        if encoding is None:
+            raise ValidationError({'file': '文件须为 UTF-8 或 GBK 编码'})
+        lines = codecs.iterdecode(upload, encoding)
+        dry_run = request.query_params.get('dry_run', '').lower() in ('1', 'true', 'yes')
+        report = run_import(self.queryset.model, lines, file_format, dry_run=dry_run)
+        # 没有实际写入任何行（试运行或全部行出错）时不返回 201
+        created = report['created'] and not dry_run
+        return Response(report, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+class TenantViewSet(CachedListMixin, QueryPlanMixin, ExportMixin, ImportMixin, viewsets.ModelViewSet):
     queryset = Tenant.objects.all()
     serializer_class = TenantSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_namespace = 'tenants'
 
     @action(detail=True, methods=['get'])
     def fees(self, request, pk=None):
         """获取指定租户的所有费用清单"""
         tenant = self.get_object()
-        fees = Fee.objects.filter(
+        fees = filter_fee_dates(Fee.objects.filter(
             contract__tenant=tenant
-        ).select_related(
-            'contract'
-        ).order_by(
+        ), request.query_params).order_by(
             '-contract__start_date', 
             'category'
         )
+        fees = self.plan_queryset(fees, FeeSerializer)
         
-        serializer = FeeSerializer(fees, many=True)
+        serializer = FeeSerializer(fees, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def statement(self, request, pk=None):
+        """
+        租户对账单：按合同汇总应收、已付、未结、逾期金额（一条分组查询），合同和房源信息每份合同只出现一次；
+        费用明细按 id 倒序分页，只带合同 id。日期参数与 fees 相同，同时作用于汇总和明细
+        """
+        tenant = self.get_object()
+        fees = filter_fee_dates(Fee.objects.filter(contract__tenant=tenant), request.query_params)
+        rollups = contract_rollups(fees)
+        contracts = list(tenant.contracts.prefetch_related('properties').order_by('-start_date', '-id'))
+        for contract in contracts:
+            contract.rollup = rollups.get(contract.pk) or empty_rollup()
+        page = self.paginator.paginate_queryset(fees.annotate(paid_amount=paid_total()), request, view=self)
+        return Response({
+            'tenant': TenantSerializer(tenant).data,
+            'totals': StatementTotalsSerializer(rollup_totals(rollups.values())).data,
+            'contracts': StatementContractSerializer(contracts, many=True).data,
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
+            'results': StatementFeeSerializer(page, many=True).data,
+        })
+
+    def enqueue_notification(self, request, tenant_ids):
+        """登记提醒任务，提交后交给 Celery 发送，立即返回 202 和任务状态地址"""
+        with transaction.atomic():
+            job = create_notification_job(tenant_ids)
+            transaction.on_commit(partial(queue_notification_job, job.pk))
+        status_url = reverse('notification-job-detail', args=[job.pk], request=request)
+        return Response(
+            {'job_id': job.pk, 'status': job.status, 'tenants': len(tenant_ids), 'status_url': status_url},
+            status=status.HTTP_202_ACCEPTED, headers={'Location': status_url},
+        )
+
     @action(detail=True, methods=['post'])
     def send_notification(self, request, pk=None):
-        """向租户发送未缴费用通知"""
+        """向租户发送未缴费用通知（后台发送，进度见 /api/notification-jobs/{job_id}/）"""
         tenant = self.get_object()
-        unpaid_fees = Fee.objects.filter(
-            contract__tenant=tenant,
-            is_collected=False
-        )
-        
-        if not unpaid_fees.exists():
+        tenant_ids = unpaid_recipients([tenant.pk])
+        if not tenant_ids:
             return Response({
                 "message": "该租户没有未缴费用"
             }, status=400)
+        return self.enqueue_notification(request, tenant_ids)
 
-        # 计算总未付金额
-        total_amount = sum(fee.amount for fee in unpaid_fees)
-        
-        # 发送邮件通知
-        subject = '费用缴纳提醒'
-        message = f"""
-        尊敬的{tenant.first_name} {tenant.last_name}：
-        
-        您目前有 {unpaid_fees.count()} 笔费用尚未支付，总金额：¥{total_amount}。
-        请及时缴纳以下费用：
-        
-        {chr(10).join([f"- {fee.category}: ¥{fee.amount} ({fee.term})" for fee in unpaid_fees])}
-        """
-        
-        try:
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[tenant.email],
-                fail_silently=False,
-            )
-            
-            return Response({
-                "message": f"已成功向租户 {tenant.first_name} {tenant.last_name} 发送费用通知",
-                "unpaid_fees_count": unpaid_fees.count(),
-                "total_amount": total_amount
-            })
-            
-        except Exception as e:
+    @action(detail=False, methods=['post'])
+    def send_notifications(self, request):
+        """批量发送未缴费用通知：{"tenant_ids": [...], "address": "..."}，只通知有未缴费用的租户"""
+        serializer = NotificationRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        tenant_ids = unpaid_recipients(**serializer.validated_data)
+        if not tenant_ids:
             return Response({
-                "message": "发送通知失败",
-                "error": str(e)
-            }, status=500)
+                "message": "所选租户没有未缴费用"
+            }, status=400)
+        return self.enqueue_notification(request, tenant_ids)
 
-class PropertyViewSet(viewsets.ModelViewSet):
+class PropertyViewSet(CachedListMixin, QueryPlanMixin, ImportMixin, viewsets.ModelViewSet):
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
     permission_classes = [permissions.IsAuthenticated]
+    cache_namespace = 'properties'
 
     @action(detail=False, methods=['get'])
     def available(self, request):
-        available_properties = Property.objects.filter(rental_status='available')
+        return self.cached_response(request, self.available_page)
+
+    def available_page(self):
+        available_properties = self.plan_queryset(Property.objects.filter(rental_status='available'))
+        page = self.paginate_queryset(available_properties)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         serializer = self.get_serializer(available_properties, many=True)
         return Response(serializer.data)
 
-class ContractViewSet(viewsets.ModelViewSet):
-    queryset = Contract.objects.all().select_related('tenant').prefetch_related('properties')
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """
+        按日期范围查询空置房源：?start=YYYY-MM-DD&end=YYYY-MM-DD（包含两端），整段期间没有有效合同的房源，
+        可选 ?min_area= 最小面积、?address= 地址关键字；不含维护中的房源，按 id 倒序分页
+        """
+        params = request.query_params
+        start, end = date_param(params, 'start'), date_param(params, 'end')
+        if start is None or end is None:
+            raise ValidationError({'start': '需要 start 和 end 参数'})
+        if start > end:
+            raise ValidationError({'end': '结束日期不能早于开始日期'})
+        min_area = params.get('min_area')
+        if min_area is not None:
+            try:
+                min_area = Decimal(min_area)
+            except InvalidOperation:
+                raise ValidationError({'min_area': '应为数字'})
+        properties = vacant_properties(
+            start, end, min_area=min_area, address=params.get('address'), queryset=self.get_queryset(),
+        )
+        page = self.paginate_queryset(properties)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class ContractViewSet(QueryPlanMixin, ExportMixin, ImportMixin, viewsets.ModelViewSet):
+    queryset = Contract.objects.all()
     serializer_class = ContractSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class FeeViewSet(viewsets.ModelViewSet):
-    queryset = Fee.objects.all().select_related('contract')
+class FeeViewSet(QueryPlanMixin, ExportMixin, viewsets.ModelViewSet):
+    queryset = Fee.objects.all()
     serializer_class = FeeSerializer
     permission_classes = [permissions.IsAuthenticated]
 
-class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.all().select_related('fee__contract')
+    def get_queryset(self):
+        return filter_fee_dates(super().get_queryset(), self.request.query_params)
+
+class PaymentViewSet(QueryPlanMixin, ExportMixin, viewsets.ModelViewSet):
+    queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        queryset = Payment.objects.all().select_related('fee__contract')
-        fee_id = self.request.query_params.get('fee', None)
-        if fee_id is not None:
-            queryset = queryset.filter(fee_id=fee_id)
-        return queryset
+        return filter_payments(super().get_queryset(), self.request.query_params)
 
     @action(detail=False, methods=['get'])
     def receivables(self, request):
-        receivables = Fee.objects.filter(is_collected=False)
-        serializer = FeeSerializer(receivables, many=True)
+        receivables = filter_fee_dates(Fee.objects.filter(is_collected=False), request.query_params)
+        receivables = self.plan_queryset(receivables, FeeSerializer)
+        context = self.get_serializer_context()
+        page = self.paginate_queryset(receivables)
+        if page is not None:
+            serializer = FeeSerializer(page, many=True, context=context)
+            return self.get_paginated_response(serializer.data)
+        serializer = FeeSerializer(receivables, many=True, context=context)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'])
     def payables(self, request):
-        payables = Fee.objects.filter(overdue_status='overdue', is_collected=False)
-        serializer = FeeSerializer(payables, many=True)
+        payables = filter_fee_dates(
+            Fee.objects.filter(overdue_status='overdue', is_collected=False), request.query_params)
+        payables = self.plan_queryset(payables, FeeSerializer)
+        context = self.get_serializer_context()
+        page = self.paginate_queryset(payables)
+        if page is not None:
+            serializer = FeeSerializer(page, many=True, context=context)
+            return self.get_paginated_response(serializer.data)
+        serializer = FeeSerializer(payables, many=True, context=context)
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
     def print_receipt(self, request, pk=None):
+        payment = self.get_object()
         try:
-            payment = self.get_object()
-            
-            # 创建临时文件
-            temp_dir = tempfile.gettempdir()
-            pdf_path = os.path.join(temp_dir, f'receipt_{payment.id}.pdf')
-            
-            # 生成PDF
-            c = canvas.Canvas(pdf_path, pagesize=letter)
-            c.setFont("Helvetica", 12)
-            
-            # 添加收据内容
-            c.drawString(100, 800, f"收据编号: {payment.id}")
-            c.drawString(100, 780, f"日期: {payment.payment_date.strftime('%Y-%m-%d')}")
-            c.drawString(100, 760, f"支付方式: {payment.get_payment_method_display()}")
-            c.drawString(100, 740, f"金额: ¥{payment.amount}")
-            
-            if payment.fee and payment.fee.contract:
-                tenant = payment.fee.contract.tenant
-                c.drawString(100, 720, f"租户: {tenant.first_name} {tenant.last_name}")
-                c.drawString(100, 700, f"费用类型: {payment.fee.get_category_display()}")
-                c.drawString(100, 680, f"所属期限: {payment.fee.term}")
-            
-            c.save()
-            
-            # 返回生成的PDF
-            try:
+            name, digest = get_printed_receipt(payment)
+            etag = quote_etag(digest)
+            # 收据按内容哈希存储，ETag 即内容哈希。不发送 Last-Modified：租户信息改回原值后会复用旧文件，
+            # 按时间判断的 If-Modified-Since 可能把另一版本当作未修改，条件请求只用 If-None-Match
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
                 response = FileResponse(
-                    open(pdf_path, 'rb'),
+                    default_storage.open(name, 'rb'),
                     content_type='application/pdf'
                 )
                 response['Content-Disposition'] = f'attachment; filename="receipt_{payment.id}.pdf"'
-                return response
-            finally:
-                # 确保文件存在才删除
-                if os.path.exists(pdf_path):
-                    os.unlink(pdf_path)
-                    
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            return response
         except Exception as e:
             return HttpResponseServerError(f"生成收据失败: {str(e)}")
 
+    @action(detail=False, methods=['post'])
+    def reconcile(self, request):
+        """
+        批量记入银行流水：{"entries": [{"fee_id", "amount", "payment_method", "reference"}], "dry_run": false}，
+        逐行返回 posted / rejected，出错的行不影响其他行
+        """
+        entries = request.data.get('entries') if isinstance(request.data, dict) else None
+        if not isinstance(entries, list) or not entries:
+            raise ValidationError({'entries': '应为非空列表'})
+        if len(entries) > RECONCILE_MAX_ENTRIES:
+            raise ValidationError({'entries': f'每批最多 {RECONCILE_MAX_ENTRIES} 行'})
+        dry_run = request.data.get('dry_run') in (True, 1, '1', 'true', 'yes')
+        report = reconcile_payments(entries, dry_run=dry_run)
+        return Response(report, status=status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED)
+
     def create(self, request, *args, **kwargs):
-        logger.info(f"Payment request data: {request.data}")
         serializer = self.get_serializer(data=request.data)
         
-        # 检查费用是否已支付
-        fee_id = request.data.get('fee_id')
-        if Payment.objects.filter(fee_id=fee_id).exists():
-            return Response(
-                {'detail': '该费用已支付，请勿重复支付！'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-            
         if not serializer.is_valid():
             logger.error(f"Payment validation errors: {serializer.errors}")
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             
+        # 记账由 services.post_payment 完成，收据在提交后异步生成（receipt_status 可轮询）
         self.perform_create(serializer)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def perform_create(self, serializer):
-        payment = serializer.save()
-        fee = payment.fee
-        
-        # 更新费用状态
-        fee.is_collected = True
-        fee.payment_method = payment.payment_method
-        fee.receipt = payment.receipt
-        
-        # 更新合同相关金额
-        contract = fee.contract
-        contract.current_receivable = contract.fees.filter(
-            is_collected=False).aggregate(total=Sum('amount'))['total'] or 0
-        contract.current_outstanding = contract.fees.filter(
-            is_collected=False, overdue_status='overdue').aggregate(total=Sum('amount'))['total'] or 0
-        contract.total_overdue = contract.fees.filter(
-            overdue_status='overdue').aggregate(total=Sum('amount'))['total'] or 0
-        
-        # 保存更改
-        fee.save()
-        contract.save()
-        
-        # 尝试生成收据
-        try:
-            pdf_path = payment.generate_receipt()
-            if pdf_path:
-                with open(pdf_path, 'rb') as pdf:
-                    payment.receipt.save(
-                        f'receipt_{payment.id}.pdf',
-                        File(pdf),
-                        save=True
-                    )
-                os.unlink(pdf_path)  # 清理临时文件
-        except Exception as e:
-            logger.error(f"保存收据时发生错误: {str(e)}")
-            # 继续执行，不影响支付流程
+class NotificationJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """通知任务的状态和进度：每日通知与前台发起的提醒"""
+    queryset = NotificationRun.objects.all()
+    serializer_class = NotificationJobSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
 @api_view(['GET'])
 def data_analysis(request):
-    receivable_amount = Fee.objects.filter(is_collected=False).aggregate(total=Sum('amount'))['total'] or 0
-    received_amount = Payment.objects.aggregate(total=Sum('amount'))['total'] or 0
-    overdue_amount = Fee.objects.filter(overdue_status='overdue', is_collected=False).aggregate(total=Sum('amount'))['total'] or 0
-    collection_rate = (received_amount / receivable_amount) * 100 if receivable_amount else 0
-
-    total_area = Property.objects.aggregate(total=Sum('area'))['total'] or 0
-    rented_area = Property.objects.filter(rental_status='rented').aggregate(total=Sum('area'))['total'] or 0
-    available_properties = Property.objects.filter(rental_status='available').count()
-    rental_rate = (rented_area / total_area) * 100 if total_area else 0
-
-    data = {
-        'financial': {
-            'receivable_amount': receivable_amount,
-            'received_amount': received_amount,
-            'overdue_amount': overdue_amount,
-            'collection_rate': collection_rate,
-        },
-        'property': {
-            'total_area': total_area,
-            'rented_area': rented_area,
-            'available_properties': available_properties,
-            'rental_rate': rental_rate,
-        }
-    }
-    return Response(data)
\ No newline at end of file
+    # 快照在费用、支付、房源变化后失效，最长缓存 KPI_SNAPSHOT_MAX_AGE 秒
+    return Response(get_kpi_snapshot())
+
+@api_view(['GET'])
+def aging_report(request):
+    """应收账款账龄报表：?as_of=YYYY-MM-DD（默认今天），可选 ?tenant= / ?contract= 过滤"""
+    params = request.query_params
+    filters = {}
+    for param in ('tenant', 'contract'):
+        if param in params:
+            if not params[param].isdigit():
+                raise ValidationError({param: '应为整数ID'})
+            filters[f'{param}_id'] = int(params[param])
+    return Response(build_aging_report(date_param(params, 'as_of'), **filters))
+
+@api_view(['GET'])
+def revenue_forecast(request):
+    """有效合同未来按月的计费和预计回收：?months=（默认 12，最多 120）、?start=YYYY-MM（默认本月）"""
+    params = request.query_params
+    months = params.get('months', '12')
+    if not months.isdigit() or not 1 <= int(months) <= MAX_FORECAST_MONTHS:
+        raise ValidationError({'months': f'应为 1 到 {MAX_FORECAST_MONTHS} 的整数'})
+    start = None
+    if 'start' in params:
+        start = term_period_start(params['start'])
+        if start is None:
+            raise ValidationError({'start': '月份格式应为 YYYY-MM'})
+    return Response(build_revenue_forecast(int(months), start))
+
+def metrics(request):
+    """Prometheus 文本格式的请求、任务指标；设置了 METRICS_TOKEN 时需带 Authorization: Bearer <token>"""
+    token = settings.METRICS_TOKEN
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render_metrics(*collect_metrics()), content_type=METRICS_CONTENT_TYPE)
@@ -27,6 +27,8 @@ INSTALLED_APPS = [
 
 # 中间件
 MIDDLEWARE = [
+    # 放在最外层，耗时包含其他中间件
+    'rental_app.middleware.RequestMetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -111,6 +113,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_PAGINATION_CLASS': 'rental_app.pagination.KeysetPagination',
 }
 
 from datetime import timedelta
@@ -125,6 +128,10 @@ SIMPLE_JWT = {
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
 CELERY_BEAT_SCHEDULE = {
+    'mark-overdue-fees-daily': {
+        'task': 'rental_app.tasks.mark_overdue_fees_task',
+        'schedule': crontab(hour=1, minute=0),
+    },
     'send-payment-notifications-daily': {
         'task': 'rental_app.tasks.send_payment_notifications',
         'schedule': crontab(hour=9, minute=0),
@@ -135,6 +142,36 @@ CELERY_BEAT_SCHEDULE = {
     },
 }
 
+# 费用到期后的宽限天数，超过后由 mark_overdue_fees_task 标记为逾期
+OVERDUE_GRACE_DAYS = 0
+
+# 数据分析 KPI 快照的最长缓存时间（秒），数据变化时会提前失效
+KPI_SNAPSHOT_MAX_AGE = 60
+
+# 缓存：KPI 快照、列表读穿缓存、/metrics 汇总都依赖它。部署时设置 REDIS_CACHE_URL
+# （如 redis://localhost:6379/1，与 Celery 的 0 号库分开）让各进程共享；未设置时使用进程内存
+if os.environ.get('REDIS_CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_CACHE_URL'],
+        }
+    }
+
+# 列表读穿缓存的过期时间（秒），按 URL 名称；数据变化时会提前失效
+LIST_CACHE_TTLS = {
+    'tenant-list': 300,
+    'property-list': 300,
+    'property-available': 60,
+}
+
+# 各进程把请求、任务指标写入缓存的最短间隔（秒），/metrics 汇总所有进程
+METRICS_FLUSH_INTERVAL = 10
+# 设置后访问 /metrics 需带 Authorization: Bearer <token>
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+# benchmark_endpoints 与基线比较时，耗时、峰值内存允许超出的比例
+BENCHMARK_REGRESSION_TOLERANCE = 0.2
+
 # 邮件配置（示例使用SMTP）
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = 'smtp.your_email_provider.com'  # 替换为您的SMTP服务器
@@ -143,6 +180,10 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = 'your_email@example.com'  # 替换为您的邮箱
 EMAIL_HOST_PASSWORD = 'your_email_password'  # 替换为您的邮箱密码或应用专用密码
 DEFAULT_FROM_EMAIL = 'your_email@example.com'
+# 通知邮件每批通过同一连接发送的封数，每批发送后登记一次送达
+NOTIFICATION_EMAIL_BATCH_SIZE = 100
+# 每日通知按租户分块并行发送，每个分块任务负责的租户数
+NOTIFICATION_CHUNK_SIZE = 500
 
 
 